@@ -1,5 +1,13 @@
 #!/bin/bash
-init_firewall.sh - 完整初始化 Captive Portal 防火牆
+# init_firewall.sh - 完整初始化 Captive Portal 防火牆 (iptables 版)
+# 只適用 FIREWALL_BACKEND=mock / 腳本 (login.sh、block_game.sh ...)
+# FIREWALL_BACKEND=nftables / agent 的規則由後端 / 防火牆代理建立 (table inet student_guard)，請改用 init_nftables.sh：
+# 這裡的 FORWARD DROP 與 PREROUTING DNAT 在另一個 base chain，nftables 的放行蓋不過，已授權的學生仍會被擋
+if command -v nft >/dev/null && sudo nft list table inet student_guard >/dev/null 2>&1; then
+    echo "❌ 偵測到 nftables 的 student_guard table，請改用 LSA/init_nftables.sh"
+    exit 1
+fi
+
 echo "🧹 1. 清空舊規則..."
 sudo iptables -F
 sudo iptables -t nat -F
@@ -0,0 +1,19 @@
+#!/bin/bash
+# init_nftables.sh - FIREWALL_BACKEND=nftables / agent 的防火牆前置設定
+# 規則 (DNS、Telegram 白名單、HTTP 導向登入頁、封鎖未授權流量) 都在 table inet student_guard，
+# 由後端 / 防火牆代理啟動時建立；這裡只清掉 iptables 腳本留下、會蓋過 nftables 放行的舊規則
+# 用法: sudo ./init_nftables.sh [學生網段前綴，預設 192.168.10.]
+
+LAN_PREFIX=${1:-192.168.10.}
+
+echo "🧹 清除 iptables 舊規則 (init_firewall.sh / allow_telegram.sh / login.sh / block_game.sh)..."
+# 把學生網段相關的 -A 規則逐條改成 -D 刪除
+for TABLE_CHAIN in "filter FORWARD" "nat PREROUTING"; do
+    set -- $TABLE_CHAIN
+    sudo iptables -t "$1" -S "$2" | grep -F -- "$LAN_PREFIX" | grep '^-A' | while read -r RULE; do
+        sudo iptables -t "$1" ${RULE/-A/-D}
+    done
+done
+sudo iptables -P FORWARD ACCEPT
+
+echo "✅ 完成！啟動後端 (FIREWALL_BACKEND=nftables) 或防火牆代理 (python -m src.network.agent) 會建立 nftables 規則"
@@ -0,0 +1,84 @@
+# benchmarks/bench_domain_matcher.py
+"""
+網域黑名單比對：逐一關鍵字子字串比對 (detect_violation 原本的作法) vs 反轉 label 後綴樹 (DomainMatcher)
+
+- 名單：video / game / social 三個分類，合計 LIST_SIZES 筆隨機網域
+- 查詢：QUERIES 筆，約 HIT_RATIO 是名單網域的子網域 (例如 rr3---sn-xx.<網域>)，其餘是不相干的網域
+- 子字串比對太慢，只跑前 NAIVE_SAMPLE 筆查詢，再換算成每筆查詢的成本
+
+用法 (在專案根目錄)：
+    python -m benchmarks.bench_domain_matcher
+"""
+import random
+import string
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.detection.matcher import DomainMatcher
+
+LIST_SIZES = [1_000, 10_000, 50_000]
+QUERIES = 100_000
+HIT_RATIO = 0.2
+NAIVE_SAMPLE = 200
+CATEGORIES = ["video", "game", "social"]
+TLDS = ["com", "net", "org", "tv", "io", "jp", "com.tw"]
+
+def random_label(rng: random.Random, low: int = 4, high: int = 12) -> str:
+    return "".join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(rng.randint(low, high)))
+
+def make_lists(size: int, rng: random.Random) -> Dict[str, List[str]]:
+    lists: Dict[str, List[str]] = {category: [] for category in CATEGORIES}
+    for i in range(size):
+        lists[CATEGORIES[i % len(CATEGORIES)]].append(f"{random_label(rng)}.{rng.choice(TLDS)}")
+    return lists
+
+def make_queries(lists: Dict[str, List[str]], count: int, rng: random.Random) -> List[str]:
+    domains = [d for entries in lists.values() for d in entries]
+    queries = []
+    for _ in range(count):
+        if rng.random() < HIT_RATIO:
+            queries.append(f"{random_label(rng, 2, 8)}.{rng.choice(domains)}")
+        else:
+            queries.append(f"www.{random_label(rng)}.{rng.choice(TLDS)}")
+    return queries
+
+def naive_match(lists: List[Tuple[str, List[str]]], domain: str) -> Optional[str]:
+    for category, keywords in lists:
+        for kw in keywords:
+            if kw in domain:
+                return category
+    return None
+
+def run(size: int) -> Tuple[float, float, float, int]:
+    rng = random.Random(size)
+    lists = make_lists(size, rng)
+    queries = make_queries(lists, QUERIES, rng)
+
+    start = time.perf_counter()
+    matcher = DomainMatcher()
+    for category, domains in lists.items():
+        matcher.add_all(domains, category)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [matcher.match(q) for q in queries]
+    trie_time = time.perf_counter() - start
+
+    ordered = list(lists.items())
+    sample = queries[:NAIVE_SAMPLE]
+    start = time.perf_counter()
+    naive_results = [naive_match(ordered, q) for q in sample]
+    naive_time = (time.perf_counter() - start) / len(sample) * QUERIES
+
+    assert results[:NAIVE_SAMPLE] == naive_results, "兩種比對方式的結果不一致"
+    hits = sum(1 for r in results if r)
+    return build_time, trie_time, naive_time, hits
+
+if __name__ == "__main__":
+    print(f"每種情境 {QUERIES:,} 筆查詢 (子字串比對只實測前 {NAIVE_SAMPLE} 筆再換算)")
+    print(f"{'名單筆數':>8} | {'建樹 (ms)':>9} | {'命中':>6} | {'後綴樹 (ns/筆)':>14} | {'子字串 (ns/筆)':>14} | {'倍數':>8}")
+    print("-" * 80)
+    for size in LIST_SIZES:
+        build_time, trie_time, naive_time, hits = run(size)
+        print(f"{size:>8,} | {build_time * 1000:>9.0f} | {hits:>6,} | {trie_time / QUERIES * 1e9:>14.0f} | "
+              f"{naive_time / QUERIES * 1e9:>14.0f} | {naive_time / trie_time:>7.0f}x")
@@ -0,0 +1,87 @@
+# benchmarks/bench_firewall_lookup.py
+"""
+防火牆比對成本的使用者空間模型：iptables 每人一條規則 (線性走訪鏈) vs nftables 集合 (雜湊查詢)
+
+這不是 kernel 的量測：只在 Python 裡重現兩種規則的比對順序，數「每個封包要比對幾條規則」
+- 鏈：login.sh 每位學生插一條 `-s IP -j ACCEPT`，block_game.sh 再插一條 `-s IP -p udp -j DROP`，
+  封包從第一條規則開始比，直到命中；未授權的裝置要走完整條鏈才被最後的 DROP 擋下
+- 集合：NftablesFirewallController 的 forward chain 規則數固定 (@game_blocked -> @allowed -> drop)，
+  每條規則最多一次集合查詢
+兩種比對的結果也會逐一核對，確認集合版的判斷與腳本版相同
+實際每個封包的延遲要在 netns 裡用 pktgen / iperf3 分別量 N 條 iptables 規則與一個 nft 集合，這裡不提供
+
+用法 (在專案根目錄)：
+    python -m benchmarks.bench_firewall_lookup
+"""
+import random
+from typing import List, Set, Tuple
+
+CLIENT_COUNTS = [50, 200, 1000]
+PACKETS = 200_000
+GAME_BLOCKED_RATIO = 0.1    # 被阻斷遊戲的比例
+UNAUTHORIZED_RATIO = 0.1    # 還沒登入的裝置比例 (封包來源)
+
+Rule = Tuple[str, str, str]  # (來源 IP, 協定 / "any", 動作)
+
+def make_clients(count: int) -> List[str]:
+    return [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(count)]
+
+def build_chain(allowed: List[str], game_blocked: List[str]) -> List[Rule]:
+    """模擬腳本的插入順序：每次都 -I FORWARD 1 插在最前面"""
+    chain: List[Rule] = []
+    for ip in allowed:
+        chain.insert(0, (ip, "any", "ACCEPT"))
+    for ip in game_blocked:
+        chain.insert(0, (ip, "udp", "DROP"))
+    return chain
+
+def chain_lookup(chain: List[Rule], src: str, proto: str) -> Tuple[str, int]:
+    """:return: (動作, 比對過的規則數)；沒有命中時由最後的 DROP 擋下"""
+    for i, (rule_src, rule_proto, action) in enumerate(chain):
+        if rule_src == src and (rule_proto == "any" or rule_proto == proto):
+            return action, i + 1
+    return "DROP", len(chain) + 1
+
+def set_lookup(allowed: Set[str], game_blocked: Set[str], src: str, proto: str) -> Tuple[str, int]:
+    # 對應 forward chain：@game_blocked udp drop -> @allowed accept -> drop
+    if proto == "udp" and src in game_blocked:
+        return "DROP", 1
+    if src in allowed:
+        return "ACCEPT", 2
+    return "DROP", 3
+
+def make_packets(allowed: List[str], count: int) -> List[Tuple[str, str]]:
+    rng = random.Random(42)
+    packets = []
+    for _ in range(count):
+        if rng.random() < UNAUTHORIZED_RATIO:
+            src = f"10.255.{rng.randrange(256)}.{rng.randrange(256)}"
+        else:
+            src = rng.choice(allowed)
+        packets.append((src, "udp" if rng.random() < 0.3 else "tcp"))
+    return packets
+
+def run(count: int) -> Tuple[float, int, float, int]:
+    """:return: (鏈的平均 / 最多比對條數, 集合的平均 / 最多比對條數)"""
+    clients = make_clients(count)
+    game_blocked = clients[:int(count * GAME_BLOCKED_RATIO)]
+    chain = build_chain(clients, game_blocked)
+    allowed_set, blocked_set = set(clients), set(game_blocked)
+    packets = make_packets(clients, PACKETS)
+
+    chain_results = [chain_lookup(chain, src, proto) for src, proto in packets]
+    set_results = [set_lookup(allowed_set, blocked_set, src, proto) for src, proto in packets]
+    assert [action for action, _ in chain_results] == [action for action, _ in set_results], "兩種比對方式的結果不一致"
+
+    chain_rules = [rules for _, rules in chain_results]
+    set_rules = [rules for _, rules in set_results]
+    return sum(chain_rules) / PACKETS, max(chain_rules), sum(set_rules) / PACKETS, max(set_rules)
+
+if __name__ == "__main__":
+    print(f"每種情境 {PACKETS:,} 個封包 (使用者空間模型：只數比對的規則條數，不是 kernel 的實際延遲)")
+    print(f"{'客戶端':>6} | {'鏈規則數':>8} | {'鏈 平均 / 最多比對':>18} | {'集合 平均 / 最多比對':>20}")
+    print("-" * 66)
+    for count in CLIENT_COUNTS:
+        chain_avg, chain_max, set_avg, set_max = run(count)
+        rules = count + int(count * GAME_BLOCKED_RATIO)
+        print(f"{count:>6} | {rules:>8} | {chain_avg:>11.1f} / {chain_max:<5} | {set_avg:>13.1f} / {set_max}")
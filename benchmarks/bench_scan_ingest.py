@@ -0,0 +1,78 @@
+# benchmarks/bench_scan_ingest.py
+"""
+掃描寫入效能比較：逐筆 create_log (舊作法) vs process_scan_results 單一 transaction 批次寫入
+
+用法 (在專案根目錄)：
+    python -m benchmarks.bench_scan_ingest
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.bench_scan_ingest
+
+會寫入測試用的 MAC (02:be:0c:...)，跑完自動刪除
+"""
+import time
+from typing import List
+
+from src.db.database import Base, SessionLocal, engine
+from src.db.models import ARPScanResult, ConnectionLog, DeviceLastSeen
+from src.db.repositories import ConnectionLogRepository
+from src.network.registry import PresenceTable, StudentRegistryService
+
+DEVICE_COUNTS = [50, 250, 1000]
+MAC_PREFIX = "02:be:0c"
+
+def make_scan(count: int) -> List[ARPScanResult]:
+    return [
+        ARPScanResult(
+            ip=f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            mac=f"{MAC_PREFIX}:{(i >> 16) & 255:02x}:{(i >> 8) & 255:02x}:{i & 255:02x}"
+        )
+        for i in range(count)
+    ]
+
+def cleanup(db) -> None:
+    db.query(ConnectionLog).filter(ConnectionLog.mac_address.like(f"{MAC_PREFIX}:%")).delete(synchronize_session=False)
+    db.query(DeviceLastSeen).filter(DeviceLastSeen.mac_address.like(f"{MAC_PREFIX}:%")).delete(synchronize_session=False)
+    db.commit()
+
+def bench_per_row(db, scan: List[ARPScanResult]) -> float:
+    """舊作法：每台裝置 add + commit + refresh"""
+    repo = ConnectionLogRepository()
+    start = time.perf_counter()
+    for device in scan:
+        repo.create_log(db=db, mac_address=device.mac, ip_address=device.ip, status="unknown")
+    return time.perf_counter() - start
+
+def bench_bulk(db, scan: List[ARPScanResult]) -> float:
+    """新作法：整輪掃描一個 transaction (第一次掃描，每台都是新 session)"""
+    service = StudentRegistryService(db, PresenceTable())
+    start = time.perf_counter()
+    service.process_scan_results(scan)
+    return time.perf_counter() - start
+
+def bench_steady(db, scan: List[ARPScanResult]) -> float:
+    """穩定狀態：裝置都已在線，只更新記憶體心跳"""
+    service = StudentRegistryService(db, PresenceTable())
+    service.process_scan_results(scan)
+    start = time.perf_counter()
+    service.process_scan_results(scan)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    print(f"資料庫: {engine.url.render_as_string(hide_password=True)}")
+    print(f"{'裝置數':>6} | {'逐筆寫入 (ms)':>14} | {'單一交易 (ms)':>14} | {'穩定狀態 (ms)':>14} | {'加速':>6}")
+    print("-" * 70)
+    try:
+        for count in DEVICE_COUNTS:
+            scan = make_scan(count)
+            cleanup(db)
+            per_row = bench_per_row(db, scan)
+            cleanup(db)
+            bulk = bench_bulk(db, scan)
+            cleanup(db)
+            steady = bench_steady(db, scan)
+            cleanup(db)
+            print(f"{count:>6} | {per_row * 1000:>14.1f} | {bulk * 1000:>14.1f} | {steady * 1000:>14.1f} | {per_row / bulk:>5.1f}x")
+    finally:
+        cleanup(db)
+        db.close()
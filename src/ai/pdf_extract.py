@@ -0,0 +1,22 @@
+# src/ai/pdf_extract.py
+"""
+在子行程 (ProcessPoolExecutor) 裡執行的 PDF 解析
+只依賴 pdfplumber：spawn 出來的子行程只會 import 這個模組，不會重建 PDFLoader 的知識庫
+"""
+from typing import List
+
+import pdfplumber
+
+def count_pages(file_path: str) -> int:
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+def extract_pages(file_path: str, start: int, end: int) -> List[str]:
+    """第 start ~ end-1 頁的文字 (沒有文字的頁面為空字串)"""
+    texts = []
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text() or "")
+            # 解析完就釋放頁面快取，大檔案不會越吃越多記憶體
+            page.close()
+    return texts
@@ -1,66 +1,372 @@
 import pdfplumber
+import asyncio
 import random
 import os
 import glob
+import hashlib
+import json
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src.ai.pdf_extract import count_pages, extract_pages
+
+CHUNK_SIZE = 1000     # 每個片段的字數
+MIN_CHUNK_LENGTH = 50 # 太短的片段 (文件結尾) 不收
+PAGES_PER_TASK = 4    # 每個子行程工作解析幾頁 (太小會一直重新開檔，太大進度更新太慢)
+MAX_FINISHED_JOBS = 50
+# 切片方式 (PageChunker / CHUNK_SIZE) 改變時要加一，舊版本的快取就不會再被使用
+CHUNKER_VERSION = 1
+
+class PageChunker:
+    """
+    逐頁切片：結果與「整份文字接起來再每 CHUNK_SIZE 字切一段」完全相同，
+    但每頁解析完就能交出已經完整的片段，跨頁的片段順序不變
+    """
+    def __init__(self, chunk_size: int = CHUNK_SIZE, min_length: int = MIN_CHUNK_LENGTH):
+        self.chunk_size = chunk_size
+        self.min_length = min_length
+        self.has_text = False
+        self._buffer = ""  # 還不滿一個片段的文字 (會接到下一頁)
+
+    def feed(self, text: str) -> List[str]:
+        if not text:
+            return []
+        self.has_text = True
+        self._buffer += text + "\n"
+        cut = len(self._buffer) - len(self._buffer) % self.chunk_size
+        chunks = [self._buffer[i:i + self.chunk_size] for i in range(0, cut, self.chunk_size)]
+        self._buffer = self._buffer[cut:]
+        return chunks
+
+    def finish(self) -> List[str]:
+        rest, self._buffer = self._buffer, ""
+        return [rest] if len(rest) > self.min_length else []
+
+class ExtractionCache:
+    """
+    PDF 解析結果的磁碟快取，以「檔案內容的 SHA-256 + 切片版本」為鍵，一個檔案一份 JSON
+    另外記下每個上傳檔案的 (大小, 修改時間) -> SHA-256，沒變動的檔案啟動時連雜湊都不用重算
+    """
+    def __init__(self, cache_dir: str, version: int = CHUNKER_VERSION):
+        self.cache_dir = cache_dir
+        self.version = version
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, "index.json")
+        # 檔名 -> [大小, 修改時間 (ns), SHA-256]
+        self._index: Dict[str, list] = self._read_json(self._index_path) or {}
+
+    def load(self, sha256: str) -> Optional[List[str]]:
+        data = self._read_json(self._path(sha256))
+        if not data or data.get("version") != self.version:
+            return None
+        return data["chunks"]
+
+    def save(self, sha256: str, chunks: List[str], pages: Optional[int] = None) -> None:
+        self._write_json(self._path(sha256), {"sha256": sha256, "version": self.version,
+                                               "pages": pages, "chunks": chunks})
+
+    def file_hash(self, file_path: str) -> str:
+        """檔案的 SHA-256 (大小與修改時間都沒變時直接用上次的結果)"""
+        stat = os.stat(file_path)
+        name = os.path.basename(file_path)
+        entry = self._index.get(name)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.remember(file_path, digest.hexdigest())
+        return digest.hexdigest()
+
+    def remember(self, file_path: str, sha256: str) -> None:
+        stat = os.stat(file_path)
+        self._index[os.path.basename(file_path)] = [stat.st_size, stat.st_mtime_ns, sha256]
+
+    def save_index(self, keep: Optional[List[str]] = None) -> None:
+        """:param keep: 目前還存在的檔名 (其餘的從索引移除)"""
+        if keep is not None:
+            self._index = {name: entry for name, entry in self._index.items() if name in keep}
+        self._write_json(self._index_path, self._index)
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, f"{sha256}.v{self.version}.json")
+
+    @staticmethod
+    def _read_json(path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path: str, data) -> None:
+        # 先寫暫存檔再改名，中途當掉也不會留下寫一半的快取
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+@dataclass
+class IngestJob:
+    """一次上傳的解析進度 (GET /api/admin/upload/{job})"""
+    id: str
+    filename: str
+    status: str = "queued"  # queued / parsing / done / failed / duplicate
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    chunks: int = 0
+    error: Optional[str] = None
+    duplicate_of: Optional[str] = None  # 內容相同的既有教材 (status 為 duplicate 時)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "job": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "chunks": self.chunks,
+            "error": self.error,
+            "duplicate_of": self.duplicate_of,
+        }
 
 class PDFLoader:
-    def __init__(self, storage_dir=None):
+    def __init__(self, storage_dir=None, max_workers: Optional[int] = None, cache_dir: Optional[str] = None):
         # 取得專案根目錄的絕對路徑
         # 無論在哪裡執行 uvicorn，檔案都會存在 /home/znk/smart-classroom/data/uploads
         base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        self.storage_dir = os.path.join(base_dir, "data", "uploads")
-        
+        self.storage_dir = storage_dir or os.path.join(base_dir, "data", "uploads")
+
         # 確保目錄存在
         os.makedirs(self.storage_dir, exist_ok=True)
-        
+
         # 知識庫
         self.knowledge_base = []
         print(f"[PDFLoader] 檔案儲存路徑設定為: {self.storage_dir}")
 
+        # 解析結果快取 (data/cache/pdf)：沒變動的檔案啟動時直接讀快取，不重新解析
+        self.cache = ExtractionCache(cache_dir or os.path.join(base_dir, "data", "cache", "pdf"))
+        # 檔名 -> 內容的 SHA-256；SHA-256 -> 該內容的片段 (同樣內容只收一次)
+        self.documents: Dict[str, str] = {}
+        self._doc_chunks: Dict[str, List[str]] = {}
+        # 解析中的內容 (SHA-256 -> 工作)，同時上傳同一份檔案時只解析一次
+        self._ingesting: Dict[str, IngestJob] = {}
+
+        # 上傳的解析在子行程執行 (第一次上傳時才建立)，不佔用後端的 event loop
+        self.max_workers = max_workers or min(2, os.cpu_count() or 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.jobs: Dict[str, IngestJob] = {}
+
         # 啟動時自動載入既有的 PDF
         self.reload_existing_files()
 
     def reload_existing_files(self):
-        """重新載入資料夾內所有的 PDF"""
-        pdf_files = glob.glob(os.path.join(self.storage_dir, "*.pdf"))
+        """重新載入資料夾內所有的 PDF (有快取的直接讀快取，只解析新的 / 改過的檔案)"""
+        # 上次沒處理完的上傳暫存檔 (後端在解析途中停止)；只刪舊的，其他行程可能正在上傳
+        for temp_path in glob.glob(os.path.join(self.storage_dir, ".*.part")):
+            if time.time() - os.path.getmtime(temp_path) > 3600:
+                os.remove(temp_path)
+        pdf_files = sorted(glob.glob(os.path.join(self.storage_dir, "*.pdf")))
         if not pdf_files:
             print("[PDFLoader] 資料夾為空，無預載教材。")
             return
 
         print(f"[PDFLoader] 發現 {len(pdf_files)} 個歷史教材，正在重新建立知識庫...")
+        parsed = 0
         for pdf_path in pdf_files:
             try:
-                self._parse_and_store(pdf_path)
+                sha256 = self.cache.file_hash(pdf_path)
+                chunks = self._doc_chunks.get(sha256) or self.cache.load(sha256)
+                if chunks is None:
+                    chunks = self._parse(pdf_path)
+                    if chunks is None:
+                        print(f"[PDFLoader] 載入 {pdf_path} 失敗")
+                        continue
+                    self.cache.save(sha256, chunks)
+                    parsed += 1
+                self._register(os.path.basename(pdf_path), sha256, chunks)
             except Exception as e:
                 print(f"[PDFLoader] 載入 {pdf_path} 失敗: {e}")
-        
-        print(f"[PDFLoader] 重建完成，目前知識庫有 {len(self.knowledge_base)} 個片段。")
+        self.cache.save_index(keep=[os.path.basename(path) for path in pdf_files])
 
-    def save_and_extract(self, file_content: bytes, filename: str) -> bool:
-        file_path = os.path.join(self.storage_dir, filename)
+        print(f"[PDFLoader] 重建完成，目前知識庫有 {len(self.knowledge_base)} 個片段 (重新解析 {parsed} 個檔案)。")
+
+    async def submit(self, file_content: bytes, filename: str) -> IngestJob:
+        """
+        存檔後排入子行程解析，立即回傳工作 (不等解析完成)
+        每解析完一批頁面，完整的片段就會加入知識庫
+        內容與既有教材 (或正在解析的上傳) 相同時不存檔也不解析，工作狀態為 duplicate
+        """
+        job = IngestJob(id=uuid.uuid4().hex[:12], filename=filename)
+        self._trim_jobs()
+        self.jobs[job.id] = job
+
+        sha256 = await asyncio.to_thread(lambda: hashlib.sha256(file_content).hexdigest())
+        duplicate_of = self._find_duplicate(sha256)
+        if duplicate_of:
+            job.status = "duplicate"
+            job.duplicate_of = duplicate_of
+            job.finished_at = time.time()
+            print(f"[PDFLoader] {filename} 與 {duplicate_of} 內容相同，略過")
+            return job
+
+        # 先寫到暫存檔，解析成功才改名蓋過 data/uploads/<filename>：
+        # 同名重新上傳一份壞掉的檔案時，原本的教材不會被覆蓋
+        temp_path = os.path.join(self.storage_dir, f".{job.id}.{filename}.part")
+        await asyncio.to_thread(self._write_file, temp_path, file_content)
+        self._ingesting[sha256] = job
+        job.task = asyncio.create_task(self._ingest(job, temp_path, sha256))
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def _ingest(self, job: IngestJob, temp_path: str, sha256: str) -> None:
+        """:param temp_path: 上傳內容的暫存檔 (成功時改名為正式檔名，失敗時刪除)"""
+        loop = asyncio.get_running_loop()
+        file_path = os.path.join(self.storage_dir, job.filename)
+        futures = []
+        added: List[str] = []
+        try:
+            # 以前解析過同樣的內容 (例如檔案曾被刪除)：直接用快取
+            cached = await asyncio.to_thread(self.cache.load, sha256)
+            if cached is not None:
+                await asyncio.to_thread(self._commit_file, temp_path, file_path, sha256)
+                self._register(job.filename, sha256, cached)
+                job.chunks = len(cached)
+                job.status = "done"
+                return
+
+            pool = self._get_pool()
+            job.pages_total = await loop.run_in_executor(pool, count_pages, temp_path)
+            job.status = "parsing"
+            # 全部頁面一次排進行程池，再依頁碼順序取回結果，片段順序與整份解析相同
+            futures = [
+                loop.run_in_executor(pool, extract_pages, temp_path, start, min(start + PAGES_PER_TASK, job.pages_total))
+                for start in range(0, job.pages_total, PAGES_PER_TASK)
+            ]
+            chunker = PageChunker()
+            for future in futures:
+                for text in await future:
+                    self._add_chunks(chunker.feed(text), added)
+                    job.pages_done += 1
+                    job.chunks = len(added)
+            self._add_chunks(chunker.finish(), added)
+            job.chunks = len(added)
+            if not chunker.has_text:
+                raise ValueError("PDF 沒有可擷取的文字")
+            # 解析成功才取代原本的檔案；片段已經在知識庫裡，這裡只記錄歸屬並寫入快取
+            await asyncio.to_thread(self._commit_file, temp_path, file_path, sha256, added, job.pages_total)
+            self._register(job.filename, sha256, added, in_knowledge_base=True)
+            job.status = "done"
+            print(f"[PDFLoader] {job.filename} 解析完成 ({job.pages_total} 頁，{job.chunks} 個片段)")
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            if isinstance(e, BrokenProcessPool):
+                # 子行程異常結束 (例如記憶體不足被砍)，下一個工作重新建立行程池
+                self.shutdown()
+            # 解析失敗就不留下一半的內容
+            self._remove_chunks(added)
+            job.chunks = 0
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+            print(f"[PDFLoader] {job.filename} 解析失敗: {job.error}")
+            # 原本的檔案 (如果有) 沒有被動過，只要刪掉暫存檔
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        finally:
+            self._ingesting.pop(sha256, None)
+            job.finished_at = time.time()
+
+    def _find_duplicate(self, sha256: str) -> Optional[str]:
+        """內容相同的既有教材或正在解析的上傳 (檔名)"""
+        for filename, document in self.documents.items():
+            if document == sha256:
+                return filename
+        job = self._ingesting.get(sha256)
+        return job.filename if job else None
+
+    def _register(self, filename: str, sha256: str, chunks: List[str], in_knowledge_base: bool = False) -> None:
+        """
+        記錄檔名對應的內容；同一個檔名換了內容時移除舊內容的片段
+        :param in_knowledge_base: 片段已經 (逐頁) 加入知識庫
+        """
+        previous = self.documents.get(filename)
+        self.documents[filename] = sha256
+        if previous and previous != sha256 and previous not in self.documents.values():
+            self._remove_chunks(self._doc_chunks.pop(previous, []))
+        if sha256 in self._doc_chunks:
+            return
+        self._doc_chunks[sha256] = chunks
+        if not in_knowledge_base:
+            self.knowledge_base.extend(chunks)
+
+    def _remove_chunks(self, chunks: List[str]) -> None:
+        if chunks:
+            ids = {id(chunk) for chunk in chunks}
+            self.knowledge_base[:] = [chunk for chunk in self.knowledge_base if id(chunk) not in ids]
+
+    def _commit_file(self, temp_path: str, file_path: str, sha256: str,
+                     chunks: Optional[List[str]] = None, pages: Optional[int] = None) -> None:
+        """暫存檔改名為正式檔名 (同一個檔案系統內是 atomic)，並更新快取與索引"""
+        if chunks is not None:
+            self.cache.save(sha256, chunks, pages)
+        os.replace(temp_path, file_path)
+        self.cache.remember(file_path, sha256)
+        self.cache.save_index()
+
+    def _add_chunks(self, chunks: List[str], added: List[str]) -> None:
+        self.knowledge_base.extend(chunks)
+        added.extend(chunks)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn：後端已經有其他執行緒，fork 可能繼承到鎖住的狀態
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _trim_jobs(self) -> None:
+        """只保留最近 MAX_FINISHED_JOBS 個已結束的工作"""
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    @staticmethod
+    def _write_file(file_path: str, file_content: bytes) -> None:
         with open(file_path, "wb") as f:
             f.write(file_content)
-        return self._parse_and_store(file_path)
 
-    def _parse_and_store(self, file_path: str) -> bool:
-        """內部方法：解析單一 PDF 並存入記憶體"""
+    def _parse(self, file_path: str) -> Optional[List[str]]:
+        """內部方法：解析單一 PDF，回傳片段 (沒有文字或解析失敗時為 None)"""
         try:
-            text_content = ""
+            chunker = PageChunker()
+            chunks = []
             with pdfplumber.open(file_path) as pdf:
                 for page in pdf.pages:
-                    text = page.extract_text()
-                    if text: text_content += text + "\n"
-
-            if not text_content: return False
-
-            chunk_size = 1000
-            for i in range(0, len(text_content), chunk_size):
-                chunk = text_content[i : i + chunk_size]
-                if len(chunk) > 50:
-                    self.knowledge_base.append(chunk)
-            return True
+                    chunks.extend(chunker.feed(page.extract_text()))
+            chunks.extend(chunker.finish())
+            return chunks if chunker.has_text else None
         except:
-            return False
+            return None
 
     def get_random_context(self) -> str:
         """
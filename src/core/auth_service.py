@@ -1,19 +1,49 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Dict, Optional
 from sqlalchemy.orm import Session
 from src.db.repositories import AuthorizationLogRepository
+from src.core.events import EventBus
 from src.network.firewall import FirewallControllerInterface
 
+# 記憶體裡沒有狀態的 MAC，隔幾秒才再查一次資料庫
+MISS_RECHECK_SECONDS = 10
+
 class AuthorizationService:
+    """
+    授權狀態以記憶體中的 MAC -> 狀態表為準 (查詢只是 dict 查表)
+    authorization_logs 仍是持久化的稽核紀錄：啟動時載入一次，之後 authorize / revoke 同步寫入兩邊
+    其他行程 (Telegram Bot) 要開通 / 撤銷請呼叫後端 API，不要直接寫 authorization_logs；
+    表裡查不到的 MAC 仍會回頭查資料庫，作為保底
+    """
     def __init__(
         self, 
         repo: AuthorizationLogRepository, 
-        firewall: FirewallControllerInterface
+        firewall: FirewallControllerInterface,
+        events: Optional[EventBus] = None
     ):
         self.repo = repo
         self.firewall = firewall
+        self.events = events
+        self._states: Optional[Dict[str, str]] = None  # MAC (小寫) -> 最新狀態，None 表示尚未載入
+        self._misses: Dict[str, float] = {}  # 查過資料庫但沒有紀錄的 MAC -> 查詢時間
+
+    def load(self, db: Session) -> int:
+        """從 authorization_logs 載入每個 MAC 的最新狀態 (一個 DISTINCT ON 查詢)"""
+        self._states = self.repo.get_latest_statuses(db)
+        self._misses.clear()
+        return len(self._states)
+
+    def _set_state(self, db: Session, mac: str, status: str) -> None:
+        if self._states is None:
+            self.load(db)
+        self._states[mac.lower()] = status
 
-    async def authorize(self, db: Session, mac: str, details: Optional[dict] = None) -> None:
-        """授權：寫 DB -> 開防火牆"""
+    async def authorize(self, db: Session, mac: str, details: Optional[dict] = None) -> bool:
+        """
+        授權：寫 DB -> 開防火牆
+        :return: 防火牆是否套用成功
+        """
         # 1. DB 記錄
         self.repo.create_log(
             db=db,
@@ -21,49 +51,68 @@ class AuthorizationService:
             status="authorized",
             details=str(details) if details else "{}"
         )
+        self._set_state(db, mac, "authorized")
         # 2. 執行 Shell Script (allow)
-        await self.firewall.allow_device(mac)
+        ok = await self.firewall.allow_device(mac)
+        # 3. 通知儀表板
+        if self.events:
+            self.events.publish("unlock", {"mac": mac})
+        return ok is not False
 
-    async def revoke(self, db: Session, mac: str) -> None:
-        """撤銷：寫 DB -> 關防火牆"""
+    async def revoke(self, db: Session, mac: str) -> bool:
+        """
+        撤銷：寫 DB -> 關防火牆
+        :return: 防火牆是否套用成功 (失敗時授權狀態已是 revoked，呼叫端可直接重試 deny_device)
+        """
         # 1. DB 記錄
         self.repo.create_log(
             db=db,
             mac_address=mac,
             status="revoked"
         )
+        self._set_state(db, mac, "revoked")
         # 2. 執行 Shell Script (block)
-        await self.firewall.deny_device(mac)
+        ok = await self.firewall.deny_device(mac)
+        # 3. 通知儀表板
+        if self.events:
+            self.events.publish("revoke", {"mac": mac})
+        return ok is not False
 
     async def is_authorized(self, db: Session, mac: str) -> bool:
-        """檢查 DB 中最新狀態是否為 authorized"""
-        latest_log = self.repo.get_latest_log(db, mac)
-        if not latest_log:
-            return False
-        return latest_log.status == "authorized"
+        """檢查最新狀態是否為 authorized (記憶體查表；表裡沒有的 MAC 才查 DB)"""
+        if self._states is None:
+            self.load(db)
+        mac = mac.lower()
+        status = self._states.get(mac)
+        if status is None:
+            status = self._lookup(db, mac)
+        return status == "authorized"
+
+    def _lookup(self, db: Session, mac: str) -> Optional[str]:
+        """記憶體裡沒有的 MAC 查一次最新紀錄 (其他行程寫入的)；查不到的 MAC 每 MISS_RECHECK_SECONDS 秒最多查一次"""
+        now = time.monotonic()
+        if now - self._misses.get(mac, float("-inf")) < MISS_RECHECK_SECONDS:
+            return None
+        log = self.repo.get_latest_log(db, mac)
+        if log is None:
+            self._misses[mac] = now
+            return None
+        self._misses.pop(mac, None)
+        self._states[mac] = log.status
+        return log.status
 
     async def restore_state(self, db: Session) -> int:
         """
         [Task 4.4] 系統重啟恢復
         找出所有應該要是 authorized 的人，重新執行 allow script
         """
-        # 這裡簡化邏輯：撈出最近 1000 筆 log，整理出最後狀態是 authorized 的 MAC
-        all_logs = self.repo.get_logs(db, limit=1000)
-        
-        # 用 dict 整理每個 MAC 的最後狀態
-        mac_status = {}
-        for log in all_logs:
-            # log 是依時間倒序嗎？如果是，我們只看第一次遇到的(最新的)
-            # 假設 get_logs 回傳的是最新的在前面
-            if log.mac_address not in mac_status:
-                mac_status[log.mac_address] = log.status
+        # 載入每個 MAC 的最新狀態 (同時也是之後 is_authorized 的查詢來源)
+        self.load(db)
         
-        restored_count = 0
-        for mac, status in mac_status.items():
-            if status == "authorized":
-                # 重新執行 Shell Script，確保 iptables 規則存在
-                await self.firewall.allow_device(mac)
-                restored_count += 1
+        # 同時送出，讓批次防火牆合併成一個 transaction，而不是每人 fork 一次
+        macs = [mac for mac, status in self._states.items() if status == "authorized"]
+        await asyncio.gather(*(self.firewall.allow_device(mac) for mac in macs))
+        restored_count = len(macs)
                 
         print(f"[System] Restored {restored_count} active sessions via Shell Scripts.")
         return restored_count
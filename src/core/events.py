@@ -0,0 +1,146 @@
+# src/core/events.py
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+
+class Event:
+    __slots__ = ("id", "type", "data")
+
+    def __init__(self, event_id: int, event_type: str, data: Dict[str, Any]):
+        self.id = event_id
+        self.type = event_type
+        self.data = data
+
+    def to_sse(self) -> str:
+        """轉成 text/event-stream 的一筆訊息"""
+        payload = json.dumps(self.data, ensure_ascii=False, default=str)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+class Subscription:
+    """一個訂閱者 (例如一個開著的儀表板) 的事件佇列"""
+    def __init__(self, bus: "EventBus", maxsize: int):
+        self._bus = bus
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # 佇列滿了 (用戶端太慢) 時設為 True，用戶端應重新抓一次完整狀態
+        self.overflowed = False
+
+    def _offer(self, event: Event) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """等下一筆事件，逾時回傳 None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self._bus._subscribers.discard(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class Watcher:
+    """等待某個 MAC 的下一筆事件 (長輪詢用)；要先建立再檢查狀態，才不會漏掉中間發生的事件"""
+    def __init__(self, bus: "EventBus", key: str):
+        self._bus = bus
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def wait(self, timeout: float) -> Optional[Event]:
+        """等到事件發生或逾時 (回傳 None)"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        watchers = self._bus._watchers.get(self.key)
+        if watchers is not None:
+            watchers.discard(self)
+            if not watchers:
+                del self._bus._watchers[self.key]
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class EventBus:
+    """
+    行程內的事件廣播 (教室儀表板的推播來源)
+    後端狀態改變時 publish 一次，所有訂閱者各自收到，不用再輪詢
+    publish 可以在任何執行緒呼叫 (例如 to_thread 裡的工作)，事件一律交回 event loop 分發
+    """
+    def __init__(self, history: int = 256, queue_size: int = 512):
+        self._subscribers: Set[Subscription] = set()
+        self._watchers: Dict[str, Set[Watcher]] = {}  # MAC (小寫) -> 等待中的長輪詢
+        self._history: Deque[Event] = deque(maxlen=history)
+        self._queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_id = 1
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """指定分發事件的 event loop (startup 時呼叫)"""
+        self._loop = loop
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        訂閱之後的事件 (必須在 event loop 裡呼叫)
+        :param last_event_id: 斷線重連時帶入，先補送還在歷史裡、之後的事件
+        """
+        sub = Subscription(self, self._queue_size)
+        if last_event_id is not None:
+            if last_event_id >= self._next_id:
+                # 重啟前的編號，無從補送
+                sub.overflowed = True
+            missed = [e for e in self._history if e.id > last_event_id]
+            if self._history and self._history[0].id > last_event_id + 1:
+                # 歷史不夠長，中間有事件遺失
+                sub.overflowed = True
+            for event in missed:
+                sub._offer(event)
+        self._subscribers.add(sub)
+        return sub
+
+    def watch(self, mac: str) -> Watcher:
+        """等待與這個 MAC 有關的下一筆事件 (事件 data 帶 "mac")，必須在 event loop 裡呼叫"""
+        key = mac.lower()
+        watcher = Watcher(self, key)
+        self._watchers.setdefault(key, set()).add(watcher)
+        return watcher
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(event_type, data)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, event_type, data)
+
+    def _dispatch(self, event_type: str, data: Dict[str, Any]) -> None:
+        # 編號只在 event loop 裡產生，保證順序與補送時的判斷一致
+        event = Event(self._next_id, event_type, data)
+        self._next_id += 1
+        self._history.append(event)
+        for sub in list(self._subscribers):
+            sub._offer(event)
+
+        mac = data.get("mac")
+        if mac:
+            for watcher in self._watchers.pop(mac.lower(), ()):
+                if not watcher.future.done():
+                    watcher.future.set_result(event)
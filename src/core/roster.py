@@ -0,0 +1,100 @@
+# src/core/roster.py
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+class RosterSnapshot:
+    """
+    教師儀表板用的學生名單快照
+    由背景掃描定期以一個查詢重建，API 直接回傳記憶體中的結果；
+    每位學生記錄「最後一次改變時的版本號」，讓前端只拿有變動的學生 (delta)
+    """
+    def __init__(self, online_window: int = 90, max_age: float = 5.0):
+        """
+        :param online_window: last_seen 在幾秒內算在線
+        :param max_age: 快照超過幾秒沒重建，API 會自行重建一次 (背景掃描停擺時的保底)
+        """
+        self.online_window = online_window
+        self.max_age = max_age
+        # 版本號從啟動時間起算：伺服器重啟後，舊的 cursor 一定比新的基準小，會拿到完整名單
+        self._base = int(time.time() * 1000)
+        self.version = self._base
+        self.refreshed_at = 0.0
+        self._students: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, int] = {}   # student_id -> 最後改變的版本
+        self._removed: Dict[str, int] = {}   # 已刪除的 student_id -> 刪除時的版本
+        self._by_mac: Dict[str, str] = {}    # MAC (小寫) -> student_id
+
+    @property
+    def etag(self) -> str:
+        return f'W/"roster-{self.version}"'
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at > self.max_age
+
+    def refresh(self, rows: List[Any]) -> List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        用 StudentRepository.get_roster 的結果更新快照
+        :return: 有變動的學生 [(變動前, 變動後)]，新增的學生變動前為 None，刪除的學生變動後為 None
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.online_window)
+        latest = {}
+        for student_id, name, mac, violation_count, connected, last_seen in rows:
+            is_online = bool(connected) and last_seen is not None and last_seen > cutoff
+            latest[student_id] = {
+                "student_id": student_id,
+                "name": name,
+                "mac": mac,
+                "status": "online" if is_online else "offline",
+                "violation_count": violation_count,
+                # 即時流量不放在名單裡 (每次取樣都會變)，見 /api/traffic 與 traffic 事件
+            }
+
+        changed = [sid for sid, data in latest.items() if self._students.get(sid) != data]
+        removed = [sid for sid in self._students if sid not in latest]
+        changes = [(self._students.get(sid), latest[sid]) for sid in changed]
+        changes += [(self._students[sid], None) for sid in removed]
+        if changes:
+            self.version += 1
+            for sid in changed:
+                self._changed[sid] = self.version
+                self._removed.pop(sid, None)
+            for sid in removed:
+                self._changed.pop(sid, None)
+                self._removed[sid] = self.version
+            self._students = latest
+            self._by_mac = {data["mac"].lower(): sid for sid, data in latest.items()}
+        self.refreshed_at = time.monotonic()
+        return changes
+
+    def apply(self, mac: str, **fields: Any) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        狀態一改變就直接更新某位學生 (不等下一次 refresh)；之後的 refresh 看到相同的資料就不會再回報一次
+        :return: (變動前, 變動後)；不是學生的 MAC 或沒有變動時回傳 None
+        """
+        sid = self._by_mac.get(mac.lower())
+        if sid is None:
+            return None
+        before = self._students[sid]
+        after = {**before, **fields}
+        if after == before:
+            return None
+        self.version += 1
+        self._students = {**self._students, sid: after}
+        self._changed[sid] = self.version
+        return before, after
+
+    def full(self) -> List[Dict[str, Any]]:
+        return list(self._students.values())
+
+    def changes_since(self, cursor: int) -> Optional[Tuple[List[Dict[str, Any]], List[str]]]:
+        """
+        cursor 之後改變 / 刪除的學生
+        :return: (changed, removed)；cursor 不屬於這次啟動 (重啟前或未來的版本) 時回傳 None，呼叫端應改給完整名單
+        """
+        if cursor < self._base or cursor > self.version:
+            return None
+        changed = [self._students[sid] for sid, v in self._changed.items() if v > cursor]
+        removed = [sid for sid, v in self._removed.items() if v > cursor]
+        return changed, removed
@@ -0,0 +1,130 @@
+# src/core/traffic.py
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+# nftables 每個 IP 的累計計數: (下載 bytes, 下載 packets, 上傳 bytes, 上傳 packets)
+Counters = Tuple[int, int, int, int]
+
+class TrafficRing:
+    """
+    一位學生最近 size 次取樣的速率 (bytes/s)，固定大小的環狀緩衝
+    用 array('f') 存：每位學生只佔 size * 8 bytes，不會隨時間成長
+    """
+    __slots__ = ("down", "up", "pos", "filled", "idle", "pps")
+
+    def __init__(self, size: int):
+        self.down = array("f", bytes(4 * size))
+        self.up = array("f", bytes(4 * size))
+        self.pos = 0       # 下一筆要寫入的位置
+        self.filled = 0    # 已寫入的筆數 (最多 size)
+        self.idle = 0      # 連續幾次取樣沒有流量
+        self.pps = (0.0, 0.0)  # 最新一次的 (下載, 上傳) packets/s
+
+    def push(self, down: float, up: float, pps: Tuple[float, float] = (0.0, 0.0)) -> None:
+        size = len(self.down)
+        self.down[self.pos] = down
+        self.up[self.pos] = up
+        self.pos = (self.pos + 1) % size
+        self.filled = min(self.filled + 1, size)
+        self.idle = self.idle + 1 if down == 0 and up == 0 else 0
+        self.pps = pps
+
+    def latest(self) -> Tuple[float, float]:
+        if not self.filled:
+            return 0.0, 0.0
+        last = self.pos - 1
+        return self.down[last], self.up[last]
+
+    def history(self) -> Tuple[List[float], List[float]]:
+        """由舊到新的 (下載, 上傳) 速率"""
+        start = self.pos - self.filled
+        order = [i % len(self.down) for i in range(start, self.pos)]
+        return [round(self.down[i]) for i in order], [round(self.up[i]) for i in order]
+
+class TrafficMeter:
+    """
+    每位學生 (MAC) 的即時流量
+    背景取樣把 nftables 的累計計數換算成速率，寫進各自的 TrafficRing；
+    儀表板直接讀記憶體，不查資料庫
+    """
+    def __init__(self, interval: float = 10.0, history: int = 60):
+        """
+        :param interval: 取樣間隔 (秒)
+        :param history: 每位學生保留幾次取樣 (預設 60 次 x 10 秒 = 最近 10 分鐘)
+        """
+        self.interval = interval
+        self.history = history
+        self._rings: Dict[str, TrafficRing] = {}
+        self._last: Dict[str, Counters] = {}   # IP -> 上一次的累計計數
+        self._last_time: Optional[float] = None
+
+    def sample(self, counters: Dict[str, Counters], owner: Callable[[str], Optional[str]],
+               now: Optional[float] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        套用一次取樣
+        :param counters: IP -> 累計計數 (NftablesFirewallController.read_counters)
+        :param owner: IP -> MAC (查不到回傳 None，該 IP 的流量略過)
+        :return: 這次有流量、或從有流量變成沒流量的學生 MAC -> (下載, 上傳) bytes/s
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._last_time if self._last_time is not None else None
+        self._last_time = now
+
+        totals: Dict[str, List[int]] = {}
+        for ip, current in counters.items():
+            previous = self._last.get(ip)
+            if previous is None or elapsed is None:
+                continue
+            # 計數變小 = 規則重建或集合元素過期，從 0 重新累計
+            delta = [c - p if c >= p else c for c, p in zip(current, previous)]
+            mac = owner(ip)
+            if mac is None:
+                continue
+            total = totals.setdefault(mac.lower(), [0, 0, 0, 0])
+            for i, value in enumerate(delta):
+                total[i] += value
+        self._last = dict(counters)
+        if not elapsed:
+            return {}
+
+        changed: Dict[str, Tuple[int, int]] = {}
+        for mac in set(totals) | set(self._rings):
+            down_bytes, down_packets, up_bytes, up_packets = totals.get(mac, (0, 0, 0, 0))
+            ring = self._rings.get(mac)
+            if ring is None:
+                if not (down_bytes or up_bytes):
+                    continue
+                ring = self._rings[mac] = TrafficRing(self.history)
+            was_active = ring.latest() != (0.0, 0.0)
+            ring.push(down_bytes / elapsed, up_bytes / elapsed, (down_packets / elapsed, up_packets / elapsed))
+            down, up = ring.latest()
+            if down or up or was_active:
+                changed[mac] = (round(down), round(up))
+            if ring.idle >= self.history:
+                # 整段歷史都沒有流量，不再保留
+                del self._rings[mac]
+        return changed
+
+    def rates(self, mac: str) -> Tuple[int, int]:
+        ring = self._rings.get(mac.lower())
+        if ring is None:
+            return 0, 0
+        down, up = ring.latest()
+        return round(down), round(up)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """所有學生的目前速率與歷史 (儀表板初次載入用)"""
+        result = {}
+        for mac, ring in self._rings.items():
+            down, up = ring.latest()
+            history_down, history_up = ring.history()
+            result[mac] = {
+                "down": round(down),
+                "up": round(up),
+                "down_pps": round(ring.pps[0], 1),
+                "up_pps": round(ring.pps[1], 1),
+                "history_down": history_down,
+                "history_up": history_up,
+            }
+        return result
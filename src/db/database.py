@@ -1,8 +1,10 @@
 # src/db/database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
+from src.db.partitions import ConnectionLogPartitionManager
+
 # 使用你 models.py 中的設定
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
@@ -23,5 +25,34 @@ def get_db():
         db.close()
 
 def init_db():
+    # 先載入 models，Base.metadata 才有所有的表
+    import src.db.models  # noqa: F401
+
+    # connection_logs 是分區表；舊版的一般表要另外執行 python -m src.db.partitions --migrate-legacy 搬移
+    # (會改名、刪表，不在每個行程啟動時自動執行)
+    partitions = ConnectionLogPartitionManager(engine)
+    if partitions.needs_migration():
+        print("[Partition] 偵測到舊版未分區的連線紀錄，請停止後端、備份後執行 python -m src.db.partitions --migrate-legacy")
+
     # 這會建立所有繼承自 Base 的 Table
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+    # create_all 不會幫已存在的表補欄位，這裡手動補上後來新增的欄位
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE connection_logs ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP"))
+
+    # 建立今天起的分區
+    partitions.run_maintenance()
+
+    with engine.begin() as conn:
+        # device_last_seen 剛建立時，從既有的連線紀錄回填一次
+        conn.execute(text("""
+            INSERT INTO device_last_seen (mac_address, last_ip, last_seen, student_id, connected)
+            SELECT DISTINCT ON (lower(mac_address))
+                   lower(mac_address), ip_address, COALESCE(last_seen, timestamp), student_id,
+                   status <> 'disconnected'
+            FROM connection_logs
+            WHERE NOT EXISTS (SELECT 1 FROM device_last_seen)
+            ORDER BY lower(mac_address), timestamp DESC NULLS LAST
+            ON CONFLICT (mac_address) DO NOTHING
+        """))
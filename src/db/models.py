@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
-from sqlalchemy import Column, String, DateTime, Boolean, Integer, Text, JSON
+from sqlalchemy import Column, String, Date, DateTime, Boolean, Integer, Float, Text, JSON, Index
 from .database import Base
 
 # ==========================================
@@ -25,6 +25,11 @@ class ARPScanResult(BaseModel):
     mac: str
     timestamp: datetime = Field(default_factory=datetime.now)
 
+class PresenceEvent(ARPScanResult):
+    """鄰居表變化事件 (PresenceMonitor 發出)"""
+    event: str  # appeared / moved / gone
+    previous_ip: Optional[str] = None
+
 class Student(BaseModel):
     student_id: str
     name: str
@@ -84,15 +89,66 @@ class StudentRecord(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class ConnectionLog(Base):
-    """連線歷史記錄"""
+    """連線歷史記錄 (依 timestamp 每日分區，由 src/db/partitions.py 建立與清除)"""
     __tablename__ = 'connection_logs'
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}
   
+    # 分區表的主鍵必須包含分區鍵，所以是 (id, timestamp)
     id = Column(String, primary_key=True)
     mac_address = Column(String, nullable=False, index=True)
     ip_address = Column(String, nullable=False)
     student_id = Column(String, nullable=True)
     status = Column(String, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # session 開始時間 (connected / unknown) 或結束時間 (disconnected)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+    # session 最後一次看到裝置的時間 (定期批次更新)
+    last_seen = Column(DateTime, nullable=True)
+
+class DeviceLastSeen(Base):
+    """每台裝置最後一次出現的位置 (由掃描寫入維護，取代 connection_logs 的 ORDER BY timestamp DESC LIMIT 1)"""
+    __tablename__ = 'device_last_seen'
+
+    mac_address = Column(String, primary_key=True)  # 一律小寫
+    last_ip = Column(String, nullable=False, index=True)
+    last_seen = Column(DateTime, nullable=False, index=True)
+    student_id = Column(String, nullable=True)
+    # session 是否仍開著 (寫入 disconnected 後為 False)
+    connected = Column(Boolean, default=True, nullable=False)
+
+class AttendanceHourly(Base):
+    """每位學生每小時的出席彙總 (原始連線紀錄過期刪除前先彙總到這裡)"""
+    __tablename__ = 'attendance_hourly'
+
+    student_id = Column(String, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    minutes_present = Column(Float, default=0, nullable=False)
+    ip_addresses = Column(JSON, nullable=True)  # 這個小時用過的 IP 列表
+
+class ViolationEvent(Base):
+    """違規事件 (只新增不修改，由 src/db/violations.py 的 ViolationEventWriter 批次寫入)"""
+    __tablename__ = 'violation_events'
+    __table_args__ = (
+        Index('ix_violation_events_student_time', 'student_id', 'occurred_at'),
+    )
+
+    id = Column(String, primary_key=True)
+    occurred_at = Column(DateTime, nullable=False, index=True)  # UTC
+    mac_address = Column(String, nullable=False, index=True)    # 一律小寫
+    ip_address = Column(String, nullable=False)
+    student_id = Column(String, nullable=True)  # 寫入時由 MAC 查出，未註冊裝置為 None
+    category = Column(String, nullable=False)   # VIDEO / GAME
+    action = Column(String, nullable=False)     # throttle / block_game
+
+class ViolationDaily(Base):
+    """每位學生每天每個分類的違規次數 (寫入事件時同一個 transaction 累加，報表不用掃描事件)"""
+    __tablename__ = 'violation_daily'
+
+    student_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)  # 本地日期 (上課日)
+    category = Column(String, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+    first_at = Column(DateTime, nullable=False)  # UTC
+    last_at = Column(DateTime, nullable=False)   # UTC
 
 class AuthorizationLog(Base):
     """授權變更記錄"""
@@ -0,0 +1,241 @@
+# src/db/partitions.py
+"""
+connection_logs 的時間分區管理
+- 每天一個分區 (connection_logs_pYYYYMMDD)，預先建立未來幾天的分區
+- 超過保留天數的分區先彙總到 attendance_hourly，再整個 DROP (O(1)，不用 DELETE 掃表)
+
+舊版未分區的 connection_logs 不會在後端啟動時自動搬移 (會改名、刪表)，請停止後端、備份後執行一次：
+    python -m src.db.partitions --migrate-legacy
+"""
+import argparse
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+# 原始連線紀錄保留幾天 (出席彙總會永久保留)
+RETENTION_DAYS = int(os.getenv("CONNECTION_LOG_RETENTION_DAYS", "14"))
+# 預先建立幾天後的分區
+PREMAKE_DAYS = 2
+
+PARENT_TABLE = "connection_logs"
+LEGACY_TABLE = "connection_logs_legacy"
+DEFAULT_PARTITION = "connection_logs_default"
+_PARTITION_NAME = re.compile(r"^connection_logs_p(\d{8})$")
+
+# 把一段 session [timestamp, last_seen] 拆到每個小時，計算每位學生每小時在線分鐘數
+# 同一位學生多台裝置同時在線時，每小時最多算 60 分鐘
+_ROLLUP_SQL = """
+    INSERT INTO attendance_hourly (student_id, hour, minutes_present, ip_addresses)
+    SELECT cl.student_id,
+           h.hour,
+           LEAST(60, SUM(EXTRACT(EPOCH FROM
+               LEAST(COALESCE(cl.last_seen, cl.timestamp), h.hour + INTERVAL '1 hour')
+               - GREATEST(cl.timestamp, h.hour))) / 60.0),
+           to_json(array_agg(DISTINCT cl.ip_address))
+    FROM {source} cl
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('hour', cl.timestamp),
+        date_trunc('hour', COALESCE(cl.last_seen, cl.timestamp)),
+        INTERVAL '1 hour'
+    ) AS h(hour)
+    WHERE cl.student_id IS NOT NULL
+      AND cl.status <> 'disconnected'
+      {condition}
+    GROUP BY cl.student_id, h.hour
+    ON CONFLICT (student_id, hour) DO UPDATE SET
+        minutes_present = LEAST(60, attendance_hourly.minutes_present + EXCLUDED.minutes_present),
+        ip_addresses = (
+            SELECT json_agg(DISTINCT ip)
+            FROM jsonb_array_elements_text(
+                attendance_hourly.ip_addresses::jsonb || EXCLUDED.ip_addresses::jsonb
+            ) AS t(ip)
+        )
+"""
+
+def _partition_name(day: date) -> str:
+    return f"{PARENT_TABLE}_p{day:%Y%m%d}"
+
+class ConnectionLogPartitionManager:
+    def __init__(self, engine: Engine, retention_days: int = RETENTION_DAYS, premake_days: int = PREMAKE_DAYS):
+        self.engine = engine
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+
+    @property
+    def enabled(self) -> bool:
+        # 宣告式分區只有 PostgreSQL 支援
+        return self.engine.dialect.name == "postgresql"
+
+    def _is_unpartitioned(self, conn: Connection) -> bool:
+        """connection_logs 是否還是舊版的一般表 (relkind 'r'；分區表為 'p')"""
+        return conn.execute(text(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"
+        ), {"name": PARENT_TABLE}).scalar() == "r"
+
+    def needs_migration(self) -> bool:
+        """還有舊版的連線紀錄要搬 (一般表的 connection_logs，或搬移中斷留下的 connection_logs_legacy)"""
+        if not self.enabled:
+            return False
+        with self.engine.connect() as conn:
+            return self._is_unpartitioned(conn) or \
+                conn.execute(text("SELECT to_regclass(:name)"), {"name": LEGACY_TABLE}).scalar() is not None
+
+    def prepare_legacy_table(self) -> None:
+        """
+        舊版的 connection_logs 是一般表：在建立分區表之前改名讓出位置，
+        之後再由 migrate_legacy_table 搬進分區表
+        """
+        if not self.enabled:
+            return
+        with self.engine.begin() as conn:
+            if not self._is_unpartitioned(conn):
+                return
+            print(f"[Partition] 偵測到未分區的 {PARENT_TABLE}，改名為 {LEGACY_TABLE} 準備搬移")
+            conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_TABLE}"))
+            conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {PARENT_TABLE}_pkey TO {LEGACY_TABLE}_pkey"))
+            conn.execute(text(f"ALTER INDEX IF EXISTS ix_{PARENT_TABLE}_mac_address RENAME TO ix_{LEGACY_TABLE}_mac_address"))
+            conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP"))
+
+    def migrate_legacy_table(self) -> int:
+        """把舊表資料搬進分區表 (依資料日期建立對應分區)，完成後刪除舊表"""
+        if not self.enabled:
+            return 0
+        with self.engine.begin() as conn:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": LEGACY_TABLE}).scalar() is None:
+                return 0
+            days = conn.execute(text(
+                f"SELECT DISTINCT timestamp::date FROM {LEGACY_TABLE} WHERE timestamp IS NOT NULL"
+            )).scalars().all()
+            for day in days:
+                self._create_partition(conn, day)
+            moved = conn.execute(text(f"""
+                INSERT INTO {PARENT_TABLE} (id, mac_address, ip_address, student_id, status, timestamp, last_seen)
+                SELECT id, mac_address, ip_address, student_id, status,
+                       COALESCE(timestamp, last_seen, now() AT TIME ZONE 'utc'), last_seen
+                FROM {LEGACY_TABLE}
+            """)).rowcount
+            conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+        print(f"[Partition] 已將 {moved} 筆舊連線紀錄搬入分區表")
+        return moved
+
+    def run_maintenance(self, today: date = None) -> Dict[str, List[str]]:
+        """建立未來的分區、彙總並刪除過期的分區 (啟動時與每小時執行)"""
+        if not self.enabled:
+            return {"created": [], "dropped": []}
+        today = today or datetime.utcnow().date()
+        with self.engine.begin() as conn:
+            if self._is_unpartitioned(conn):
+                print(f"[Partition] {PARENT_TABLE} 尚未分區，請停止後端後執行 python -m src.db.partitions --migrate-legacy")
+                return {"created": [], "dropped": []}
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+            ))
+            created = []
+            for offset in range(self.premake_days + 1):
+                name = self._create_partition(conn, today + timedelta(days=offset))
+                if name:
+                    created.append(name)
+        dropped = self.expire_partitions(today)
+        if created or dropped:
+            print(f"[Partition] 新建分區: {created}，刪除過期分區: {dropped}")
+        return {"created": created, "dropped": dropped}
+
+    def expire_partitions(self, today: date) -> List[str]:
+        """超過保留天數的分區：先彙總到 attendance_hourly 再 DROP，同一個 transaction 內完成"""
+        cutoff = today - timedelta(days=self.retention_days)
+        dropped = []
+        for name, day in self._list_partitions():
+            if day >= cutoff:
+                continue
+            with self.engine.begin() as conn:
+                conn.execute(text(_ROLLUP_SQL.format(source=name, condition="")))
+                conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+
+        # DEFAULT 分區只會接到落在既有分區以外的零星資料，這裡用一般的 DELETE 清掉
+        cutoff_ts = datetime.combine(cutoff, datetime.min.time())
+        with self.engine.begin() as conn:
+            conn.execute(text(_ROLLUP_SQL.format(
+                source=DEFAULT_PARTITION, condition="AND cl.timestamp < :cutoff"
+            )), {"cutoff": cutoff_ts})
+            conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff"), {"cutoff": cutoff_ts})
+        return dropped
+
+    def _list_partitions(self) -> List[tuple]:
+        with self.engine.connect() as conn:
+            names = conn.execute(text("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(:parent)
+            """), {"parent": PARENT_TABLE}).scalars().all()
+        partitions = []
+        for name in names:
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions.append((name, datetime.strptime(match.group(1), "%Y%m%d").date()))
+        return sorted(partitions, key=lambda p: p[1])
+
+    def _create_partition(self, conn: Connection, day: date) -> str:
+        """建立某一天的分區，已存在則回傳空字串"""
+        name = _partition_name(day)
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+            return ""
+        # DEFAULT 分區裡若已有這天的資料，必須先搬出來才能建立新分區
+        has_default = conn.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar()
+        start, end = day, day + timedelta(days=1)
+        if has_default:
+            conn.execute(text(f"CREATE TEMP TABLE _moved_logs (LIKE {PARENT_TABLE})"))
+            conn.execute(text(f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end RETURNING *
+                ) INSERT INTO _moved_logs SELECT * FROM moved
+            """), {"start": start, "end": end})
+        conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} FOR VALUES FROM ('{start}') TO ('{end}')"
+        ))
+        if has_default:
+            conn.execute(text(f"INSERT INTO {PARENT_TABLE} SELECT * FROM _moved_logs"))
+            conn.execute(text("DROP TABLE _moved_logs"))
+        return name
+
+
+def migrate_legacy(engine: Engine) -> int:
+    """一次性搬移：舊表改名 -> 建立分區表與分區 -> 搬資料並刪除舊表，回傳搬移的筆數"""
+    from src.db.models import ConnectionLog
+
+    manager = ConnectionLogPartitionManager(engine)
+    manager.prepare_legacy_table()
+    ConnectionLog.__table__.create(bind=engine, checkfirst=True)
+    manager.run_maintenance()
+    return manager.migrate_legacy_table()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="connection_logs 分區管理")
+    parser.add_argument("--migrate-legacy", action="store_true",
+                        help="把舊版未分區的 connection_logs 搬進分區表 (一次性；請先停止後端並備份資料庫)")
+    parser.add_argument("--maintain", action="store_true", help="建立未來的分區，彙總並刪除過期的分區")
+    options = parser.parse_args()
+
+    from src.db.database import engine
+
+    manager = ConnectionLogPartitionManager(engine)
+    if not manager.enabled:
+        print("[Partition] 只有 PostgreSQL 支援分區")
+        return
+    if options.migrate_legacy:
+        if not manager.needs_migration():
+            print(f"[Partition] {PARENT_TABLE} 已經是分區表，不需要搬移")
+            return
+        migrate_legacy(engine)
+    elif options.maintain:
+        manager.run_maintenance()
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
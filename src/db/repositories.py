@@ -1,9 +1,10 @@
 import uuid
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Dict, Any
+from datetime import date, datetime, timezone
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from src.db.models import StudentRecord, ConnectionLog, AuthorizationLog, User
+from sqlalchemy import desc, exists, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from src.db.models import StudentRecord, ConnectionLog, DeviceLastSeen, AuthorizationLog, User, ViolationEvent, ViolationDaily
 
 class UserRepository:
     def get_user_by_email(self, db: Session, email: str) -> Optional[User]:
@@ -46,25 +47,136 @@ class StudentRepository:
     def get_all_students(self, db: Session) -> List[StudentRecord]:
         return db.query(StudentRecord).all()
 
+    def get_roster(self, db: Session) -> List[Any]:
+        """
+        學生名單 + 各自裝置的最後出現狀態 (一個 LEFT JOIN，取代逐一查詢)
+        :return: (student_id, name, mac_address, violation_count, connected, last_seen) 的列
+        """
+        return db.execute(
+            select(
+                StudentRecord.student_id,
+                StudentRecord.name,
+                StudentRecord.mac_address,
+                StudentRecord.violation_count,
+                DeviceLastSeen.connected,
+                DeviceLastSeen.last_seen
+            )
+            .outerjoin(DeviceLastSeen, DeviceLastSeen.mac_address == func.lower(StudentRecord.mac_address))
+            .order_by(StudentRecord.student_id)
+        ).all()
+
+    def mark_offline(self, db: Session, cutoff: datetime, commit: bool = True) -> List[str]:
+        """
+        把 online 但裝置已斷線 / 在 cutoff 之後都沒出現的學生標記為 offline
+        一個 UPDATE ... WHERE NOT EXISTS (device_last_seen) 完成，不用逐一查詢每位學生
+        :return: 這次被標記為離線的 MAC
+        """
+        fresh = select(DeviceLastSeen.mac_address).where(
+            DeviceLastSeen.mac_address == func.lower(StudentRecord.mac_address),
+            DeviceLastSeen.connected.is_(True),
+            DeviceLastSeen.last_seen >= cutoff
+        )
+        stmt = (
+            update(StudentRecord)
+            .where(StudentRecord.status == 'online', ~exists(fresh))
+            .values(status='offline')
+            .returning(StudentRecord.mac_address)
+            .execution_options(synchronize_session=False)
+        )
+        macs = db.execute(stmt).scalars().all()
+        if commit:
+            db.commit()
+        return macs
+
+    def mark_logged_out(self, db: Session, macs: List[str], commit: bool = True) -> None:
+        """離線且已撤銷授權的學生標記為 log_out (一個 UPDATE)"""
+        if not macs:
+            return
+        db.execute(
+            update(StudentRecord)
+            .where(func.lower(StudentRecord.mac_address).in_([mac.lower() for mac in macs]),
+                   StudentRecord.status == 'offline')
+            .values(status='log_out')
+            .execution_options(synchronize_session=False)
+        )
+        if commit:
+            db.commit()
+
+    def get_punished_macs(self, db: Session, macs: List[str]) -> List[str]:
+        """macs 之中已經是 PUNISHED 的 (小寫)"""
+        lowered = [mac.lower() for mac in macs]
+        return db.execute(
+            select(func.lower(StudentRecord.mac_address))
+            .where(func.lower(StudentRecord.mac_address).in_(lowered), StudentRecord.p_status == 'PUNISHED')
+        ).scalars().all()
+
+    def mark_punished(self, db: Session, mac_address: str) -> Optional[StudentRecord]:
+        """標記為 PUNISHED 並累加違規次數，找不到學生時回傳 None"""
+        student = db.query(StudentRecord).filter(
+            func.lower(StudentRecord.mac_address) == mac_address.lower()
+        ).first()
+        if student:
+            student.p_status = 'PUNISHED'
+            student.violation_count = (student.violation_count or 0) + 1
+            db.commit()
+        return student
+
 
 class ConnectionLogRepository:
     """
     負責網路連線紀錄 (Connection Logs) 的存取
     """
-    def create_log(self, db: Session, mac_address: str, ip_address: str, status: str, student_id: Optional[str] = None) -> ConnectionLog:
+    def create_log(self, db: Session, mac_address: str, ip_address: str, status: str, student_id: Optional[str] = None, last_seen: Optional[datetime] = None) -> ConnectionLog:
+        now = datetime.utcnow()
         log = ConnectionLog(
             id=str(uuid.uuid4()),
             mac_address=mac_address,
             ip_address=ip_address,
             student_id=student_id,
             status=status,
-            timestamp=datetime.utcnow()
+            timestamp=now,
+            last_seen=last_seen or now
         )
         db.add(log)
         db.commit()
         db.refresh(log)
         return log
 
+    def create_logs(self, db: Session, logs: List[Dict[str, Any]], commit: bool = True) -> List[str]:
+        """
+        批次新增連線紀錄 (一個 INSERT ... executemany，而不是每筆 add + commit + refresh)
+        :param logs: [{ mac_address, ip_address, status, student_id, timestamp, last_seen }, ...]
+        :param commit: False 時交給呼叫端一起 commit (整輪掃描一個 transaction)
+        :return: 依輸入順序的 log id
+        """
+        if not logs:
+            return []
+        now = datetime.utcnow()
+        rows = [{
+            "id": str(uuid.uuid4()),
+            "mac_address": log["mac_address"],
+            "ip_address": log["ip_address"],
+            "student_id": log.get("student_id"),
+            "status": log["status"],
+            "timestamp": log.get("timestamp") or now,
+            "last_seen": log.get("last_seen") or now
+        } for log in logs]
+        db.execute(insert(ConnectionLog), rows)
+        if commit:
+            db.commit()
+        return [row["id"] for row in rows]
+
+    def touch_logs(self, db: Session, sessions: List[Dict[str, Any]], commit: bool = True) -> None:
+        """
+        批次更新 session 的最後出現時間 (一次 executemany)
+        :param sessions: [{ id, timestamp, last_seen }, ...] (id + timestamp 是主鍵)
+        """
+        if not sessions:
+            return
+        db.bulk_update_mappings(ConnectionLog, sessions)
+        if commit:
+            db.commit()
+
     def get_logs_by_mac(self, db: Session, mac_address: str, limit: int = 50) -> List[ConnectionLog]:
         return db.query(ConnectionLog)\
             .filter(ConnectionLog.mac_address == mac_address)\
@@ -73,6 +185,49 @@ class ConnectionLogRepository:
             .all()
 
 
+class DeviceLastSeenRepository:
+    """
+    負責裝置最後出現位置 (device_last_seen) 的存取
+    MAC / IP 反查都是索引點查詢，不用再排序整張 connection_logs
+    """
+    def upsert_many(self, db: Session, rows: List[Dict[str, Any]], commit: bool = True) -> None:
+        """
+        批次 upsert (INSERT ... ON CONFLICT DO UPDATE)
+        :param rows: [{ mac_address, last_ip, last_seen, student_id, connected }, ...]
+        """
+        if not rows:
+            return
+        # 同一個 MAC 在一個 statement 裡只能出現一次 (ON CONFLICT 限制)，以最後一筆為準
+        rows = list({row["mac_address"].lower(): {**row, "mac_address": row["mac_address"].lower()} for row in rows}.values())
+        dialect_insert = sqlite.insert if db.bind.dialect.name == "sqlite" else postgresql.insert
+        stmt = dialect_insert(DeviceLastSeen)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DeviceLastSeen.mac_address],
+            set_={
+                "last_ip": stmt.excluded.last_ip,
+                "last_seen": stmt.excluded.last_seen,
+                "student_id": stmt.excluded.student_id,
+                "connected": stmt.excluded.connected,
+            }
+        )
+        db.execute(stmt, rows)
+        if commit:
+            db.commit()
+
+    def get_by_mac(self, db: Session, mac_address: str) -> Optional[DeviceLastSeen]:
+        return db.get(DeviceLastSeen, mac_address.lower())
+
+    def get_by_ip(self, db: Session, ip_address: str, since: Optional[datetime] = None) -> Optional[DeviceLastSeen]:
+        """
+        IP 目前 (最後) 是誰在用
+        :param since: 只接受這個時間之後還出現過的裝置
+        """
+        query = db.query(DeviceLastSeen).filter(DeviceLastSeen.last_ip == ip_address)
+        if since:
+            query = query.filter(DeviceLastSeen.last_seen > since)
+        return query.order_by(desc(DeviceLastSeen.last_seen)).first()
+
+
 class AuthorizationLogRepository:
     """
     負責授權狀態紀錄 (Authorization Logs) 的存取
@@ -106,13 +261,34 @@ class AuthorizationLogRepository:
 
     def get_latest_log(self, db: Session, mac_address: str) -> Optional[AuthorizationLog]:
         """
-        取得該 MAC 最近的一筆狀態變更紀錄
+        取得該 MAC 最近的一筆狀態變更紀錄 (大寫 / 小寫寫入的都算，仍可使用 mac_address 索引)
         """
         return db.query(AuthorizationLog)\
-            .filter(AuthorizationLog.mac_address == mac_address)\
+            .filter(AuthorizationLog.mac_address.in_({mac_address, mac_address.lower(), mac_address.upper()}))\
             .order_by(desc(AuthorizationLog.authorized_at))\
             .first()
 
+    def get_latest_statuses(self, db: Session) -> Dict[str, str]:
+        """
+        每個 MAC (小寫) 最新的一筆狀態，一個查詢取回 (啟動時載入 AuthorizationService 的記憶體狀態)
+        PostgreSQL 用 DISTINCT ON；其他資料庫 (測試用 SQLite) 改用 ROW_NUMBER()
+        """
+        mac = func.lower(AuthorizationLog.mac_address)
+        if db.bind.dialect.name == "postgresql":
+            stmt = (
+                select(mac, AuthorizationLog.status)
+                .distinct(mac)
+                .order_by(mac, desc(AuthorizationLog.authorized_at))
+            )
+        else:
+            ranked = select(
+                mac.label("mac"),
+                AuthorizationLog.status,
+                func.row_number().over(partition_by=mac, order_by=desc(AuthorizationLog.authorized_at)).label("rn")
+            ).subquery()
+            stmt = select(ranked.c.mac, ranked.c.status).where(ranked.c.rn == 1)
+        return {mac_address: status for mac_address, status in db.execute(stmt)}
+
     def get_logs(self, db: Session, limit: int = 100) -> List[AuthorizationLog]:
         """
         取得系統最近的授權紀錄 (供稽核使用)
@@ -121,3 +297,111 @@ class AuthorizationLogRepository:
             .order_by(desc(AuthorizationLog.authorized_at))\
             .limit(limit)\
             .all()
+
+
+class ViolationEventRepository:
+    """
+    負責違規事件 (violation_events) 與每日彙總 (violation_daily) 的存取
+    事件只新增不修改；彙總在同一個 transaction 裡累加，報表與儀表板只讀彙總
+    """
+    def add_events(self, db: Session, events: List[Dict[str, Any]], commit: bool = True) -> int:
+        """
+        批次寫入事件並累加每日彙總 (一個 INSERT ... executemany + 一個 upsert)
+        :param events: [{ occurred_at (UTC), mac_address, ip_address, category, action }, ...]
+        :return: 寫入的事件數
+        """
+        if not events:
+            return 0
+        # MAC -> 學生 (一個查詢)，事件寫入時就記下當時是哪位學生
+        macs = {event["mac_address"].lower() for event in events}
+        students = dict(db.execute(
+            select(func.lower(StudentRecord.mac_address), StudentRecord.student_id)
+            .where(func.lower(StudentRecord.mac_address).in_(macs))
+        ).all())
+
+        rows = []
+        daily: Dict[tuple, Dict[str, Any]] = {}
+        for event in events:
+            mac = event["mac_address"].lower()
+            student_id = students.get(mac)
+            rows.append({
+                "id": str(uuid.uuid4()),
+                "occurred_at": event["occurred_at"],
+                "mac_address": mac,
+                "ip_address": event["ip_address"],
+                "student_id": student_id,
+                "category": event["category"],
+                "action": event["action"],
+            })
+            if student_id is None:
+                continue
+            key = (student_id, self.local_day(event["occurred_at"]), event["category"])
+            counter = daily.get(key)
+            if counter is None:
+                daily[key] = {"student_id": key[0], "day": key[1], "category": key[2], "count": 1,
+                              "first_at": event["occurred_at"], "last_at": event["occurred_at"]}
+            else:
+                counter["count"] += 1
+                counter["first_at"] = min(counter["first_at"], event["occurred_at"])
+                counter["last_at"] = max(counter["last_at"], event["occurred_at"])
+
+        db.execute(insert(ViolationEvent), rows)
+        if daily:
+            dialect_insert = sqlite.insert if db.bind.dialect.name == "sqlite" else postgresql.insert
+            stmt = dialect_insert(ViolationDaily)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ViolationDaily.student_id, ViolationDaily.day, ViolationDaily.category],
+                set_={
+                    "count": ViolationDaily.count + stmt.excluded["count"],
+                    "last_at": stmt.excluded.last_at,
+                }
+            )
+            db.execute(stmt, list(daily.values()))
+        if commit:
+            db.commit()
+        return len(rows)
+
+    @staticmethod
+    def local_day(occurred_at: datetime) -> date:
+        """UTC (naive) -> 本地日期，彙總以上課日為單位"""
+        return occurred_at.replace(tzinfo=timezone.utc).astimezone().date()
+
+    def get_daily(self, db: Session, since: date, until: date,
+                  student_id: Optional[str] = None, category: Optional[str] = None) -> List[ViolationDaily]:
+        """[since, until] 之間每位學生每天每個分類的次數"""
+        query = db.query(ViolationDaily).filter(ViolationDaily.day >= since, ViolationDaily.day <= until)
+        if student_id:
+            query = query.filter(ViolationDaily.student_id == student_id)
+        if category:
+            query = query.filter(ViolationDaily.category == category)
+        return query.order_by(ViolationDaily.day, ViolationDaily.student_id, ViolationDaily.category).all()
+
+    def get_totals(self, db: Session, since: date, until: date, student_id: Optional[str] = None) -> List[Any]:
+        """[since, until] 之間每位學生每個分類的總次數 (由每日彙總加總)"""
+        stmt = (
+            select(
+                ViolationDaily.student_id,
+                ViolationDaily.category,
+                func.sum(ViolationDaily.count).label("count"),
+                func.min(ViolationDaily.first_at).label("first_at"),
+                func.max(ViolationDaily.last_at).label("last_at"),
+            )
+            .where(ViolationDaily.day >= since, ViolationDaily.day <= until)
+            .group_by(ViolationDaily.student_id, ViolationDaily.category)
+            .order_by(desc("count"))
+        )
+        if student_id:
+            stmt = stmt.where(ViolationDaily.student_id == student_id)
+        return db.execute(stmt).all()
+
+    def get_events(self, db: Session, student_id: Optional[str] = None, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None, limit: int = 100) -> List[ViolationEvent]:
+        """最近的違規事件 (明細，依時間由新到舊)"""
+        query = db.query(ViolationEvent)
+        if student_id:
+            query = query.filter(ViolationEvent.student_id == student_id)
+        if since:
+            query = query.filter(ViolationEvent.occurred_at >= since)
+        if until:
+            query = query.filter(ViolationEvent.occurred_at < until)
+        return query.order_by(desc(ViolationEvent.occurred_at)).limit(limit).all()
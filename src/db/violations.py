@@ -0,0 +1,91 @@
+# src/db/violations.py
+"""
+違規事件的批次寫入
+違規偵測在 event loop 裡，不能每處罰一次就同步寫一次資料庫：
+事件先放進記憶體緩衝區，每 flush_interval 秒 (或累積到 max_batch 筆) 在執行緒裡一次寫入，
+事件與每日彙總 (violation_daily) 在同一個 transaction 裡完成
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from src.db.repositories import ViolationEventRepository
+
+logger = logging.getLogger(__name__)
+
+class ViolationEventWriter:
+    def __init__(self, session_factory: Callable[[], Session], flush_interval: float = 5.0,
+                 max_batch: int = 500, max_buffer: int = 10000):
+        """
+        :param flush_interval: 最多幾秒寫入一次
+        :param max_batch: 緩衝區累積到幾筆就提早寫入
+        :param max_buffer: 資料庫一直寫不進去時最多保留幾筆 (超過時丟掉最舊的)
+        """
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self.repo = ViolationEventRepository()
+        self._buffer: List[Dict[str, Any]] = []
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, mac_address: str, ip_address: str, category: str, action: str,
+            occurred_at: Optional[datetime] = None) -> None:
+        """記下一筆違規 (不碰資料庫，立即返回)"""
+        self._buffer.append({
+            "occurred_at": occurred_at or datetime.utcnow(),
+            "mac_address": mac_address,
+            "ip_address": ip_address,
+            "category": category,
+            "action": action,
+        })
+        if len(self._buffer) >= self.max_batch:
+            self._wake.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """停止定期寫入，並把緩衝區剩下的事件寫完"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """寫入目前緩衝區的事件；失敗時放回緩衝區，下次重試"""
+        async with self._lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                return await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                print(f"[Violation Writer Error] {e}")
+                self._buffer = batch + self._buffer
+                dropped = len(self._buffer) - self.max_buffer
+                if dropped > 0:
+                    logger.warning(f"違規事件緩衝區已滿，丟棄最舊的 {dropped} 筆")
+                    del self._buffer[:dropped]
+                return 0
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        db = self.session_factory()
+        try:
+            return self.repo.add_events(db, batch)
+        finally:
+            db.close()
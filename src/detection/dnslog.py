@@ -0,0 +1,170 @@
+# src/detection/dnslog.py
+"""
+即時 DNS 查詢來源：跟隨 (tail) dnsmasq / pihole-FTL 的查詢紀錄檔
+
+Pi-hole 每隔一段時間 (預設 60 秒) 才把查詢寫進 pihole-FTL.db，讀資料庫最多會晚一分鐘；
+log 檔則是查詢當下就寫入。這裡用 inotify (watchfiles) 等檔案變化，一有新的一行就解析成
+(timestamp, client, domain) 交給違規偵測，不用輪詢、也不增加資料庫負擔
+
+log 輪替 (logrotate 改名後建立新檔、或 copytruncate 清空) 時會自動接續新檔
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+
+from watchfiles import awatch
+
+from src.detection.pihole import DnsQuery
+
+logger = logging.getLogger(__name__)
+
+PIHOLE_LOG_PATH = "/var/log/pihole/pihole.log"
+
+# Oct 18 10:15:32 dnsmasq[812]: query[A] www.youtube.com from 192.168.10.5
+# (log-queries=extra 時中間會多一段 "123 192.168.10.5/51234 ")
+_QUERY_LINE = re.compile(r"^(\w{3} [ \d]\d \d\d:\d\d:\d\d) .*?\bquery\[\w+\] (\S+) from (\S+)")
+
+class DnsLogTailer:
+    def __init__(self, path: str = PIHOLE_LOG_PATH, from_start: bool = False, follow: bool = True,
+                 debounce: int = 200, batch_lines: int = 5000):
+        """
+        :param from_start: 從檔案開頭讀 (重播錄下來的 log)；預設從結尾開始，只讀之後的查詢
+        :param follow: 讀到結尾後繼續等新的內容；False 時讀完就結束 (重播 / 測試用)
+        :param debounce: 檔案變化合併的最長等待 (毫秒)，也就是偵測延遲的上限
+        :param batch_lines: 每批最多幾行 (重播大檔時分批交出)
+        """
+        self.path = path
+        self.from_start = from_start
+        self.follow = follow
+        self.debounce = debounce
+        self.batch_lines = batch_lines
+        self._file = None
+        self._inode: Optional[int] = None
+        self._partial = ""
+        self._pending: List[str] = []  # 輪替時舊檔剩下的行
+        self._ts_cache = ("", 0.0)
+        self._open_error: Optional[str] = None
+        self._skip_existing = False  # 第一次開檔時讀不到 (例如沒有權限)：之後開成功時仍從結尾開始
+
+    async def stream(self, stop_event: Optional[asyncio.Event] = None) -> AsyncIterator[List[DnsQuery]]:
+        """每次有新的查詢就交出一批 (timestamp, client, domain)"""
+        self._open(at_end=not self.from_start)
+        try:
+            for batch in self._read_available():
+                yield batch
+            if not self.follow:
+                return
+            # 監看所在目錄：輪替時檔案會被改名 / 重新建立
+            directory, name = os.path.split(os.path.abspath(self.path))
+            async for _ in awatch(directory, watch_filter=lambda change, path: os.path.basename(path) == name,
+                                  debounce=self.debounce, step=50, stop_event=stop_event):
+                self._check_rotation()
+                for batch in self._read_available():
+                    yield batch
+        finally:
+            self._close()
+
+    # --- 檔案處理 ---
+
+    def _open(self, at_end: bool) -> bool:
+        """開檔失敗 (還不存在、沒有讀取權限) 時不拋出例外，下一次檔案變化時再試"""
+        try:
+            self._file = open(self.path, "r", encoding="utf-8", errors="replace")
+        except OSError as e:
+            self._file = None
+            # 檔案已存在但讀不到：之後開成功時舊的內容不算新查詢；還不存在的檔案之後建立時從頭讀
+            self._skip_existing = self._skip_existing or (at_end and not isinstance(e, FileNotFoundError))
+            if not isinstance(e, FileNotFoundError) and str(e) != self._open_error:
+                # 同樣的錯誤只記一次 (每次檔案變化都會重試)
+                logger.warning(f"無法開啟 DNS 查詢紀錄 {self.path}: {e}")
+            self._open_error = str(e)
+            return False
+        self._open_error = None
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._partial = ""
+        if at_end or self._skip_existing:
+            self._file.seek(0, os.SEEK_END)
+        self._skip_existing = False
+        return True
+
+    def _close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _check_rotation(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # 已改名、新檔還沒建立：繼續讀舊檔剩下的內容
+            return
+        if self._file is None:
+            self._open(at_end=False)
+        elif stat.st_ino != self._inode:
+            # 新檔：先讀完舊檔剩下的內容，再從新檔開頭開始
+            self._pending = self._read_lines()
+            self._close()
+            self._open(at_end=False)
+        elif stat.st_size < self._file.tell():
+            # copytruncate：檔案被清空
+            self._file.seek(0)
+            self._partial = ""
+
+    def _read_lines(self) -> List[str]:
+        if self._file is None:
+            return []
+        data = self._file.read()
+        if not data:
+            return []
+        data = self._partial + data
+        lines = data.split("\n")
+        # 最後一段還沒寫完整 (沒有換行)，留到下一次
+        self._partial = lines.pop()
+        return lines
+
+    def _read_available(self) -> List[List[DnsQuery]]:
+        lines = self._pending + self._read_lines()
+        self._pending = []
+        if not self.follow and self._partial:
+            # 重播：最後一行沒有換行也要處理
+            lines.append(self._partial)
+            self._partial = ""
+        batches = []
+        for start in range(0, len(lines), self.batch_lines):
+            queries = self.parse_lines(lines[start:start + self.batch_lines])
+            if queries:
+                batches.append(queries)
+        return batches
+
+    # --- 解析 ---
+
+    def parse_lines(self, lines: List[str]) -> List[DnsQuery]:
+        queries = []
+        for line in lines:
+            if "query[" not in line:
+                continue
+            match = _QUERY_LINE.match(line)
+            if match:
+                stamp, domain, client = match.groups()
+                queries.append((self._timestamp(stamp), client, domain))
+        return queries
+
+    def _timestamp(self, stamp: str) -> float:
+        # 同一秒的查詢很多，只解析一次
+        if self._ts_cache[0] == stamp:
+            return self._ts_cache[1]
+        # syslog 格式沒有年份：用今年，落在未來 (跨年) 時改用去年
+        now = time.time()
+        year = datetime.now().year
+        try:
+            value = datetime.strptime(f"{year} {stamp}", "%Y %b %d %H:%M:%S").timestamp()
+            if value > now + 86400:
+                value = datetime.strptime(f"{year - 1} {stamp}", "%Y %b %d %H:%M:%S").timestamp()
+        except ValueError:
+            value = now
+        self._ts_cache = (stamp, value)
+        return value
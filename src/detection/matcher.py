@@ -0,0 +1,86 @@
+# src/detection/matcher.py
+"""
+網域分類比對 (黑名單)
+
+以「反轉 label」的後綴樹 (suffix trie) 儲存：youtube.com 存成 com -> youtube，
+查詢 rr3---sn-abc.googlevideo.com 時從最右邊的 label 往左走，最多走 label 數那麼多步，
+跟名單有 10 筆還是 5 萬筆無關；名單裡的網域也涵蓋它所有的子網域
+"""
+import glob
+import os
+from typing import Dict, Iterable, Optional
+
+BLOCKLIST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "config", "blocklists")
+
+# 節點裡存放分類的 key (label 不可能是空字串)
+_CATEGORY = ""
+
+class DomainMatcher:
+    def __init__(self):
+        self._root: Dict[str, dict] = {}
+        self.size = 0
+
+    def add(self, domain: str, category: str) -> None:
+        """加入一個網域 (含所有子網域)；同一個網域重複加入時以最後的分類為準"""
+        labels = domain.strip().strip(".").lower().split(".")
+        if labels and labels[0] == "*":
+            labels = labels[1:]
+        if not labels or not all(labels):
+            return
+        node = self._root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        if _CATEGORY not in node:
+            self.size += 1
+        node[_CATEGORY] = category
+
+    def add_all(self, domains: Iterable[str], category: str) -> None:
+        for domain in domains:
+            self.add(domain, category)
+
+    def load_file(self, path: str, category: Optional[str] = None) -> int:
+        """
+        讀取一個分類檔 (一行一個網域，# 開頭為註解；也接受 hosts 格式 "0.0.0.0 example.com")
+        :param category: 預設為檔名 (例如 video.txt -> video)
+        :return: 讀入的行數
+        """
+        category = category or os.path.splitext(os.path.basename(path))[0]
+        count = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].split()
+                if line:
+                    self.add(line[-1], category)
+                    count += 1
+        return count
+
+    def load_dir(self, path: str = BLOCKLIST_DIR) -> int:
+        """讀取目錄下所有 *.txt，每個檔案是一個分類"""
+        total = 0
+        for file_path in sorted(glob.glob(os.path.join(path, "*.txt"))):
+            total += self.load_file(file_path)
+        return total
+
+    def match(self, domain: str) -> Optional[str]:
+        """
+        回傳網域所屬的分類，不在名單裡回傳 None
+        父網域與子網域都有列時，以最精確 (最長) 的那筆為準
+        """
+        node = self._root
+        category = None
+        for label in reversed(domain.rstrip(".").lower().split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            category = node.get(_CATEGORY, category)
+        return category
+
+    def __len__(self) -> int:
+        return self.size
+
+def load_default() -> DomainMatcher:
+    """載入 config/blocklists 裡的所有分類"""
+    matcher = DomainMatcher()
+    matcher.load_dir()
+    return matcher
@@ -0,0 +1,87 @@
+# src/detection/pihole.py
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PIHOLE_DB_PATH = "/etc/pihole/pihole-FTL.db"
+
+# (timestamp, client IP, domain)
+DnsQuery = Tuple[float, str, str]
+
+class PiholeQueryReader:
+    """
+    增量讀取 Pi-hole 的 queries 表
+    保持一條唯讀連線，記住讀到的最後一個 id，每次只抓之後新增的紀錄；
+    同一筆查詢只會被處理一次，工作量只跟新的 DNS 流量成正比
+    """
+    def __init__(self, db_path: str = PIHOLE_DB_PATH, lookback: int = 60, batch_size: int = 5000):
+        """
+        :param db_path: pihole-FTL.db 路徑
+        :param lookback: 第一次連線時往回讀幾秒 (之後只讀新的)
+        :param batch_size: 每次查詢最多取幾筆 (積太多時分批讀完)
+        """
+        self.db_path = db_path
+        self.lookback = lookback
+        self.batch_size = batch_size
+        self.last_id: Optional[int] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        # 唯讀模式開啟，不會鎖住 pihole-FTL 的寫入；之後可能在別的執行緒讀取
+        self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        if self.last_id is None:
+            self.last_id = self._start_id()
+
+    def close(self) -> None:
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def fetch_new(self) -> List[DnsQuery]:
+        """上次之後新增的查詢 (依 id 排序)；資料庫暫時讀不到時回傳空 list，下次重新連線"""
+        try:
+            if self._conn is None:
+                self.open()
+            rows: List[DnsQuery] = []
+            while True:
+                batch = self._conn.execute(
+                    "SELECT id, timestamp, client, domain FROM queries WHERE id > ? ORDER BY id LIMIT ?",
+                    (self.last_id, self.batch_size),
+                ).fetchall()
+                if batch:
+                    self.last_id = batch[-1][0]
+                    rows.extend((ts, client, domain) for _, ts, client, domain in batch)
+                if len(batch) < self.batch_size:
+                    break
+            if not rows:
+                self._check_reset()
+            return rows
+        except sqlite3.Error as e:
+            print(f"[Pi-hole Error] {e}")
+            self.close()
+            return []
+
+    async def stream(self, interval: float = 10.0) -> AsyncIterator[List[DnsQuery]]:
+        """每 interval 秒在執行緒裡讀一次新的查詢，有資料才交出 (與 DnsLogTailer.stream 相同介面)"""
+        while True:
+            queries = await asyncio.to_thread(self.fetch_new)
+            if queries:
+                yield queries
+            await asyncio.sleep(interval)
+
+    def _start_id(self) -> int:
+        """lookback 秒之前的最後一個 id (timestamp 有索引)"""
+        since = time.time() - self.lookback
+        row = self._conn.execute("SELECT MAX(id) FROM queries WHERE timestamp <= ?", (since,)).fetchone()
+        return row[0] or 0
+
+    def _check_reset(self) -> None:
+        # 資料庫被清空 / 重建 (pihole -f 或 FTL 重建) 時 id 會重新編號，cursor 要跟著回到開頭
+        row = self._conn.execute("SELECT MAX(id) FROM queries").fetchone()
+        if (row[0] or 0) < self.last_id:
+            logger.warning("Pi-hole queries 的 id 變小 (資料庫重建)，重新定位讀取位置")
+            self.last_id = self._start_id()
@@ -0,0 +1,94 @@
+# src/detection/scoring.py
+"""
+違規積分 (指數衰減，讀取時才計算)
+
+原本每一輪都要把所有看過的 IP 扣一次分，而且從來不刪除，成本跟歷史成正比；
+這裡每筆紀錄只存 (分數, 最後更新時間)，衰減在加分 / 讀取時依經過的時間一次算出：
+    score(t) = score(t0) * 0.5 ** ((t - t0) / half_life)
+紀錄依最後更新時間排序，閒置超過 ttl 的從最舊的一端刪除，
+所以每次的成本只跟「有新查詢的裝置」有關
+"""
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Tuple
+
+class ScoreRecord:
+    __slots__ = ("score", "updated", "hit_at")
+
+    def __init__(self, score: float, updated: float, hit_at: float):
+        self.score = score
+        self.updated = updated  # score 對應的時間
+        self.hit_at = hit_at    # 最後一次加分的時間
+
+class ScoreBoard:
+    def __init__(self, half_life: float, max_score: float, ttl: float, min_gap: float = 0.0):
+        """
+        :param half_life: 分數減半所需的秒數
+        :param max_score: 分數上限 (避免無限疊加)
+        :param ttl: 閒置超過幾秒就刪除紀錄
+        :param min_gap: 同一個 (裝置, 分類) 兩次加分至少間隔幾秒 (影片一次載入會有大量查詢，只算一次)
+        """
+        self.half_life = half_life
+        self.max_score = max_score
+        self.ttl = ttl
+        self.min_gap = min_gap
+        # (裝置, 分類) -> 紀錄，依最後更新時間由舊到新
+        self._records: "OrderedDict[Tuple[Hashable, str], ScoreRecord]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _decayed(self, record: ScoreRecord, now: float) -> float:
+        elapsed = now - record.updated
+        if elapsed <= 0:
+            return record.score
+        return record.score * 0.5 ** (elapsed / self.half_life)
+
+    def hit(self, client: Hashable, category: str, amount: float, now: float) -> float:
+        """加分 (先套用衰減)，回傳加分後的分數"""
+        key = (client, category)
+        # 目前最新的紀錄時間 (紀錄依 updated 排序，最後一筆最新)
+        latest = next(reversed(self._records.values())).updated if self._records else now
+        record = self._records.get(key)
+        if record is None:
+            # 第一次一定加分 (用 now - min_gap 的話浮點誤差可能讓差距略小於 min_gap)
+            record = self._records[key] = ScoreRecord(0.0, now, float("-inf"))
+        else:
+            self._records.move_to_end(key)
+        score = self._decayed(record, now)
+        if now - record.hit_at >= self.min_gap:
+            score = min(score + amount, self.max_score)
+            record.hit_at = now
+        # 時間戳可能略微倒退 (不同來源)：紀錄時間不往回走、也不早於其他紀錄 (evict 只看最舊的一端)，
+        # 存下的分數衰減到紀錄時間
+        base = max(record.updated, now)
+        updated = max(base, latest)
+        record.score = score * 0.5 ** ((updated - base) / self.half_life)
+        record.updated = updated
+        return score
+
+    def score(self, client: Hashable, category: str, now: float) -> float:
+        """目前分數 (只讀，不更新紀錄)"""
+        record = self._records.get((client, category))
+        return self._decayed(record, now) if record else 0.0
+
+    def scores(self, client: Hashable, categories: Iterable[str], now: float) -> Dict[str, float]:
+        return {category: self.score(client, category, now) for category in categories}
+
+    def reset(self, client: Hashable, categories: Iterable[str]) -> None:
+        """分數歸零 (保留最後加分時間，min_gap 內的查詢不會馬上又加分)"""
+        for category in categories:
+            record = self._records.get((client, category))
+            if record:
+                record.score = 0.0
+
+    def evict(self, now: float) -> int:
+        """刪除閒置超過 ttl 的紀錄 (只看最舊的一端)，回傳刪除的筆數"""
+        cutoff = now - self.ttl
+        count = 0
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.updated >= cutoff:
+                break
+            del self._records[key]
+            count += 1
+        return count
@@ -0,0 +1,267 @@
+# src/detection/service.py
+"""
+違規偵測 (在後端的 event loop 裡執行)
+
+原本 LSA/detect_violation.py 是另一個 root 行程：自己的鄰居表、自己的資料庫連線、
+每輪 time.sleep；現在改成 FastAPI 的背景工作，直接共用後端的 NeighborCache 與防火牆控制器，
+讀 Pi-hole 與寫資料庫都丟到執行緒，不會卡住 event loop
+
+查詢一到就計分 (DnsLogTailer 約 1 秒內)，分數隨時間指數衰減 (ScoreBoard)，
+時間以查詢的時間戳為準，重播錄下來的 log 也會得到相同的結果
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from src.db.repositories import DeviceLastSeenRepository, StudentRepository
+from src.db.violations import ViolationEventWriter
+from src.detection.matcher import DomainMatcher
+from src.detection.pihole import DnsQuery
+from src.detection.scoring import ScoreBoard
+from src.network.neighbors import NeighborCache
+
+logger = logging.getLogger(__name__)
+
+# --- 設定區 ---
+SCORE_INCREMENT_VIDEO = 21  # 偵測到影片網域，加多少分
+SCORE_INCREMENT_GAME = 0    # 偵測到遊戲網域，加多少分
+PUNISH_THRESHOLD = 20       # 積分超過多少才處罰 (累積制)
+MAX_SCORE = 50              # 積分上限 (避免無限疊加)
+SCORE_HALF_LIFE = 240       # 分數減半的秒數 (約同原本每 10 秒扣 1 分：滿分 50 約 5 分鐘降到閥值以下)
+SCORE_TTL = 1200            # 閒置超過幾秒刪除紀錄 (此時分數最多剩 50 / 32)
+CHECK_INTERVAL = 10         # 同一個分類每幾秒最多加一次分；也是檢查待處罰裝置的間隔
+RESTART_DELAY = 1           # 偵測工作出錯後第一次重新啟動前等幾秒 (之後每次加倍)
+RESTART_DELAY_MAX = 300     # 重新啟動的最長間隔
+
+# 分類 -> 每次命中加幾分
+SCORED_CATEGORIES = {
+    "video": SCORE_INCREMENT_VIDEO,
+    "game": SCORE_INCREMENT_GAME,
+}
+
+class ViolationDetector:
+    def __init__(self, source, matcher: DomainMatcher, firewall,
+                 neighbors: NeighborCache, session_factory: Callable[[], Session],
+                 interval: float = CHECK_INTERVAL, dry_run: bool = False,
+                 events: Optional[ViolationEventWriter] = None,
+                 on_punished: Optional[Callable[[str, int], None]] = None):
+        """
+        :param source: DNS 查詢來源，stream() 一批批交出 (timestamp, client, domain)：
+                       DnsLogTailer (即時 tail log) 或 PiholeQueryReader (輪詢資料庫)
+        :param firewall: 防火牆控制器 (block_game / throttle)
+        :param neighbors: IP -> MAC 快取 (與後端共用)
+        :param session_factory: 建立資料庫 Session (在執行緒裡使用)
+        :param interval: 同一個分類的加分間隔，也是重新檢查待處罰裝置、清除閒置紀錄的間隔
+        :param dry_run: 只印出會處罰誰，不動防火牆、不寫資料庫 (重播 log 測試用)
+        :param events: 違規事件的批次寫入 (violation_events)；None 時不留紀錄
+        :param on_punished: 學生被標記為 PUNISHED 後呼叫 (MAC, 累計違規次數)，例如推播給儀表板
+        """
+        self.source = source
+        self.matcher = matcher
+        self.firewall = firewall
+        self.neighbors = neighbors
+        self.session_factory = session_factory
+        self.interval = interval
+        self.dry_run = dry_run
+        self.events = events
+        self.on_punished = on_punished
+        self.student_repo = StudentRepository()
+        self.last_seen_repo = DeviceLastSeenRepository()
+        # (IP, 分類) -> (分數, 最後更新時間)
+        self.board = ScoreBoard(SCORE_HALF_LIFE, MAX_SCORE, SCORE_TTL, min_gap=interval)
+        # 達到閥值但還沒處罰成功的 IP (例如查不到 MAC)，定期重試
+        self._pending: Set[str] = set()
+        # 正在處罰中的 IP (新的查詢與定期重試可能同時觸發)
+        self._punishing: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = 0.0
+        self._restart_delay = RESTART_DELAY
+        self._restart: Optional[asyncio.TimerHandle] = None
+
+    # --- 生命週期 ---
+
+    def start(self) -> None:
+        """在 event loop 裡開始偵測；工作出錯結束時等一段時間 (指數退避) 再重新啟動"""
+        self._restart = None
+        self._started_at = time.monotonic()
+        self._task = asyncio.create_task(self.run())
+        self._task.add_done_callback(self._on_done)
+
+    def stop(self) -> None:
+        if self._restart:
+            self._restart.cancel()
+            self._restart = None
+        if self._task:
+            self._task.remove_done_callback(self._on_done)
+            self._task.cancel()
+            self._task = None
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._task = None
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            # 來源正常結束 (重播檔案讀完)，不需要重新啟動
+            logger.info("違規偵測結束")
+            return
+        # 跑了一段時間才出錯的，從最短的間隔重新開始退避
+        if time.monotonic() - self._started_at > RESTART_DELAY_MAX:
+            self._restart_delay = RESTART_DELAY
+        logger.error(f"違規偵測意外停止，{self._restart_delay} 秒後重新啟動: {error!r}")
+        self._restart = asyncio.get_running_loop().call_later(self._restart_delay, self.start)
+        self._restart_delay = min(self._restart_delay * 2, RESTART_DELAY_MAX)
+
+    async def run(self) -> None:
+        """消化 DNS 查詢直到來源結束 (重播檔案讀完)；即時來源不會結束"""
+        logger.info("違規偵測啟動")
+        # 重播 (follow=False) 時不需要依現在時間重試 / 清除
+        live = getattr(self.source, "follow", True)
+        ticker = asyncio.create_task(self._maintenance_loop()) if live else None
+        try:
+            async for queries in self.source.stream():
+                try:
+                    await self.process(queries)
+                except Exception as e:
+                    print(f"[Detector Error] {e}")
+        finally:
+            if ticker:
+                ticker.cancel()
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain(time.time())
+            except Exception as e:
+                print(f"[Detector Error] {e}")
+
+    # --- 偵測 ---
+
+    async def process(self, queries: Iterable[DnsQuery]) -> List[Tuple[str, str, str]]:
+        """
+        新的查詢一到就加分，達到閥值立即處罰
+        :return: 處罰的 (IP, MAC, 類型)
+        """
+        offenders = self.observe(queries)
+        return await self.punish(offenders) if offenders else []
+
+    async def maintain(self, now: float) -> List[Tuple[str, str, str]]:
+        """清除閒置的紀錄，並重試還在閥值以上、之前沒處罰成功的裝置"""
+        self.board.evict(now)
+        offenders = self._offenders(self._pending, now)
+        self._pending = {ip for ip, _ in offenders}
+        return await self.punish(offenders) if offenders else []
+
+    def observe(self, queries: Iterable[DnsQuery]) -> List[Tuple[str, str]]:
+        """
+        套用一批查詢的加分 (只動到有新查詢的裝置)
+        :return: 這批查詢裡達到處罰閥值的 (IP, 類型)
+        """
+        touched = set()
+        latest = None
+        for timestamp, client_ip, domain in queries:
+            category = self.matcher.match(domain)
+            if category not in SCORED_CATEGORIES:
+                continue
+            self.board.hit(client_ip, category, SCORED_CATEGORIES[category], timestamp)
+            touched.add(client_ip)
+            latest = timestamp
+        if latest is None:
+            return []
+        self.board.evict(latest)
+
+        for ip in touched:
+            scores = self.board.scores(ip, SCORED_CATEGORIES, latest)
+            print(f"IP: {ip} | 影片積分: {scores['video']:.0f} | 遊戲積分: {scores['game']:.0f}")
+        offenders = self._offenders(touched, latest)
+        self._pending.update(ip for ip, _ in offenders)
+        return offenders
+
+    def _offenders(self, ips: Iterable[str], now: float) -> List[Tuple[str, str]]:
+        """達到閥值的 (IP, 類型)，遊戲優先"""
+        offenders = []
+        for ip in ips:
+            if self.board.score(ip, "game", now) >= PUNISH_THRESHOLD:
+                offenders.append((ip, "GAME"))
+            elif self.board.score(ip, "video", now) >= PUNISH_THRESHOLD:
+                offenders.append((ip, "VIDEO"))
+        return offenders
+
+    async def punish(self, offenders: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+        offenders = [(ip, violation_type) for ip, violation_type in offenders if ip not in self._punishing]
+        if not offenders:
+            return []
+        self._punishing.update(ip for ip, _ in offenders)
+        try:
+            # IP -> MAC 先查記憶體，查不到的才一起丟到執行緒查資料庫
+            macs = {ip: self.neighbors.get_mac(ip) for ip, _ in offenders}
+            macs, punished = await asyncio.to_thread(self._resolve, macs)
+
+            done = []
+            for ip, violation_type in offenders:
+                mac = macs.get(ip)
+                if not mac or mac.lower() in punished:
+                    continue
+                print(f"🚨 違規偵測確認！IP: {ip} / MAC: {mac} / 類型: {violation_type}")
+                action = "block_game" if violation_type == "GAME" else "throttle"
+                if self.dry_run:
+                    ok = True
+                elif violation_type == "GAME":
+                    # 阻斷遊戲 (UDP)
+                    ok = await self.firewall.block_game(ip)
+                else:
+                    # 限速 (HTB 慢速通道)
+                    ok = await self.firewall.throttle(ip)
+                if ok is False:
+                    continue
+                if self.events and not self.dry_run:
+                    self.events.add(mac, ip, violation_type, action)
+                # 處罰後將分數歸零，避免重複處罰
+                self.board.reset(ip, SCORED_CATEGORIES)
+                self._pending.discard(ip)
+                done.append((ip, mac, violation_type))
+
+            if done and not self.dry_run:
+                counts = await asyncio.to_thread(self._record, done)
+                if self.on_punished:
+                    for mac, count in counts.items():
+                        self.on_punished(mac, count)
+            return done
+        finally:
+            self._punishing.difference_update(ip for ip, _ in offenders)
+
+    # --- 資料庫 (執行緒裡執行) ---
+
+    def _resolve(self, macs: Dict[str, Optional[str]]) -> Tuple[Dict[str, Optional[str]], List[str]]:
+        db = self.session_factory()
+        try:
+            # device_last_seen 以 UTC (naive) 儲存
+            cutoff = datetime.utcnow() - timedelta(hours=24)
+            for ip, mac in macs.items():
+                if mac is None:
+                    device = self.last_seen_repo.get_by_ip(db, ip, since=cutoff)
+                    macs[ip] = device.mac_address if device else None
+            known = [mac for mac in macs.values() if mac]
+            punished = self.student_repo.get_punished_macs(db, known) if known else []
+            return macs, punished
+        finally:
+            db.close()
+
+    def _record(self, punished: List[Tuple[str, str, str]]) -> Dict[str, int]:
+        """標記為 PUNISHED，回傳 {MAC: 累計違規次數} (只含學生)"""
+        counts = {}
+        db = self.session_factory()
+        try:
+            for _, mac, violation_type in punished:
+                student = self.student_repo.mark_punished(db, mac)
+                if student:
+                    print(f"[DB] 學生 {student.name} ({student.student_id}) 因 {violation_type} 已被標記為 PUNISHED")
+                    counts[mac] = student.violation_count
+        finally:
+            db.close()
+        return counts
@@ -27,8 +27,10 @@ const app = createApp({
         const paymentAmount = ref(9.99);     
         const paymentReason = ref('');
         
-        let statusCheckInterval = null;
-        let paymentPollingInterval = null;
+        // 長輪詢：後端在狀態改變 (授權 / 付款) 時才回應，最多等 LONG_POLL_WAIT 秒
+        const LONG_POLL_WAIT = 25;
+        let statusCheckActive = false;
+        let paymentPollingActive = false;
 
         const shortMac = computed(() => macAddress.value || 'Unknown Device');
 
@@ -52,25 +54,42 @@ const app = createApp({
                 currentPage.value = pendingFate;
             }
 
-            statusCheckInterval = setInterval(checkAuthStatus, 3000);
+            checkAuthStatus();
         });
 
-        const checkAuthStatus = async () => {
-            if (!macAddress.value) return;
-            try {
-                const res = await fetch(`${API_BASE}/auth/status?mac=${macAddress.value}`);
-                if (res.ok) {
-                    const data = await res.json();
-                    if (data.authorized) {
-                        handleSuccessRedirect();
+        const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+        // 反覆長輪詢 url，直到 isDone(data) 成立或 isActive() 變成 false
+        const longPoll = async (url, isActive, isDone) => {
+            while (isActive()) {
+                try {
+                    const res = await fetch(`${url}&wait=${LONG_POLL_WAIT}`);
+                    if (res.ok) {
+                        const data = await res.json();
+                        if (isDone(data)) return true;
+                        continue;
                     }
-                }
-            } catch (e) { /* ignore */ }
+                } catch (e) { /* ignore */ }
+                // 伺服器錯誤或斷線時稍等再試，避免連續重送
+                await sleep(3000);
+            }
+            return false;
+        };
+
+        const checkAuthStatus = async () => {
+            if (!macAddress.value || statusCheckActive) return;
+            statusCheckActive = true;
+            const authorized = await longPoll(
+                `${API_BASE}/auth/status?mac=${macAddress.value}`,
+                () => statusCheckActive,
+                data => data.authorized
+            );
+            if (authorized) handleSuccessRedirect();
         };
 
         const handleSuccessRedirect = () => {
-            if (statusCheckInterval) clearInterval(statusCheckInterval);
-            if (paymentPollingInterval) clearInterval(paymentPollingInterval);
+            statusCheckActive = false;
+            paymentPollingActive = false;
 
             // 清除所有暫存
             localStorage.removeItem('user_fate');
@@ -235,25 +254,25 @@ const app = createApp({
         };
 
         // --- 5. 付款 Polling ---
-        const startPaymentPolling = () => {
-            if (paymentPollingInterval) clearInterval(paymentPollingInterval);
-            paymentPollingInterval = setInterval(async () => {
-                try {
-                    const res = await fetch(`${API_BASE}/payment/check?mac=${macAddress.value}`);
-                    const data = await res.json();
-                    if (data.status === 'paid') {
-                        isProcessingPayment.value = true; 
-                        handleSuccessRedirect();
-                    }
-                } catch (e) { console.error(e); }
-            }, 3000);
+        const startPaymentPolling = async () => {
+            if (paymentPollingActive) return;
+            paymentPollingActive = true;
+            const paid = await longPoll(
+                `${API_BASE}/payment/check?mac=${macAddress.value}`,
+                () => paymentPollingActive,
+                data => data.status === 'paid'
+            );
+            if (paid) {
+                isProcessingPayment.value = true; 
+                handleSuccessRedirect();
+            }
         };
 
         const processPayment = async () => { /* 備用 */ };
 
         onUnmounted(() => {
-            if (statusCheckInterval) clearInterval(statusCheckInterval);
-            if (paymentPollingInterval) clearInterval(paymentPollingInterval);
+            statusCheckActive = false;
+            paymentPollingActive = false;
         });
 
         window.resetTest = () => {
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 from sqlalchemy.orm import Session
 from src.core.auth_service import AuthorizationService
 
@@ -9,11 +9,14 @@ class CaptivePortalService:
     async def check_authorization_status(self, db: Session, mac: str) -> bool:
         return await self.auth_service.is_authorized(db, mac)
 
-    async def authorize_device(self, db: Session, mac: str, ip: str):
-        await self.auth_service.authorize(db, mac, ip, details={"source": "captive_portal"})
+    async def authorize_device(self, db: Session, mac: str, ip: Optional[str] = None):
+        details = {"source": "captive_portal"}
+        if ip:
+            details["ip"] = ip
+        await self.auth_service.authorize(db, mac, details=details)
 
-    async def revoke_device(self, db: Session, mac: str, ip: str):
-        await self.auth_service.revoke(db, mac, ip)
+    async def revoke_device(self, db: Session, mac: str):
+        await self.auth_service.revoke(db, mac)
 
     async def get_portal_config(self) -> Dict:
         return {
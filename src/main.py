@@ -1,7 +1,8 @@
-import asyncio, uvicorn, random, os, uuid
-from datetime import datetime, timedelta
-from typing import Optional, List
-from fastapi import FastAPI, Request, Depends, Header, HTTPException, UploadFile, File
+import asyncio, uvicorn, random, os, uuid, hmac
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Set
+from fastapi import FastAPI, Request, Response, Depends, Header, HTTPException, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -11,23 +12,40 @@ from src.ai.pdf_loader import pdf_loader
 from src.ai.service import AIQuizService
 
 # 資料庫相關
-from src.db.database import get_db, init_db, SessionLocal
+from src.db.database import get_db, init_db, SessionLocal, engine
+from src.db.partitions import ConnectionLogPartitionManager
 from src.db.models import StudentRecord, ConnectionLog, QuizAttempt, LoginRequest, RegisterRequest, User
-from src.db.repositories import AuthorizationLogRepository, StudentRepository, ConnectionLogRepository, UserRepository
+from src.db.repositories import AuthorizationLogRepository, StudentRepository, ConnectionLogRepository, DeviceLastSeenRepository, UserRepository, ViolationEventRepository
+from src.db.violations import ViolationEventWriter
 
 # 核心服務與網路元件
 # 測試用 Mock，實際換成 ShellScriptFirewallController
-from src.network.firewall import MockFirewallController
+from src.network.firewall import BatchingFirewallController, MockFirewallController, NftablesFirewallController
+from src.network.agent import AgentFirewallController
 from src.network.scanner import ARPScanner
-from src.network.registry import StudentRegistryService
+from src.network.presence import PresenceMonitor
+from src.network.neighbors import NeighborCache
+from src.network.shaper import TrafficShaper
+from src.network.registry import StudentRegistryService, PresenceTable, HEARTBEAT_INTERVAL
 from src.core.auth_service import AuthorizationService
+from src.core.roster import RosterSnapshot
+from src.core.traffic import TrafficMeter
+from src.core.events import EventBus
 from src.gateway.service import CaptivePortalService
+from src.detection.matcher import load_default as load_blocklists
+from src.detection.pihole import PIHOLE_DB_PATH, PiholeQueryReader
+from src.detection.dnslog import PIHOLE_LOG_PATH, DnsLogTailer
+from src.detection.service import ViolationDetector
 
 # === 設定區 ===
 # 請使用 ip addr 確認無線網卡名稱 (例如 wlan0, wlp2s0)
 WIFI_INTERFACE = "eno1"  
 # 設定熱點網段 (例如 192.168.10.0/24)
 TARGET_NETWORK = "192.168.10.0/24"
+# 防火牆後端：mock (開發測試) / agent (正式環境，交給 root 的防火牆代理) / nftables (後端本身以 root 執行)
+FIREWALL_BACKEND = os.getenv("FIREWALL_BACKEND", "mock")
+# Telegram Bot 呼叫後端 (開通網路 / 付款解鎖) 時帶的共用密鑰，與 payment_local.py 設定相同的值
+BACKEND_API_SECRET = os.getenv("BACKEND_API_SECRET", "")
 
 # 初始化 AI (Mistral 跑不動)
 ai_service = AIQuizService(model="gemma2:2b")
@@ -55,6 +73,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 儀表板 (不同 port) 需要讀取名單的版本資訊
+    expose_headers=["ETag", "X-Roster-Cursor"],
 )
 
 # Dependency: 資料庫 Session
@@ -68,12 +88,56 @@ def get_db():
 # Dependency Injection：系統元件初始化
 auth_repo = AuthorizationLogRepository()
 scanner = ARPScanner(interface=WIFI_INTERFACE)
-# 測試用 Mock，實際換成 ShellScriptFirewallController() 
-firewall_controller = MockFirewallController()
-auth_service = AuthorizationService(auth_repo, firewall_controller)
+# IP <-> MAC 快取，由 PresenceMonitor 收到的鄰居表事件增量更新
+neighbor_cache = NeighborCache(interface=WIFI_INTERFACE)
+presence_monitor = PresenceMonitor(interface=WIFI_INTERFACE, ip_range=TARGET_NETWORK, prober=scanner,
+                                   neighbors=neighbor_cache)
+# 在線 session 表 (跨掃描保存，只有狀態轉換才寫 DB)
+presence_table = PresenceTable()
+partition_manager = ConnectionLogPartitionManager(engine)
+# 預設為測試用 Mock，正式環境設定 FIREWALL_BACKEND=agent
+nft_firewall = None
+if FIREWALL_BACKEND == "nftables":
+    nft_firewall = NftablesFirewallController(WIFI_INTERFACE, TARGET_NETWORK)
+    # 短時間內的多筆授權變更合併成一個 nft transaction，限速交給 tc
+    firewall_controller = BatchingFirewallController(nft_firewall, TrafficShaper(WIFI_INTERFACE))
+elif FIREWALL_BACKEND == "agent":
+    # python -m src.network.agent 以 root 執行，後端本身不需要 sudo
+    firewall_controller = AgentFirewallController()
+else:
+    firewall_controller = MockFirewallController()
+# 後端狀態變化的推播來源 (教室儀表板 SSE)
+event_bus = EventBus()
+auth_service = AuthorizationService(auth_repo, firewall_controller, events=event_bus)
 portal_service = CaptivePortalService(auth_service)
 student_repo = StudentRepository() 
 user_repo = UserRepository()
+last_seen_repo = DeviceLastSeenRepository()
+connection_repo = ConnectionLogRepository()
+violation_repo = ViolationEventRepository()
+# 教師儀表板的名單快照 (last_seen 每 HEARTBEAT_INTERVAL 秒才批次寫回，在線判斷要多給這段緩衝)
+roster = RosterSnapshot(online_window=30 + HEARTBEAT_INTERVAL)
+# 每位學生最近 10 分鐘的流量 (nftables 計數，每 10 秒取樣一次)
+traffic_meter = TrafficMeter(interval=10, history=60)
+
+# 違規偵測 (讀 Pi-hole 的 DNS 查詢)，與後端共用鄰居表快取與防火牆控制器
+# 讀得到查詢 log 就即時跟隨 (約 1 秒)，否則退回輪詢 pihole-FTL.db (最多晚 60 秒以上)
+# (後端不是 root：pihole.log 預設 0640，要把執行後端的使用者加進 pihole 群組)
+if os.access(PIHOLE_LOG_PATH, os.R_OK):
+    dns_source = DnsLogTailer(PIHOLE_LOG_PATH)
+else:
+    if os.path.exists(PIHOLE_LOG_PATH):
+        print(f"[Detector] 沒有 {PIHOLE_LOG_PATH} 的讀取權限，改為輪詢 Pi-hole 資料庫")
+    dns_source = PiholeQueryReader(PIHOLE_DB_PATH)
+# 違規事件先進緩衝區，每 5 秒批次寫入 violation_events 並累加每日彙總
+violation_writer = ViolationEventWriter(SessionLocal, flush_interval=5)
+violation_detector = ViolationDetector(dns_source, load_blocklists(), firewall_controller,
+                                       neighbor_cache, SessionLocal, events=violation_writer,
+                                       on_punished=lambda mac, count: publish_student_change(
+                                           mac, "violation", violation_count=count))
+
+# 長輪詢 (?wait=) 最多等幾秒，避免連線被中間的 proxy 切斷
+LONG_POLL_MAX_WAIT = 30
 
 # --- 題目答案暫存區 ---
 # 結構: { "question_uuid": "A" }
@@ -83,6 +147,14 @@ ACTIVE_QUIZZES = {}
 # 格式: { "MAC_ADDRESS": { "penalty": 0, "wrong_count": 0 } }
 student_quiz_state = {}
 
+# === Helper: Telegram Bot 專用 API 的共用密鑰 ===
+async def verify_bot_secret(x_backend_secret: Optional[str] = Header(None, alias="X-Backend-Secret")) -> None:
+    """沒有設定 BACKEND_API_SECRET 時一律拒絕，避免任何人都能替別人開通網路"""
+    if not BACKEND_API_SECRET or not hmac.compare_digest(
+        (x_backend_secret or "").encode(), BACKEND_API_SECRET.encode()
+    ):
+        raise HTTPException(status_code=403, detail="密鑰錯誤")
+
 # === Helper: 取得 MAC ===
 async def get_current_mac(
     request: Request,
@@ -108,122 +180,104 @@ async def get_current_mac(
 
     print(f"[MAC Lookup] 嘗試透過 IP 反查: {client_ip}")
 
-    # 查詢 ConnectionLog 表
-    # 邏輯：找這個 IP 最近的一筆連線紀錄
-    last_log = db.query(ConnectionLog)\
-    .filter(ConnectionLog.ip_address == client_ip)\
-    .order_by(ConnectionLog.timestamp.desc())\
-    .first()
+    # 優先順序 3：記憶體中的鄰居表快取 (最即時，O(1) 查表)
+    mac = neighbor_cache.get_mac(client_ip)
+    if mac:
+        print(f"[MAC Lookup] 鄰居表命中: {mac}")
+        return mac
 
-    if last_log:
-        print(f"[MAC Lookup] 找到對應 MAC: {last_log.mac_address}")
-        return last_log.mac_address
+    # 優先順序 4 (保底)：查詢 device_last_seen 表 (IP 索引點查詢)
+    # 邏輯：找最後一次使用這個 IP 的裝置 (例如鄰居表項目已被 kernel 回收)
+    device = last_seen_repo.get_by_ip(db, client_ip)
 
-    # 優先順序 4 (保底)：如果資料庫也沒有，嘗試讀取系統 ARP 表 (更即時)
-    # 有時候資料庫還沒寫入，但系統底層已經有 ARP 了
-    try:
-        with open('/proc/net/arp', 'r') as f:
-            lines = f.readlines()[1:] # 跳過標題
-            for line in lines:
-                parts = line.split()
-                # parts[0] 是 IP, parts[3] 是 MAC
-                if len(parts) >= 4 and parts[0] == client_ip:
-                    print(f"[MAC Lookup] ARP 表命中: {parts[3]}")
-                    return parts[3]
-    except Exception as e:
-        print(f"[MAC Lookup] ARP 讀取失敗: {e}")
+    if device:
+        print(f"[MAC Lookup] 找到對應 MAC: {device.mac_address}")
+        return device.mac_address
 
     print(f"[MAC Lookup] 無法識別 MAC，IP: {client_ip}")
     return "00:00:00:00:00:00"
 
 def get_ip_by_mac(target_mac: str) -> Optional[str]:
     """
-    簡單讀取 /proc/net/arp 來尋找對應 MAC 的 IP
-    注意：這需要該設備近期有發送過封包，ARP 表才會有紀錄
+    從鄰居表快取尋找對應 MAC 的 IP
+    注意：這需要該設備近期有發送過封包，鄰居表才會有紀錄
     """
-    try:
-        with open('/proc/net/arp', 'r') as f:
-            lines = f.readlines()[1:] # 跳過標題
-            for line in lines:
-                parts = line.split()
-                if len(parts) >= 4:
-                    ip = parts[0]
-                    mac = parts[3]
-                    if mac.lower() == target_mac.lower():
-                        return ip
-    except Exception as e:
-        print(f"[ARP Lookup Error] {e}")
-    return None
+    return neighbor_cache.get_ip(target_mac)
 
 # === ### 新增: 執行解鎖 Script 的 Helper ===
-def execute_restore_script(ip: str, interface: str):
-    """
-    執行 sudo ./restore.sh <IP> <介面>
-    注意：執行此程式的使用者需要有 sudo 權限且設定 NOPASSWD，否則會卡在輸入密碼。
-    """
-    try:
-        print(f"[System] 執行解鎖腳本: sudo ./restore.sh {ip} {interface}")
-        # 確保 restore.sh 有執行權限 (chmod +x restore.sh)
-        result = subprocess.run(
-            ["sudo", "./restore.sh", ip, interface],
-            capture_output=True,
-            text=True,
-            check=False # 不拋出異常，手動檢查 returncode
-        )
-        
-        if result.returncode == 0:
-            print(f"[System] 解鎖成功: {result.stdout}")
-            return True
-        else:
-            print(f"[System] 解鎖失敗 (Code {result.returncode}): {result.stderr}")
-            return False
-    except Exception as e:
-        print(f"[System] 執行腳本發生錯誤: {e}")
+async def restore_network(ip: str) -> bool:
+    """解除該 IP 的遊戲阻斷與限速 (取代 sudo ./restore.sh，由防火牆控制器 / 代理執行)"""
+    print(f"[System] 解除限制: {ip}")
+    if not await firewall_controller.restore(ip):
+        print(f"[System] 解鎖失敗: {ip}")
         return False
+    return True
 
-def check_and_mark_offline(db: Session, timeout_seconds: int = 45):
+def check_and_mark_offline(db: Session, timeout_seconds: int = 45) -> List[str]:
     """
-    檢查所有目前狀態為 'online' 的學生
-    如果他們最近一筆連線紀錄超過 timeout_seconds 秒，就標記為 'offline'
+    把目前狀態為 'online'，但 session 已結束 (disconnected) 或超過 timeout_seconds 秒沒看到的學生標記為 'offline'
+    整個判斷是一條 UPDATE ... RETURNING，花費不隨名單人數增加
+    :return: 這次變成離線的 MAC (給後續的登出動作使用)
     """
+    # 注意：必須跟 device_last_seen 的寫入時間時區一致 (utcnow)
+    # last_seen 是每 HEARTBEAT_INTERVAL 秒才批次寫回，所以要多給這段緩衝
+    cutoff_time = datetime.utcnow() - timedelta(seconds=timeout_seconds + HEARTBEAT_INTERVAL)
     try:
-        # 1. 找出所有目前資料庫標記為 online 的學生
-        online_students = db.query(StudentRecord).filter(StudentRecord.status == 'online').all()
-        
-        # 設定逾時時間點 (現在時間 - 容許秒數)
-        # 注意：這裡必須跟 ConnectionLog 的寫入時間時區一致，建議都用 utcnow
-        cutoff_time = datetime.utcnow() - timedelta(seconds=timeout_seconds)
-        
-        offline_count = 0
-        
-        for student in online_students:
-            # 2. 找該學生最後一次的連線紀錄
-            last_log = db.query(ConnectionLog)\
-                .filter(ConnectionLog.mac_address == student.mac_address)\
-                .order_by(ConnectionLog.timestamp.desc())\
-                .first()
-
-            if last_log:
-                now = datetime.utcnow()
-                diff = now - last_log.timestamp
-                print(f"現在時間: {datetime.utcnow()}")
-                print(f"最後紀錄: {last_log.timestamp}")
-                print(f"相差秒數: {diff.total_seconds()}")
-            
-            # 3. 判斷是否逾時
-            # 如果完全沒紀錄，或者最後紀錄時間早於截止時間 -> 判定離線
-            if not last_log or last_log.timestamp < cutoff_time:
-                print(f"[System] 偵測到 {student.name} ({student.mac_address}) 已離線")
-                student.status = 'offline'
-                offline_count += 1
-        
-        if offline_count > 0:
-            db.commit()
-            # print(f"[System] 已將 {offline_count} 位使用者標記為離線")
-            
+        offline_macs = student_repo.mark_offline(db, cutoff_time)
     except Exception as e:
         print(f"[Check Offline Error] {e}")
         db.rollback()
+        return []
+
+    if offline_macs:
+        print(f"[System] 偵測到 {len(offline_macs)} 位使用者離線: {', '.join(offline_macs)}")
+    return offline_macs
+
+# 離線撤銷授權時防火牆沒有套用成功的 MAC (下一輪重試 deny)
+pending_denies: Set[str] = set()
+
+def publish_student_change(mac: str, event_type: str, **fields) -> None:
+    """學生狀態一改變就更新名單快照並推播 (不等 5 秒一次的名單比對)"""
+    change = roster.apply(mac, **fields)
+    if change:
+        event_bus.publish(event_type, change[1])
+
+async def logout_offline_students(db: Session, offline_macs: List[str]) -> None:
+    """
+    check_and_mark_offline 回傳的離線學生：推播離線、撤銷授權 (移出防火牆放行名單)、標記為 log_out
+    取代 LSA/login.py 每 5 秒輪詢 status='offline' 再踢除，授權狀態也會一起更新
+    """
+    for mac in offline_macs:
+        publish_student_change(mac, "offline", status="offline")
+    retry = list(pending_denies)
+    pending_denies.clear()
+    authorized = [mac for mac in offline_macs if await auth_service.is_authorized(db, mac)]
+    # 同時送出，批次防火牆會合併成一個 transaction
+    results = await asyncio.gather(
+        *(auth_service.revoke(db, mac) for mac in authorized),
+        *(firewall_controller.deny_device(mac) for mac in retry)
+    )
+    for mac, ok in zip(authorized + retry, results):
+        if ok is False:
+            pending_denies.add(mac)
+    student_repo.mark_logged_out(db, offline_macs)
+    if authorized:
+        print(f"[System] 已登出 {len(authorized)} 位離線使用者")
+
+def refresh_roster(db: Session) -> None:
+    """
+    重建名單快照，並把有變動的學生推播給儀表板
+    上線 / 離線 / 違規在狀態改變時就已經推播 (publish_student_change)；這裡補上其他來源的變動 (例如新增學生)
+    """
+    for before, after in roster.refresh(student_repo.get_roster(db)):
+        if after is None:
+            event_bus.publish("student_removed", {"student_id": before["student_id"]})
+        elif before and after["violation_count"] > before["violation_count"]:
+            event_bus.publish("violation", after)
+        elif before is None or before["status"] != after["status"]:
+            event_bus.publish(after["status"], after)
+        else:
+            event_bus.publish("student", after)
 
 # === 定期掃描網路 (Background Task) ===
 async def network_scanner_loop():
@@ -231,16 +285,27 @@ async def network_scanner_loop():
     while True:
         try:
             db = SessionLocal()
-            registry_service = StudentRegistryService(db)
+            registry_service = StudentRegistryService(db, presence_table)
             
-            # 1. 執行掃描 (將掃到的裝置更新為 Online / 寫入 Log)
-            scan_results = scanner.scan(TARGET_NETWORK) 
-            if scan_results:
-                registry_service.process_scan_results(scan_results)
+            # 1. 取得目前在線裝置 (將掃到的裝置更新為 Online / 寫入 Log)
+            # 優先使用 PresenceMonitor 記住的鄰居表 (不發任何封包)
+            # 監聽失敗 (非 Linux / 權限不足) 時才退回 ARP 廣播掃描，掃描在背景執行緒進行，不會卡住 event loop
+            if presence_monitor.running:
+                scan_results = presence_monitor.snapshot()
+            else:
+                scan_results = await scanner.scan_async(TARGET_NETWORK)
+            # 就算沒掃到任何裝置也要處理，才能結束逾時的 session
+            registry_service.process_scan_results(scan_results)
             
             # 2. ### 新增：檢查並標記離線使用者 ###
             # 建議設定 45~60 秒。因為掃描每 5 秒一次，給一點緩衝避免訊號不穩閃爍
-            check_and_mark_offline(db, timeout_seconds=45)
+            offline_macs = check_and_mark_offline(db, timeout_seconds=45)
+            # 離線的學生直接登出 (撤銷授權 + 防火牆)；上一輪失敗的也在這裡重試
+            if offline_macs or pending_denies:
+                await logout_offline_students(db, offline_macs)
+
+            # 3. 重建儀表板名單快照 (一個 JOIN 查詢，API 直接回傳記憶體結果)，有變動才推播
+            refresh_roster(db)
             
             db.close()
         except Exception as e:
@@ -248,20 +313,88 @@ async def network_scanner_loop():
             pass
             
         await asyncio.sleep(5)
+
+# === 鄰居表事件 (Background Task) ===
+async def presence_event_loop():
+    """裝置一出現 / 換 IP 就立刻寫入，不用等下一輪掃描"""
+    while True:
+        event = await presence_monitor.events.get()
+        # 離線仍交給 check_and_mark_offline 的緩衝時間判定，避免訊號不穩時閃爍
+        if event.event == "gone":
+            continue
+        db = SessionLocal()
+        try:
+            StudentRegistryService(db, presence_table).process_scan_results([event])
+            publish_student_change(event.mac, "online", status="online")
+        except Exception as e:
+            print(f"[Presence Loop Error] {e}")
+        finally:
+            db.close()
+
+# === 流量取樣 (Background Task) ===
+async def traffic_sampler_loop():
+    """讀取 nftables 的每 IP 計數換算成速率，有變化的學生推播給儀表板"""
+    while True:
+        await asyncio.sleep(traffic_meter.interval)
+        try:
+            counters = await firewall_controller.read_counters()
+            rates = traffic_meter.sample(counters, neighbor_cache.get_mac)
+            if rates:
+                event_bus.publish("traffic", {"rates": rates})
+        except Exception as e:
+            print(f"[Traffic Error] {e}")
+
+# === 連線紀錄分區維護 (Background Task) ===
+async def partition_maintenance_loop():
+    """每小時建立新分區、彙總並刪除過期的分區 (init_db 啟動時已先跑過一次)"""
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            await asyncio.to_thread(partition_manager.run_maintenance)
+        except Exception as e:
+            print(f"[Partition Error] {e}")
+
 @app.on_event("startup")
 async def startup_event():
     # 建立資料庫表格
     init_db()
+    event_bus.bind(asyncio.get_running_loop())
     os.makedirs("data/uploads", exist_ok=True)
     
+    # 被動監聽鄰居表 (失敗時 network_scanner_loop 會自動改用 ARP 掃描)
+    if presence_monitor.start():
+        asyncio.create_task(presence_event_loop())
+    elif neighbor_cache.open():
+        # 無法監聽出席事件時，IP <-> MAC 快取仍自行訂閱鄰居表
+        neighbor_cache.attach()
     asyncio.create_task(network_scanner_loop())
+    asyncio.create_task(partition_maintenance_loop())
+    asyncio.create_task(traffic_sampler_loop())
+    # 本機有 Pi-hole 才啟動違規偵測
+    if os.path.exists(PIHOLE_LOG_PATH) or os.path.exists(PIHOLE_DB_PATH):
+        violation_writer.start()
+        violation_detector.start()
     
     # 恢復防火牆狀態 (使用 Mock 不會報錯)
+    if nft_firewall:
+        # 後端重新啟動時 kernel 的 table 還在：先讀回已授權 / 懲罰中的名單，setup 重建時一併放回
+        await nft_firewall.load_existing()
+        await firewall_controller.shaper.load_existing()
+        if not await nft_firewall.setup():
+            raise RuntimeError("無法建立 nftables 規則 (需要 root 與 nft，且不能留有 iptables 舊規則)")
+        await firewall_controller.shaper.setup()
     db = SessionLocal()
     await auth_service.restore_state(db)
     db.close()
     print("[System] 系統啟動完成")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 緩衝區裡還沒寫入的違規事件
+    violation_detector.stop()
+    await violation_writer.stop()
+    pdf_loader.shutdown()
+
 # === API Endpoints ===
 
 @app.get("/api/health")
@@ -274,11 +407,22 @@ async def get_config():
 
 @app.get("/api/auth/status")
 async def check_auth_status(
+    wait: float = 0,
     mac: str = Depends(get_current_mac),
     db: Session = Depends(get_db)
 ):
-    """前端 Polling 狀態"""
-    is_authorized = await portal_service.check_authorization_status(db, mac)
+    """
+    前端查詢授權狀態
+    ?wait=<秒>：尚未授權時不立即回應，等到授權 / 付款事件或逾時 (長輪詢，最多 LONG_POLL_MAX_WAIT 秒)
+    """
+    # 先登記再檢查，檢查到開始等待之間發生的事件也不會漏掉
+    with event_bus.watch(mac) as watcher:
+        is_authorized = await portal_service.check_authorization_status(db, mac)
+        if not is_authorized and wait > 0:
+            # 等待期間不佔用資料庫連線
+            db.rollback()
+            if await watcher.wait(min(wait, LONG_POLL_MAX_WAIT)):
+                is_authorized = await portal_service.check_authorization_status(db, mac)
     return {"mac": mac, "authorized": is_authorized}
 
 # --- Dashboard 相關 API ---
@@ -331,39 +475,89 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
     }
 
 @app.get("/api/students")
-async def get_students(db: Session = Depends(get_db)):
-    students = student_repo.get_all_students(db) # 這裡現在會正常運作了
-    response_data = []
-    
-    cutoff_time = datetime.utcnow() - timedelta(seconds=30)
+async def get_students(
+    response: Response,
+    since: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    db: Session = Depends(get_db)
+):
+    """
+    學生名單 (由記憶體快照提供，不再逐一查詢每位學生)
+    - If-None-Match 與目前 ETag 相同 -> 304
+    - ?since=<X-Roster-Cursor> -> 只回傳該版本之後有變動的學生
+    """
+    # 背景掃描停擺時才會在這裡重建 (一個 JOIN 查詢)
+    if roster.is_stale:
+        refresh_roster(db)
+
+    headers = {"ETag": roster.etag, "X-Roster-Cursor": str(roster.version), "Cache-Control": "no-cache"}
+    if if_none_match == roster.etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    if since is None:
+        return roster.full()
+
+    delta = roster.changes_since(since)
+    if delta is None:
+        return {"full": True, "students": roster.full(), "removed": []}
+    changed, removed = delta
+    return {"full": False, "students": changed, "removed": removed}
+
+@app.get("/api/traffic")
+async def get_traffic():
+    """
+    每位學生 (MAC) 的即時流量與最近的歷史 (bytes/s，由舊到新)
+    之後的變化由 /api/stream/classroom 的 traffic 事件推播
+    """
+    return {"interval": traffic_meter.interval, "students": traffic_meter.snapshot()}
 
-    for s in students:
-        last_log = db.query(ConnectionLog)\
-            .filter(ConnectionLog.mac_address == s.mac_address)\
-            .order_by(ConnectionLog.timestamp.desc())\
-            .first()
-            
-        is_online = False
-        
-        # 修改這裡：
-        # 前端 teacher.html 判斷 traffic > 1000 才會變紅燈
-        # 我們讓違規次數 > 0 的人，流量看起來很高
-        # TEST
-        current_traffic = s.violation_count * 100 
-        
-        if last_log and last_log.timestamp > cutoff_time:
-            is_online = True
-            
-        response_data.append({
-            "student_id": s.student_id,
-            "name": s.name,
-            "mac": s.mac_address,
-            "status": "online" if is_online else "offline",
-            "violation_count": s.violation_count,
-            "traffic": current_traffic # 傳回計算後的模擬流量
-        })
-        
-    return response_data
+@app.get("/api/violations/summary")
+async def get_violation_summary(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    student_id: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    違規統計 (只讀每日彙總 violation_daily，不掃描事件)
+    預設最近 7 天；totals 為期間內每位學生每個分類的總次數，daily 為逐日明細
+    """
+    until = until or date.today()
+    since = since or until - timedelta(days=6)
+    if since > until:
+        raise HTTPException(status_code=400, detail="since 不能晚於 until")
+    totals = violation_repo.get_totals(db, since, until, student_id=student_id)
+    daily = violation_repo.get_daily(db, since, until, student_id=student_id)
+    return {
+        "since": since,
+        "until": until,
+        "totals": [
+            {"student_id": row.student_id, "category": row.category, "count": row.count,
+             "first_at": row.first_at, "last_at": row.last_at}
+            for row in totals
+        ],
+        "daily": [
+            {"student_id": row.student_id, "day": row.day, "category": row.category, "count": row.count}
+            for row in daily
+        ]
+    }
+
+@app.get("/api/violations")
+async def get_violations(
+    student_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """違規事件明細 (由新到舊)，時間為 UTC"""
+    events = violation_repo.get_events(db, student_id=student_id, since=since, until=until, limit=min(limit, 1000))
+    return [
+        {"occurred_at": e.occurred_at, "student_id": e.student_id, "mac_address": e.mac_address,
+         "ip_address": e.ip_address, "category": e.category, "action": e.action}
+        for e in events
+    ]
 
 @app.post("/api/admin/upload")
 async def upload_material(file: UploadFile = File(...)):
@@ -372,13 +566,26 @@ async def upload_material(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="只支援 PDF 檔案")
     
     content = await file.read()
-    success = pdf_loader.save_and_extract(content, file.filename)
-    
-    if success:
-        return {"message": f"成功載入：{file.filename}，知識庫片段數: {len(pdf_loader.knowledge_base)}"}
-    else:
-        raise HTTPException(status_code=500, detail="解析 PDF 失敗")
-        
+    # 解析在子行程執行，這裡只排入工作；進度由 GET /api/admin/upload/{job} 查詢
+    # 內容與既有教材相同時不會解析 (status: duplicate)
+    job = await pdf_loader.submit(content, file.filename)
+    if job.task:
+        job.task.add_done_callback(lambda _: _announce_upload(job))
+    return JSONResponse(job.to_dict(), status_code=202)
+
+@app.get("/api/admin/upload/{job_id}")
+async def get_upload_status(job_id: str):
+    """上傳解析進度 (pages_done / pages_total)；解析到的片段會即時加入知識庫"""
+    job = pdf_loader.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="找不到這個上傳工作")
+    return {**job.to_dict(), "kb_size": len(pdf_loader.knowledge_base)}
+
+def _announce_upload(job) -> None:
+    if job.status == "done":
+        event_bus.publish("upload", {"name": job.filename, "chunks": len(pdf_loader.knowledge_base)})
+
+
 # 取得已上傳檔案
 @app.get("/api/admin/files")
 async def get_uploaded_files():
@@ -404,6 +611,38 @@ async def get_uploaded_files():
     # 回傳前端
     return files
 
+# --- 教室即時推播 (SSE) ---
+
+@app.get("/api/stream/classroom")
+async def stream_classroom(
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """
+    推播學生上線 / 離線 / 違規 / 解鎖 / 付款 / 上傳完成 / 流量事件 (text/event-stream)
+    沒有事件時只送 keep-alive 註解，伺服器不需重算名單
+    """
+    last_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    subscription = event_bus.subscribe(last_id)
+
+    async def event_stream():
+        with subscription:
+            # 告訴 EventSource 斷線後 3 秒重連
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                if subscription.overflowed:
+                    # 用戶端跟不上或有事件遺失 -> 請前端重新抓一次名單
+                    subscription.overflowed = False
+                    yield "event: resync\ndata: {}\n\n"
+                event = await subscription.get(timeout=15)
+                yield event.to_sse() if event else ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # --- 測驗相關 ---
 
 @app.post("/api/quiz/init")
@@ -538,8 +777,8 @@ async def confirm_payment(data: dict, db: Session = Depends(get_db)):
     user_ip = get_ip_by_mac(user_mac)
     
     if not user_ip:
-        last_log = db.query(ConnectionLog).filter(ConnectionLog.mac_address == user_mac).order_by(ConnectionLog.timestamp.desc()).first()
-        if last_log: user_ip = last_log.ip_address
+        device = last_seen_repo.get_by_mac(db, user_mac)
+        if device: user_ip = device.last_ip
 
     student = db.query(StudentRecord).filter(StudentRecord.mac_address == user_mac).first()
     if student and getattr(student, 'p_status', 'NORMAL') == 'PUNISHED':
@@ -547,13 +786,31 @@ async def confirm_payment(data: dict, db: Session = Depends(get_db)):
         db.commit()
 
     await portal_service.authorize_device(db, user_mac)
-    if user_ip: execute_restore_script(user_ip, WIFI_INTERFACE)
+    if user_ip: await restore_network(user_ip)
 
     if user_mac in student_quiz_state: del student_quiz_state[user_mac]
+    event_bus.publish("payment", {"mac": user_mac, "source": "confirm"})
     return {"status": "success", "message": "付款成功，違規狀態已解除，網路已解鎖"}
 
 @app.get("/api/payment/check")
-async def check_payment_status(mac: str = Depends(get_current_mac), db: Session = Depends(get_db)):
+async def check_payment_status(
+    wait: float = 0,
+    mac: str = Depends(get_current_mac),
+    db: Session = Depends(get_db)
+):
+    """
+    前端查詢付款狀態
+    ?wait=<秒>：尚未付款時不立即回應，等到付款 / 授權事件或逾時 (長輪詢，最多 LONG_POLL_MAX_WAIT 秒)
+    """
+    with event_bus.watch(mac) as watcher:
+        result = await _payment_status(db, mac)
+        if result["status"] != "paid" and wait > 0:
+            db.rollback()
+            if await watcher.wait(min(wait, LONG_POLL_MAX_WAIT)):
+                result = await _payment_status(db, mac)
+    return result
+
+async def _payment_status(db: Session, mac: str) -> dict:
     if mac not in student_quiz_state:
         if await portal_service.check_authorization_status(db, mac):
             return {"status": "paid", "message": "已付款"}
@@ -567,7 +824,7 @@ async def check_payment_status(mac: str = Depends(get_current_mac), db: Session
 
 
 # === 修正後的 Payment Callback API ===
-@app.post("/api/payment/callback")
+@app.post("/api/payment/callback", dependencies=[Depends(verify_bot_secret)])
 async def payment_callback(data: dict, db: Session = Depends(get_db)):
     """
     接收來自 Telegram Bot 的付款通知
@@ -592,6 +849,10 @@ async def payment_callback(data: dict, db: Session = Depends(get_db)):
     # 2. 更新暫存狀態 (讓前端 Polling 也能知道已付款)
     if target_mac in student_quiz_state:
         student_quiz_state[target_mac]["payment_status"] = "paid"
+    event_bus.publish("payment", {
+        "mac": target_mac, "student_id": student.student_id, "name": student.name,
+        "amount": data.get("amount"), "source": "telegram"
+    })
     
     # 3. 更新資料庫懲罰狀態
     if getattr(student, 'p_status', 'NORMAL') == 'PUNISHED':
@@ -605,20 +866,17 @@ async def payment_callback(data: dict, db: Session = Depends(get_db)):
     
     # 如果 ARP 沒資料，嘗試從資料庫找最近連線
     if not user_ip:
-        last_log = db.query(ConnectionLog)\
-            .filter(ConnectionLog.mac_address == target_mac)\
-            .order_by(ConnectionLog.timestamp.desc())\
-            .first()
-        if last_log:
-            user_ip = last_log.ip_address
+        device = last_seen_repo.get_by_mac(db, target_mac)
+        if device:
+            user_ip = device.last_ip
             print(f"[Payment] ARP 未命中，使用最後連線 IP: {user_ip}")
 
     # 執行系統授權 (FastAPI 層)
     await portal_service.authorize_device(db, target_mac)
 
-    # 執行物理層解鎖 (Shell Script)
+    # 執行物理層解鎖 (防火牆)
     if user_ip:
-        success = execute_restore_script(user_ip, WIFI_INTERFACE)
+        success = await restore_network(user_ip)
         if success:
             return {"status": "success", "message": f"已成功解鎖 {student.name} ({user_ip})"}
         else:
@@ -626,5 +884,45 @@ async def payment_callback(data: dict, db: Session = Depends(get_db)):
     else:
         return {"status": "warning", "message": "資料庫已更新，但找不到裝置 IP，請重新連線"}
 
+# === Telegram Bot 開通網路 ===
+@app.post("/api/network/activate", dependencies=[Depends(verify_bot_secret)])
+async def activate_network(data: dict, db: Session = Depends(get_db)):
+    """
+    Telegram Bot 驗證學生後呼叫 (Bot 不再自己寫 authorization_logs、自己叫防火牆代理)
+    需要 X-Backend-Secret header (BACKEND_API_SECRET)
+    授權經過 auth_service，後端記憶體裡的授權狀態、防火牆、儀表板一起更新
+    Payload: {"telegram_id": "12345", "ip_address": "192.168.10.5"}
+    """
+    tg_id = data.get("telegram_id")
+    ip_address = data.get("ip_address")
+    if not tg_id or not ip_address:
+        return {"status": "error", "message": "缺少 telegram_id 或 ip_address 參數"}
+
+    student = db.query(StudentRecord).filter(StudentRecord.telegram_id == str(tg_id)).first()
+    if not student:
+        return {"status": "error", "message": "找不到對應的學生紀錄 (未綁定)"}
+
+    mac = student.mac_address
+    now = datetime.utcnow()
+    # 1. 連線紀錄 + 最後出現位置 (後端馬上就能用 IP / MAC 查到這台裝置)，學生狀態改為 online
+    connection_repo.create_logs(db, [{
+        "mac_address": mac, "ip_address": ip_address, "student_id": student.student_id,
+        "status": "connected", "timestamp": now
+    }], commit=False)
+    last_seen_repo.upsert_many(db, [{
+        "mac_address": mac, "last_ip": ip_address, "last_seen": now,
+        "student_id": student.student_id, "connected": True
+    }], commit=False)
+    student.status = "online"
+    db.commit()
+    print(f"[Activate] 學生 {student.name} ({student.student_id}) 已驗證，MAC: {mac}")
+
+    # 2. 授權 + 放行
+    ok = await auth_service.authorize(db, mac, details={"source": "telegram_bot", "chat_id": str(tg_id)})
+    publish_student_change(mac, "online", status="online")
+    if not ok:
+        return {"status": "warning", "message": "資料庫已更新，但防火牆放行失敗"}
+    return {"status": "success", "message": f"已開通 {student.name} ({ip_address})"}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,309 @@
+# src/network/agent.py
+"""
+以 root 執行的常駐防火牆代理 (firewall agent)
+
+後端、違規偵測、Telegram Bot、登入頁都不再 `sudo ./LSA/*.sh`，
+而是透過 Unix socket 送 JSON 指令給這個行程；它持有 nftables / tc 的狀態，
+同一時間的變更由 BatchingFirewallController 合併成一個 transaction
+
+協定：每行一個 JSON
+    請求 {"id": 1, "cmd": "allow", "args": {"mac": "aa:bb:cc:dd:ee:ff"}}
+    回應 {"id": 1, "ok": true, "result": ...} 或 {"id": 1, "ok": false, "error": "..."}
+
+驗證：以 SO_PEERCRED 取得對方的 uid / gid，只接受 root、代理本身的使用者、
+FIREWALL_AGENT_UIDS 列出的 uid，或 FIREWALL_AGENT_GROUP 群組的成員
+
+啟動 (root)：
+    python -m src.network.agent --interface eno1 --network 192.168.10.0/24
+"""
+import argparse
+import asyncio
+import grp
+import itertools
+import json
+import logging
+import os
+import pwd
+import socket
+import struct
+from typing import Any, Dict, Optional, Set, Tuple
+
+from src.network.firewall import BatchingFirewallController, FirewallControllerInterface, NftablesFirewallController
+from src.network.shaper import TrafficShaper
+
+logger = logging.getLogger(__name__)
+
+AGENT_SOCKET = os.getenv("FIREWALL_AGENT_SOCKET", "/run/student-guard/firewall.sock")
+AGENT_GROUP = os.getenv("FIREWALL_AGENT_GROUP", "")
+AGENT_UIDS = {int(uid) for uid in os.getenv("FIREWALL_AGENT_UIDS", "").split(",") if uid.strip()}
+
+_PEERCRED = struct.Struct("3i")  # pid, uid, gid
+
+
+class AgentError(Exception):
+    """代理回報失敗，或無法連線到代理"""
+
+
+# --- 代理本體 (root) ---
+
+class FirewallAgent:
+    def __init__(self, firewall: BatchingFirewallController, socket_path: str = AGENT_SOCKET,
+                 allowed_uids: Optional[Set[int]] = None, group: str = AGENT_GROUP):
+        self.firewall = firewall
+        self.socket_path = socket_path
+        self.allowed_uids = {0, os.getuid()} | (allowed_uids if allowed_uids is not None else AGENT_UIDS)
+        self.allowed_gid = grp.getgrnam(group).gr_gid if group else None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._commands = {
+            "ping": self._ping,
+            "allow": lambda args: self.firewall.allow_device(args["mac"]),
+            "deny": lambda args: self.firewall.deny_device(args["mac"]),
+            "block_game": lambda args: self.firewall.block_game(args["ip"]),
+            "throttle": lambda args: self.firewall.throttle(args["ip"], args.get("tier", "slow")),
+            "restore": lambda args: self.firewall.restore(args["ip"]),
+            "counters": lambda args: self.firewall.read_counters(),
+            "status": self._status,
+        }
+
+    async def start(self) -> None:
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        # 只有擁有者與指定群組可以連線，真正的權限判斷在 SO_PEERCRED
+        os.chmod(self.socket_path, 0o660)
+        if self.allowed_gid is not None:
+            os.chown(self.socket_path, -1, self.allowed_gid)
+        logger.info(f"防火牆代理已啟動: {self.socket_path}")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _authorized(self, writer: asyncio.StreamWriter) -> bool:
+        sock = writer.get_extra_info("socket")
+        pid, uid, gid = _PEERCRED.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size))
+        if uid in self.allowed_uids or self._in_group(uid, gid):
+            return True
+        logger.warning(f"拒絕未授權的連線: pid={pid} uid={uid} gid={gid}")
+        return False
+
+    def _in_group(self, uid: int, gid: int) -> bool:
+        """
+        對方是否為 FIREWALL_AGENT_GROUP 的成員：主要群組，或列在 /etc/group 的附加群組
+        (SO_PEERCRED 只帶主要群組；每次連線時重新查，加入群組後不用重啟代理)
+        """
+        if self.allowed_gid is None:
+            return False
+        if gid == self.allowed_gid:
+            return True
+        try:
+            return pwd.getpwuid(uid).pw_name in grp.getgrgid(self.allowed_gid).gr_mem
+        except KeyError:
+            return False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if not self._authorized(writer):
+            writer.close()
+            return
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # 每個請求各自處理，同一條連線上的請求可以一起進入同一批防火牆變更
+                task = asyncio.create_task(self._respond(line, writer))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            handler = self._commands.get(request.get("cmd"))
+            if handler is None:
+                raise ValueError(f"未知的指令: {request.get('cmd')}")
+            result = await handler(request.get("args") or {})
+            if result is False:
+                response = {"id": request_id, "ok": False, "error": "防火牆套用失敗"}
+            else:
+                response = {"id": request_id, "ok": True, "result": result}
+        except Exception as e:
+            response = {"id": request_id, "ok": False, "error": str(e)}
+        if not writer.is_closing():
+            writer.write(json.dumps(response).encode() + b"\n")
+
+    async def _ping(self, args: Dict[str, Any]) -> str:
+        return "pong"
+
+    async def _status(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        backend = self.firewall.backend
+        shaper = self.firewall.shaper
+        return {
+            "allowed": sorted(backend.allowed),
+            "game_blocked": sorted(backend.game_blocked),
+            "throttled": shaper.throttled if shaper else {},
+        }
+
+
+# --- 用戶端 ---
+
+class AgentClient:
+    """非同步用戶端 (FastAPI 後端)：一條常駐連線，可同時送出多個請求"""
+    def __init__(self, socket_path: str = AGENT_SOCKET, timeout: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._connect_lock = asyncio.Lock()
+
+    async def call(self, cmd: str, **args) -> Any:
+        await self._ensure_connected()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        try:
+            self._writer.write(json.dumps({"id": request_id, "cmd": cmd, "args": args}).encode() + b"\n")
+            await self._writer.drain()
+            response = await asyncio.wait_for(future, self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise AgentError(f"防火牆代理沒有回應 ({cmd}): {e}") from e
+        finally:
+            self._waiting.pop(request_id, None)
+        if not response.get("ok"):
+            raise AgentError(response.get("error", "unknown error"))
+        return response.get("result")
+
+    async def close(self) -> None:
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+        self._writer = None
+
+    async def _ensure_connected(self) -> None:
+        async with self._connect_lock:
+            if self._writer and not self._writer.is_closing():
+                return
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError as e:
+                raise AgentError(f"無法連線到防火牆代理 {self.socket_path}: {e}") from e
+            self._reader_task = asyncio.create_task(self._read_responses(reader))
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._waiting.get(response.get("id"))
+                if future and not future.done():
+                    future.set_result(response)
+        finally:
+            # 連線中斷：讓等待中的呼叫立刻失敗，下次呼叫會重新連線
+            if self._writer:
+                self._writer.close()
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("防火牆代理連線中斷"))
+
+
+class SyncAgentClient:
+    """同步用戶端 (違規偵測、Telegram Bot、登入頁的背景執行緒)：每次呼叫一條短連線"""
+    def __init__(self, socket_path: str = AGENT_SOCKET, timeout: float = 5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, cmd: str, **args) -> Any:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps({"id": 1, "cmd": cmd, "args": args}).encode() + b"\n")
+                with sock.makefile("rb") as stream:
+                    line = stream.readline()
+        except OSError as e:
+            raise AgentError(f"無法連線到防火牆代理 {self.socket_path}: {e}") from e
+        if not line:
+            raise AgentError("防火牆代理關閉了連線 (權限不足？)")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise AgentError(response.get("error", "unknown error"))
+        return response.get("result")
+
+
+class AgentFirewallController(FirewallControllerInterface):
+    """後端用的防火牆控制器：所有變更都交給 root 代理執行"""
+    def __init__(self, client: Optional[AgentClient] = None):
+        self.client = client or AgentClient()
+
+    async def allow_device(self, mac: str) -> bool:
+        return await self._call("allow", mac=mac)
+
+    async def deny_device(self, mac: str) -> bool:
+        return await self._call("deny", mac=mac)
+
+    async def block_game(self, ip: str) -> bool:
+        return await self._call("block_game", ip=ip)
+
+    async def throttle(self, ip: str, tier: str = "slow") -> bool:
+        return await self._call("throttle", ip=ip, tier=tier)
+
+    async def restore(self, ip: str) -> bool:
+        return await self._call("restore", ip=ip)
+
+    async def read_counters(self) -> Dict[str, Tuple[int, int, int, int]]:
+        try:
+            counters = await self.client.call("counters")
+        except AgentError as e:
+            print(f"[Firewall Error] counters: {e}")
+            return {}
+        return {ip: tuple(values) for ip, values in counters.items()}
+
+    async def _call(self, cmd: str, **args) -> bool:
+        try:
+            await self.client.call(cmd, **args)
+            return True
+        except AgentError as e:
+            print(f"[Firewall Error] {cmd} {args}: {e}")
+            return False
+
+
+# --- 啟動 ---
+
+async def run_agent(interface: str, network: str, portal: str, socket_path: str) -> None:
+    backend = NftablesFirewallController(interface, network, portal=portal)
+    shaper = TrafficShaper(interface)
+    # 代理自己重新啟動 (crash / systemd restart / 升級) 時 kernel 的狀態還在：
+    # 先讀回已授權 / 懲罰中的名單，重建規則時一併放回，不用等後端重新 restore_state
+    await backend.load_existing()
+    await shaper.load_existing()
+    if not await backend.setup():
+        raise SystemExit("無法建立 nftables 規則 (需要 root 與 nft，且不能留有 iptables 舊規則)")
+    if not await shaper.setup():
+        logger.error("建立 HTB 失敗，限速功能無法使用")
+    agent = FirewallAgent(BatchingFirewallController(backend, shaper), socket_path=socket_path)
+    await agent.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Student Guard 防火牆代理 (需以 root 執行)")
+    parser.add_argument("--interface", default="eno1", help="學生連上來的網卡")
+    parser.add_argument("--network", default="192.168.10.0/24", help="學生網段")
+    parser.add_argument("--portal", default="192.168.10.1:81", help="未授權流量導向的登入頁")
+    parser.add_argument("--socket", default=AGENT_SOCKET, help="Unix socket 路徑")
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    asyncio.run(run_agent(options.interface, options.network, options.portal, options.socket))
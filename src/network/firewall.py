@@ -1,6 +1,11 @@
 import asyncio
+import ipaddress
+import json
+import shlex
 from abc import ABC, abstractmethod
-from typing import Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from src.network.shaper import TrafficShaper
 
 # --- 1. 抽象介面 (維持不變，這是您跟組員的契約) ---
 class FirewallControllerInterface(ABC):
@@ -53,7 +58,393 @@ class ShellScriptFirewallController(FirewallControllerInterface):
     #     # 呼叫組員的 block 腳本
     #     await self._run_script("block_game.sh", mac)
 
-# --- 3. Mock 實作 (測試用) ---
+# --- 3. nftables 集合實作 ---
+
+# Telegram 伺服器網段 (Walled Garden，未登入也要能付款 / 驗證)，同 LSA/allow_telegram.sh
+TELEGRAM_CIDRS = [
+    "91.108.4.0/22", "91.108.8.0/22", "91.108.12.0/22", "91.108.16.0/22", "91.108.56.0/22",
+    "149.154.160.0/20", "149.154.164.0/22", "149.154.168.0/22", "149.154.172.0/22",
+]
+
+def _rule_options(args: List[str]) -> Dict[str, str]:
+    """iptables -S 的一條規則 -> {選項: 值}；沒有值的旗標 (--syn) 對應空字串"""
+    options = {}
+    for i, arg in enumerate(args):
+        if arg.startswith("-"):
+            value = args[i + 1] if i + 1 < len(args) else ""
+            options[arg] = "" if value.startswith("-") or value == "!" else value
+    return options
+
+class NftablesFirewallController(FirewallControllerInterface):
+    """
+    以 nftables 集合 (set) 管理放行 / 懲罰名單
+    iptables 腳本每位學生都插一條規則，每個封包都要線性走過整條鏈；
+    這裡規則數固定，封包只做 O(1) 的集合查詢，授權 / 撤銷只是新增 / 刪除集合元素
+
+    集合：
+    - allowed      (ether_addr) 已授權的 MAC，可以上網、不再被導到登入頁
+    - game_blocked (ipv4_addr)  阻斷 UDP (遊戲)
+    - traffic_down / traffic_up (ipv4_addr, 動態) 每個學生 IP 的下載 / 上傳計數 (儀表板的即時流量)
+    限速不在這裡，由 src.network.shaper.TrafficShaper 管理 tc
+    """
+    TABLE = "student_guard"
+
+    def __init__(self, lan_interface: str, lan_network: str, portal: str = "192.168.10.1:81",
+                 nft_path: str = "nft", iptables_path: str = "iptables"):
+        """
+        :param lan_interface: 學生連上來的網卡
+        :param lan_network: 學生網段 (CIDR)
+        :param portal: 未授權的 HTTP 流量導向的登入頁 (IP:port)
+        """
+        self.lan_interface = lan_interface
+        self.lan_network = lan_network
+        self.portal = portal
+        self.nft_path = nft_path
+        self.iptables_path = iptables_path
+        # kernel 集合的鏡像：避免重複新增 / 刪除不存在的元素 (nft 會報錯)
+        self.allowed: Set[str] = set()
+        self.game_blocked: Set[str] = set()
+
+    def render_ruleset(self) -> str:
+        """整個 table 的定義 (先刪除再重建，nft -f 會在同一個 transaction 內完成)"""
+        lan = self.lan_interface
+        telegram = ", ".join(TELEGRAM_CIDRS)
+        return f"""
+table inet {self.TABLE}
+delete table inet {self.TABLE}
+table inet {self.TABLE} {{
+    set allowed {{ type ether_addr; }}
+    set game_blocked {{ type ipv4_addr; }}
+    set walled_garden {{ type ipv4_addr; flags interval; auto-merge; elements = {{ {telegram} }} }}
+    set traffic_down {{ type ipv4_addr; size 65535; flags dynamic, timeout; timeout 10m; }}
+    set traffic_up {{ type ipv4_addr; size 65535; flags dynamic, timeout; timeout 10m; }}
+
+    chain prerouting {{
+        type nat hook prerouting priority dstnat; policy accept;
+        iifname "{lan}" ether saddr @allowed accept
+        iifname "{lan}" ip saddr {self.lan_network} tcp dport 80 dnat ip to {self.portal}
+    }}
+
+    chain forward {{
+        type filter hook forward priority filter; policy accept;
+        oifname "{lan}" ip daddr {self.lan_network} update @traffic_down {{ ip daddr counter }}
+        iifname "{lan}" ip saddr {self.lan_network} update @traffic_up {{ ip saddr counter }}
+        iifname "{lan}" ip saddr @game_blocked meta l4proto udp drop
+        iifname "{lan}" meta l4proto {{ tcp, udp }} th dport 53 accept
+        iifname "{lan}" ip daddr @walled_garden accept
+        iifname "{lan}" ether saddr @allowed accept
+        iifname "{lan}" ip saddr {self.lan_network} drop
+    }}
+}}
+"""
+
+    async def load_existing(self) -> bool:
+        """
+        把 kernel 裡既有的 allowed / game_blocked 元素讀回記憶體 (在 setup 之前呼叫)
+        防火牆代理自己重新啟動時 table 還在，setup 重建後才不會把已授權的學生全部斷線
+        :return: False 表示沒有既有的 table (開機後第一次啟動)
+        """
+        output = await self._query("-j", "list", "table", "inet", self.TABLE, quiet=True)
+        if output is None:
+            return False
+        for item in json.loads(output).get("nftables", []):
+            nft_set = item.get("set")
+            if not nft_set or nft_set.get("name") not in ("allowed", "game_blocked"):
+                continue
+            mirror = self._mirror(nft_set["name"])
+            for element in nft_set.get("elem", []):
+                # 一般元素是字串；帶 counter / timeout 的元素是 {"elem": {"val": ...}}
+                value = element["elem"]["val"] if isinstance(element, dict) else element
+                mirror.add(value.lower() if nft_set["name"] == "allowed" else value)
+        print(f"[Firewall] 沿用既有的 nftables 狀態: {len(self.allowed)} 台已授權、{len(self.game_blocked)} 個遊戲阻斷")
+        return True
+
+    async def setup(self) -> bool:
+        """建立 table 與集合，並放回記憶體中已知的元素 (啟動 / 重新初始化時呼叫)"""
+        conflicts = await self.find_iptables_conflicts()
+        if conflicts:
+            print("[Firewall Error] 偵測到 iptables 舊規則 (LSA/init_firewall.sh 等)，已授權的學生仍會被擋下 / 導到登入頁：")
+            for rule in conflicts:
+                print(f"    {rule}")
+            print("[Firewall Error] 請先執行 sudo LSA/init_nftables.sh 清除，nftables / agent 不要再跑 init_firewall.sh")
+            return False
+        script = self.render_ruleset()
+        script += self._element_commands("add", "allowed", self.allowed)
+        script += self._element_commands("add", "game_blocked", self.game_blocked)
+        return await self._apply(script)
+
+    async def find_iptables_conflicts(self) -> List[str]:
+        """
+        找出學生網段在 iptables 裡的 FORWARD DROP / REJECT 與 PREROUTING port 80 DNAT
+        封包會走過每一個 base chain，別的 table 的 drop 無法被這裡的 accept 蓋過
+        :return: 衝突的規則 (iptables -S 格式)；沒有 iptables 指令時回傳空 list
+        """
+        lan = ipaddress.ip_network(self.lan_network, strict=False)
+        conflicts = []
+        for table, chain in (("filter", "FORWARD"), ("nat", "PREROUTING")):
+            output = await self._iptables("-t", table, "-S", chain)
+            for rule in (output or "").splitlines():
+                args = shlex.split(rule)
+                if args[:3] == ["-P", "FORWARD", "DROP"]:
+                    conflicts.append(rule)
+                    continue
+                if args[:1] != ["-A"]:
+                    continue
+                options = _rule_options(args[2:])
+                source = options.get("-s")
+                if source and not ipaddress.ip_network(source, strict=False).overlaps(lan):
+                    continue
+                target = options.get("-j")
+                if chain == "FORWARD" and target in ("DROP", "REJECT"):
+                    conflicts.append(rule)
+                elif chain == "PREROUTING" and target == "DNAT" and options.get("--dport") == "80":
+                    conflicts.append(rule)
+        return conflicts
+
+    # --- FirewallControllerInterface ---
+
+    async def allow_device(self, mac: str) -> None:
+        await self._update("add", "allowed", self.allowed, [mac.lower()])
+
+    async def deny_device(self, mac: str) -> None:
+        await self._update("delete", "allowed", self.allowed, [mac.lower()])
+
+    def is_allowed(self, mac: str) -> bool:
+        return mac.lower() in self.allowed
+
+    # --- 懲罰 (違規偵測使用) ---
+
+    async def block_game(self, ip: str) -> None:
+        await self._update("add", "game_blocked", self.game_blocked, [ip])
+
+    async def restore(self, ip: str) -> None:
+        """解除該 IP 的遊戲阻斷"""
+        await self._update("delete", "game_blocked", self.game_blocked, [ip])
+
+    # --- 流量計數 ---
+
+    async def read_counters(self) -> Dict[str, Tuple[int, int, int, int]]:
+        """
+        每個學生 IP 的累計計數 (一次 nft -j list table)
+        :return: IP -> (下載 bytes, 下載 packets, 上傳 bytes, 上傳 packets)；失敗時回傳空 dict
+        """
+        output = await self._query("-j", "list", "table", "inet", self.TABLE)
+        if output is None:
+            return {}
+        counters: Dict[str, List[int]] = {}
+        for item in json.loads(output).get("nftables", []):
+            nft_set = item.get("set")
+            if not nft_set or nft_set.get("name") not in ("traffic_down", "traffic_up"):
+                continue
+            offset = 0 if nft_set["name"] == "traffic_down" else 2
+            for element in nft_set.get("elem", []):
+                elem = element.get("elem", {})
+                counter = elem.get("counter")
+                if not counter:
+                    continue
+                values = counters.setdefault(elem["val"], [0, 0, 0, 0])
+                values[offset] = counter["bytes"]
+                values[offset + 1] = counter["packets"]
+        return {ip: tuple(values) for ip, values in counters.items()}
+
+    # --- 內部 ---
+
+    def _mirror(self, set_name: str) -> Set[str]:
+        return {"allowed": self.allowed, "game_blocked": self.game_blocked}[set_name]
+
+    def _element_commands(self, action: str, set_name: str, elements: Iterable[str]) -> str:
+        elements = sorted(elements)
+        if not elements:
+            return ""
+        return f"{action} element inet {self.TABLE} {set_name} {{ {', '.join(elements)} }}\n"
+
+    async def _update(self, action: str, set_name: str, mirror: Set[str], elements: List[str]) -> None:
+        if action == "add":
+            pending = [e for e in elements if e not in mirror]
+        else:
+            pending = [e for e in elements if e in mirror]
+        if not pending:
+            return
+        if await self._apply(self._element_commands(action, set_name, pending)):
+            if action == "add":
+                mirror.update(pending)
+            else:
+                mirror.difference_update(pending)
+            print(f"[Firewall] nft {action} {set_name}: {', '.join(pending)}")
+
+    async def _apply(self, script: str) -> bool:
+        """把 nft 指令透過 stdin 交給 nft -f - (整份腳本是一個 atomic transaction)"""
+        process = await asyncio.create_subprocess_exec(
+            self.nft_path, "-f", "-",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate(script.encode())
+        if process.returncode != 0:
+            print(f"[Firewall Error] nft -f failed: {stderr.decode().strip()}")
+            return False
+        return True
+
+    async def _query(self, *args: str, quiet: bool = False) -> Optional[str]:
+        process = await asyncio.create_subprocess_exec(
+            self.nft_path, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            if not quiet:
+                print(f"[Firewall Error] nft {' '.join(args)} failed: {stderr.decode().strip()}")
+            return None
+        return stdout.decode()
+
+    async def _iptables(self, *args: str) -> Optional[str]:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.iptables_path, *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            return None
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"[Firewall Error] iptables {' '.join(args)} failed: {stderr.decode().strip()}")
+            return None
+        return stdout.decode()
+
+# --- 4. 批次交易 ---
+
+class BatchingFirewallController(FirewallControllerInterface):
+    """
+    把短時間內 (window 秒) 的所有變更合併成一個 nft -f transaction
+    例如啟動時恢復全班授權、或一次解鎖整班，只需要 fork 一次 nft
+
+    - 同一個元素在同一批裡多次變更，只保留最後的狀態
+    - 每個呼叫端各自拿到自己那筆的結果 (True / False)；被同一批後來的變更蓋掉的要求回傳 False
+    - 整批失敗時改為逐筆套用，壞掉的那筆不會拖累其他人
+    限速交給 shaper (tc)，沒有設定 shaper 時 throttle 一律失敗
+    """
+    def __init__(self, backend: NftablesFirewallController, shaper: Optional[TrafficShaper] = None,
+                 window: float = 0.02):
+        self.backend = backend
+        self.shaper = shaper
+        self.window = window
+        # (集合, 元素) -> (最後要求的狀態: 是否在集合內, [(等待結果的呼叫端, 它要求的狀態)])
+        self._pending: Dict[Tuple[str, str], Tuple[bool, List[Tuple[asyncio.Future, bool]]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    # --- FirewallControllerInterface ---
+
+    async def allow_device(self, mac: str) -> bool:
+        return await self._submit([("allowed", mac.lower(), True)])
+
+    async def deny_device(self, mac: str) -> bool:
+        return await self._submit([("allowed", mac.lower(), False)])
+
+    def is_allowed(self, mac: str) -> bool:
+        return self.backend.is_allowed(mac)
+
+    async def read_counters(self) -> Dict[str, Tuple[int, int, int, int]]:
+        return await self.backend.read_counters()
+
+    # --- 懲罰 ---
+
+    async def block_game(self, ip: str) -> bool:
+        return await self._submit([("game_blocked", ip, True)])
+
+    async def throttle(self, ip: str, tier: str = "slow") -> bool:
+        if self.shaper is None:
+            print(f"[Firewall Error] throttle {ip}: 沒有設定 TrafficShaper")
+            return False
+        return await self.shaper.throttle(ip, tier)
+
+    async def restore(self, ip: str) -> bool:
+        """解除該 IP 的所有懲罰 (同 restore.sh)：遊戲阻斷 + 限速"""
+        if self.shaper is None:
+            return await self._submit([("game_blocked", ip, False)])
+        unblocked, released = await asyncio.gather(
+            self._submit([("game_blocked", ip, False)]), self.shaper.release(ip)
+        )
+        return unblocked and released
+
+    # --- 內部 ---
+
+    async def _submit(self, changes: List[Tuple[str, str, bool]]) -> bool:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for set_name, element, present in changes:
+            future = loop.create_future()
+            _, waiters = self._pending.get((set_name, element), (present, []))
+            waiters.append((future, present))
+            self._pending[(set_name, element)] = (present, waiters)
+            futures.append(future)
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        return all(await asyncio.gather(*futures))
+
+    async def _flush_loop(self) -> None:
+        # 套用期間新進來的變更，留到下一批
+        while self._pending:
+            await asyncio.sleep(self.window)
+            batch, self._pending = self._pending, {}
+            try:
+                await self._apply_batch(batch)
+            except Exception as e:
+                print(f"[Firewall Error] batch failed: {e}")
+                for present, waiters in batch.values():
+                    self._resolve(waiters, present, False)
+
+    async def _apply_batch(self, batch: Dict[Tuple[str, str], Tuple[bool, List[Tuple[asyncio.Future, bool]]]]) -> None:
+        backend = self.backend
+        ops = []
+        for (set_name, element), (present, waiters) in batch.items():
+            if (element in backend._mirror(set_name)) == present:
+                # 已經是要求的狀態
+                self._resolve(waiters, present, True)
+            else:
+                ops.append((set_name, element, present, waiters))
+        if not ops:
+            return
+
+        # 同一個集合的新增 / 刪除各合併成一行
+        grouped: Dict[Tuple[str, str], List[str]] = {}
+        for set_name, element, present, _ in ops:
+            grouped.setdefault(("add" if present else "delete", set_name), []).append(element)
+        script = "".join(backend._element_commands(action, set_name, elements)
+                         for (action, set_name), elements in grouped.items())
+
+        if await backend._apply(script):
+            for set_name, element, present, waiters in ops:
+                self._commit(set_name, element, present)
+                self._resolve(waiters, present, True)
+            print(f"[Firewall] nft batch applied: {len(ops)} change(s)")
+            return
+
+        # 整批失敗 -> 逐筆套用，找出是哪一筆有問題
+        for set_name, element, present, waiters in ops:
+            ok = await backend._apply(backend._element_commands("add" if present else "delete", set_name, [element]))
+            if ok:
+                self._commit(set_name, element, present)
+            self._resolve(waiters, present, ok)
+
+    def _commit(self, set_name: str, element: str, present: bool) -> None:
+        mirror = self.backend._mirror(set_name)
+        if present:
+            mirror.add(element)
+        else:
+            mirror.discard(element)
+
+    @staticmethod
+    def _resolve(waiters: List[Tuple[asyncio.Future, bool]], present: bool, result: bool) -> None:
+        """套用的結果只屬於要求最後狀態的呼叫端；被蓋掉的 (例如同一批的 allow 後又 deny) 一律 False"""
+        for future, wanted in waiters:
+            if not future.done():
+                future.set_result(result and wanted == present)
+
+# --- 5. Mock 實作 (測試用) ---
 class MockFirewallController(FirewallControllerInterface):
     def __init__(self):
         self.allowed = set()
@@ -68,3 +459,16 @@ class MockFirewallController(FirewallControllerInterface):
             self.allowed.remove(mac)
     def is_allowed(self, mac: str) -> bool:
         return mac in self.allowed
+
+    async def block_game(self, ip: str):
+        print(f"[MockFirewall] BLOCK GAME {ip}")
+
+    async def throttle(self, ip: str, tier: str = "slow"):
+        print(f"[MockFirewall] THROTTLE {ip} ({tier})")
+
+    async def restore(self, ip: str):
+        print(f"[MockFirewall] RESTORE {ip}")
+        return True
+
+    async def read_counters(self):
+        return {}
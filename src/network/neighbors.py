@@ -0,0 +1,120 @@
+# src/network/neighbors.py
+import asyncio
+import logging
+import socket
+from typing import Dict, Optional
+
+from src.network.netlink import (
+    NeighborEntry, NeighborSocket, RTM_DELNEIGH, NUD_FAILED, NUD_INCOMPLETE,
+)
+
+logger = logging.getLogger(__name__)
+
+# 觸發 ARP 解析用的 UDP 目的埠 (discard，對方不會回應)
+_SOLICIT_PORT = 9
+
+def _solicit(ip: str) -> None:
+    """送一個空的 UDP 封包：kernel 送出前必須先解析鄰居，不需要 root，也不用 fork ping"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b"", (ip, _SOLICIT_PORT))
+
+class NeighborCache:
+    """
+    行程內的 IP <-> MAC 雙向對照表 (kernel 鄰居表的鏡像)
+    查詢都是 dict 查表，不再讀 /proc/net/arp、查資料庫或 fork ping / ip neigh
+
+    更新方式 (擇一)：
+    1. 後端：由 PresenceMonitor 把收到的 netlink 事件轉交 apply()，共用同一條 socket
+    2. 獨立程式 (違規偵測、Telegram Bot)：open() 自己訂閱，查詢前 refresh() 讀取排隊中的變化 (不阻塞)
+    """
+    def __init__(self, interface: Optional[str] = None):
+        self.interface = interface
+        self._by_ip: Dict[str, str] = {}
+        self._by_mac: Dict[str, str] = {}
+        self._socket: Optional[NeighborSocket] = None
+
+    def open(self) -> bool:
+        """自己訂閱鄰居表並載入目前的內容，失敗 (非 Linux / 找不到介面) 回傳 False"""
+        try:
+            sock = NeighborSocket(self.interface)
+            sock.open()
+            entries = sock.dump()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"無法讀取鄰居表: {e}")
+            return False
+        self._socket = sock
+        for msg_type, entry in entries:
+            self.apply(msg_type, entry)
+        logger.info(f"鄰居表快取已載入 {len(self._by_ip)} 筆")
+        return True
+
+    def attach(self) -> None:
+        """在 event loop 裡改由 socket 可讀時自動更新 (必須先 open)"""
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self.refresh)
+
+    def close(self) -> None:
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def refresh(self) -> int:
+        """套用 socket 裡排隊中的變化 (不阻塞)，回傳處理的筆數"""
+        if not self._socket:
+            return 0
+        try:
+            entries = self._socket.read()
+        except OSError as e:
+            logger.error(f"讀取鄰居表變化失敗: {e}")
+            return 0
+        for msg_type, entry in entries:
+            self.apply(msg_type, entry)
+        return len(entries)
+
+    def apply(self, msg_type: int, entry: NeighborEntry) -> None:
+        """套用一筆 netlink 鄰居事件"""
+        if msg_type == RTM_DELNEIGH or entry.state & (NUD_FAILED | NUD_INCOMPLETE) or not entry.mac:
+            mac = self._by_ip.pop(entry.ip, None)
+            if mac and self._by_mac.get(mac) == entry.ip:
+                del self._by_mac[mac]
+            return
+
+        old_mac = self._by_ip.get(entry.ip)
+        if old_mac and old_mac != entry.mac and self._by_mac.get(old_mac) == entry.ip:
+            del self._by_mac[old_mac]
+        self._by_ip[entry.ip] = entry.mac
+        self._by_mac[entry.mac] = entry.ip
+
+    def get_mac(self, ip: str) -> Optional[str]:
+        self.refresh()
+        return self._by_ip.get(ip)
+
+    async def resolve(self, ip: str, timeout: float = 1.0) -> Optional[str]:
+        """
+        查不到時只針對這個 IP 補查 (不重新載入整張表)：
+        向 kernel 要這一筆紀錄 (沒有指定介面時每個介面各問一次)，並送一個 UDP 封包讓 kernel 發 ARP 解析 (取代 ping)，
+        等待鄰居表事件最多 timeout 秒
+        """
+        mac = self.get_mac(ip)
+        if mac or not self._socket:
+            return mac
+        try:
+            if self._socket.ifindex:
+                ifindexes = [self._socket.ifindex]
+            else:
+                ifindexes = [index for index, name in socket.if_nameindex() if name != "lo"]
+            for ifindex in ifindexes:
+                self._socket.request_neighbor(ip, ifindex)
+            _solicit(ip)
+        except OSError as e:
+            logger.warning(f"無法查詢 {ip} 的鄰居紀錄: {e}")
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while mac is None and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+            mac = self.get_mac(ip)
+        return mac
+
+    def get_ip(self, mac: str) -> Optional[str]:
+        self.refresh()
+        return self._by_mac.get(mac.lower())
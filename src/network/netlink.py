@@ -0,0 +1,201 @@
+# src/network/netlink.py
+"""
+rtnetlink 鄰居表 (neighbor table) 的底層存取
+只用標準函式庫的 socket + struct，直接跟 kernel 訂閱 RTM_NEWNEIGH / RTM_DELNEIGH，
+不用再定期廣播 ARP 或解析 /proc/net/arp
+"""
+import errno
+import select
+import socket
+import time
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# --- netlink / rtnetlink 常數 (linux/netlink.h, linux/rtnetlink.h, linux/neighbour.h) ---
+NETLINK_ROUTE = 0
+RTMGRP_NEIGH = 0x4
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+NDA_DST = 1
+NDA_LLADDR = 2
+
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_STALE = 0x04
+NUD_DELAY = 0x08
+NUD_PROBE = 0x10
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+
+# 這些狀態代表 kernel 最近確認過對方還在
+NUD_PRESENT = NUD_REACHABLE | NUD_DELAY | NUD_PROBE | NUD_PERMANENT
+
+_NLMSGHDR = struct.Struct("=LHHLL")   # len, type, flags, seq, pid
+_NDMSG = struct.Struct("=BxxxiHBB")   # family, (pad), ifindex, state, flags, type
+_RTATTR = struct.Struct("=HH")        # len, type
+
+
+class NeighborEntry(NamedTuple):
+    ifindex: int
+    ip: str
+    mac: Optional[str]
+    state: int
+
+    @property
+    def is_present(self) -> bool:
+        return bool(self.state & NUD_PRESENT)
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _parse_neighbor(payload: bytes) -> Optional[NeighborEntry]:
+    """解析 ndmsg + rtattr，只處理 IPv4"""
+    if len(payload) < _NDMSG.size:
+        return None
+    family, ifindex, state, _flags, _type = _NDMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return None
+
+    ip = None
+    mac = None
+    offset = _NDMSG.size
+    while offset + _RTATTR.size <= len(payload):
+        attr_len, attr_type = _RTATTR.unpack_from(payload, offset)
+        if attr_len < _RTATTR.size:
+            break
+        value = payload[offset + _RTATTR.size: offset + attr_len]
+        if attr_type == NDA_DST and len(value) == 4:
+            ip = socket.inet_ntoa(value)
+        elif attr_type == NDA_LLADDR and len(value) == 6:
+            mac = ":".join(f"{b:02x}" for b in value)
+        offset += _align(attr_len)
+
+    if ip is None:
+        return None
+    return NeighborEntry(ifindex=ifindex, ip=ip, mac=mac, state=state)
+
+
+def parse_messages(data: bytes) -> Iterator[Tuple[int, NeighborEntry]]:
+    """把一個 netlink datagram 拆成 (訊息類型, NeighborEntry)"""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        msg_len, msg_type, _flags, _seq, _pid = _NLMSGHDR.unpack_from(data, offset)
+        if msg_len < _NLMSGHDR.size:
+            break
+        if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            entry = _parse_neighbor(data[offset + _NLMSGHDR.size: offset + msg_len])
+            if entry:
+                yield msg_type, entry
+        offset += _align(msg_len)
+
+
+def _is_done(data: bytes) -> bool:
+    """datagram 裡是否有 NLMSG_DONE (dump 結束)"""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        msg_len, msg_type, _flags, _seq, _pid = _NLMSGHDR.unpack_from(data, offset)
+        if msg_type in (NLMSG_DONE, NLMSG_ERROR):
+            return True
+        if msg_len < _NLMSGHDR.size:
+            break
+        offset += _align(msg_len)
+    return False
+
+
+class NeighborSocket:
+    """
+    非阻塞的 rtnetlink socket
+    訂閱 RTMGRP_NEIGH 後，kernel 每次鄰居表變動都會送一筆 RTM_NEWNEIGH / RTM_DELNEIGH
+    """
+    def __init__(self, interface: Optional[str] = None):
+        # 指定介面時只回報該介面的鄰居 (例如學生連上來的無線網卡)
+        self.ifindex = socket.if_nametoindex(interface) if interface else None
+        self._sock: Optional[socket.socket] = None
+        self._seq = 0
+
+    def open(self) -> None:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK, NETLINK_ROUTE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind((0, RTMGRP_NEIGH))
+        self._sock = sock
+
+    def close(self) -> None:
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def request_dump(self) -> None:
+        """要求 kernel 把目前整張 IPv4 鄰居表送過來 (回覆會跟事件走同一條 socket)"""
+        self._seq += 1
+        ndmsg = _NDMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        header = _NLMSGHDR.pack(_NLMSGHDR.size + len(ndmsg), RTM_GETNEIGH,
+                                NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0)
+        self._sock.send(header + ndmsg)
+
+    def request_neighbor(self, ip: str, ifindex: int) -> None:
+        """
+        要求 kernel 送來某個介面上單一 IP 的鄰居紀錄，回覆跟事件走同一條 socket
+        沒有這筆紀錄時 kernel 回 NLMSG_ERROR，read() 會略過
+        """
+        self._seq += 1
+        dst = socket.inet_aton(ip)
+        ndmsg = _NDMSG.pack(socket.AF_INET, ifindex, 0, 0, 0)
+        attr = _RTATTR.pack(_RTATTR.size + len(dst), NDA_DST) + dst
+        header = _NLMSGHDR.pack(_NLMSGHDR.size + len(ndmsg) + len(attr), RTM_GETNEIGH,
+                                NLM_F_REQUEST, self._seq, 0)
+        self._sock.send(header + ndmsg + attr)
+
+    def dump(self, timeout: float = 1.0) -> List[Tuple[int, NeighborEntry]]:
+        """同步取得整張鄰居表 (等到 NLMSG_DONE 或逾時)，給沒有 event loop 的程式用"""
+        self.request_dump()
+        results = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._sock], [], [], remaining)[0]:
+                break
+            try:
+                data = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                continue
+            for msg_type, entry in parse_messages(data):
+                if self.ifindex is None or entry.ifindex == self.ifindex:
+                    results.append((msg_type, entry))
+            if _is_done(data):
+                break
+        return results
+
+    def read(self) -> List[Tuple[int, NeighborEntry]]:
+        """把目前 socket 裡排隊的訊息全部讀出來 (不阻塞)"""
+        results = []
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # ENOBUFS: 事件太多、接收緩衝區溢位，有事件遺失 -> 重新要一次完整表
+                if e.errno == errno.ENOBUFS:
+                    self.request_dump()
+                    continue
+                raise
+            if not data:
+                break
+            for msg_type, entry in parse_messages(data):
+                if self.ifindex is None or entry.ifindex == self.ifindex:
+                    results.append((msg_type, entry))
+        return results
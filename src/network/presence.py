@@ -0,0 +1,171 @@
+# src/network/presence.py
+import asyncio
+import ipaddress
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from src.db.models import ARPScanResult, PresenceEvent
+from src.network.netlink import (
+    NeighborEntry, NeighborSocket, RTM_DELNEIGH, RTM_NEWNEIGH,
+    NUD_FAILED, NUD_INCOMPLETE, NUD_STALE,
+)
+from src.network.neighbors import NeighborCache
+from src.network.scanner import ARPScanner
+
+logger = logging.getLogger(__name__)
+
+class PresenceMonitor:
+    """
+    被動式出席偵測
+    訂閱 kernel 鄰居表變化 (rtnetlink RTM_NEWNEIGH / RTM_DELNEIGH)，
+    只有在裝置「出現 / 換 IP / 離開」時才發出事件，平常完全不發封包。
+
+    學生所有流量都經過本機 (閘道 + DNS)，所以在線裝置的鄰居項目會一直被 kernel 確認為 REACHABLE；
+    裝置安靜一段時間後會變成 STALE，這時才用 ARPScanner 對「這幾台」單播探測，確認是否真的離開。
+    """
+    def __init__(self, interface: str, ip_range: Optional[str] = None,
+                 prober: Optional[ARPScanner] = None, probe_interval: int = 10,
+                 neighbors: Optional[NeighborCache] = None):
+        """
+        :param interface: 學生連上來的網卡
+        :param ip_range: 只追蹤這個網段 (CIDR)，None 表示不過濾
+        :param prober: STALE 時用來單播探測的掃描器，None 則 STALE 直接視為離開
+        :param probe_interval: 每隔幾秒探測一次 STALE 裝置
+        :param neighbors: 一併更新的 IP <-> MAC 快取 (共用同一條 netlink socket)
+        """
+        self.interface = interface
+        self.network = ipaddress.ip_network(ip_range, strict=False) if ip_range else None
+        self.prober = prober
+        self.probe_interval = probe_interval
+        self.neighbors = neighbors
+
+        # 事件佇列，由使用者 (main.py) 自行消化
+        self.events: asyncio.Queue = asyncio.Queue()
+
+        self._socket: Optional[NeighborSocket] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._devices: Dict[str, str] = {}   # 在線裝置 MAC -> IP
+        self._ip_owner: Dict[str, str] = {}  # IP -> MAC
+        self._stale: Dict[str, str] = {}     # 等待探測的裝置 MAC -> IP
+
+    @property
+    def running(self) -> bool:
+        return self._socket is not None
+
+    def start(self) -> bool:
+        """
+        開始監聽 (必須在 event loop 裡呼叫)
+        :return: 無法開啟 netlink (非 Linux / 權限不足) 時回傳 False，呼叫端應改用 ARP 掃描
+        """
+        try:
+            sock = NeighborSocket(self.interface)
+            sock.open()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"無法訂閱鄰居表，改用 ARP 掃描: {e}")
+            return False
+
+        self._socket = sock
+        loop = asyncio.get_running_loop()
+        loop.add_reader(sock.fileno(), self._on_readable)
+        # 先載入目前整張表，之後就只處理增量事件
+        sock.request_dump()
+        if self.prober:
+            self._probe_task = asyncio.create_task(self._probe_loop())
+        logger.info(f"開始監聽 {self.interface} 的鄰居表變化")
+        return True
+
+    def stop(self) -> None:
+        if self._probe_task:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._socket:
+            asyncio.get_running_loop().remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+
+    def snapshot(self) -> List[ARPScanResult]:
+        """目前在線裝置 (格式同 ARPScanner.scan 的結果)"""
+        now = datetime.now()
+        return [ARPScanResult(ip=ip, mac=mac, timestamp=now) for mac, ip in self._devices.items()]
+
+    # --- kernel 事件處理 ---
+
+    def _on_readable(self) -> None:
+        try:
+            for msg_type, entry in self._socket.read():
+                self._apply(msg_type, entry)
+        except Exception as e:
+            logger.error(f"處理鄰居表事件發生錯誤: {e}")
+
+    def _apply(self, msg_type: int, entry: NeighborEntry) -> None:
+        if self.neighbors:
+            self.neighbors.apply(msg_type, entry)
+        if self.network and ipaddress.ip_address(entry.ip) not in self.network:
+            return
+
+        if msg_type == RTM_NEWNEIGH and entry.is_present and entry.mac:
+            self._mark_present(entry.ip, entry.mac)
+            return
+
+        mac = self._ip_owner.get(entry.ip)
+        if not mac:
+            return
+        if msg_type == RTM_DELNEIGH or entry.state & (NUD_FAILED | NUD_INCOMPLETE):
+            self._mark_gone(mac, entry.ip)
+        elif entry.state & NUD_STALE and self._devices.get(mac) == entry.ip:
+            if self.prober:
+                self._stale[mac] = entry.ip
+            else:
+                self._mark_gone(mac, entry.ip)
+
+    def _mark_present(self, ip: str, mac: str) -> None:
+        self._stale.pop(mac, None)
+
+        # 同一個 IP 換了一台裝置 -> 原本那台視為離開
+        old_owner = self._ip_owner.get(ip)
+        if old_owner and old_owner != mac:
+            self._mark_gone(old_owner, ip)
+
+        previous_ip = self._devices.get(mac)
+        if previous_ip == ip:
+            return
+        if previous_ip and self._ip_owner.get(previous_ip) == mac:
+            del self._ip_owner[previous_ip]
+
+        self._devices[mac] = ip
+        self._ip_owner[ip] = mac
+        self._emit("moved" if previous_ip else "appeared", ip, mac, previous_ip)
+
+    def _mark_gone(self, mac: str, ip: str) -> None:
+        if self._ip_owner.get(ip) == mac:
+            del self._ip_owner[ip]
+        # 舊 IP 的項目過期不代表裝置離開 (例如 DHCP 換了新 IP)
+        if self._devices.get(mac) != ip:
+            return
+        del self._devices[mac]
+        self._stale.pop(mac, None)
+        self._emit("gone", ip, mac)
+
+    def _emit(self, event: str, ip: str, mac: str, previous_ip: Optional[str] = None) -> None:
+        logger.info(f"[Presence] {event}: {mac} ({ip})")
+        self.events.put_nowait(PresenceEvent(event=event, ip=ip, mac=mac, previous_ip=previous_ip))
+
+    # --- STALE 裝置的後備探測 ---
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            if not self._stale:
+                continue
+            targets = dict(self._stale)
+            try:
+                answered = await self.prober.probe_async([(ip, mac) for mac, ip in targets.items()])
+            except Exception as e:
+                # 探測本身失敗 (不是裝置沒回應)：這一輪不判定任何人離線
+                logger.error(f"探測 STALE 裝置失敗，略過這一輪: {e}")
+                continue
+            for mac, ip in targets.items():
+                # 探測期間可能已經收到新事件，只處理狀態沒變的裝置
+                if ip not in answered and self._stale.get(mac) == ip:
+                    self._mark_gone(mac, ip)
@@ -1,59 +1,167 @@
 # src/network/registry.py
 
-from typing import List, Dict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, List, Dict, Optional
 from sqlalchemy.orm import Session
-from src.db.models import ARPScanResult, StudentRecord 
-from src.db.repositories import StudentRepository, ConnectionLogRepository
+from src.db.models import ARPScanResult, StudentRecord
+from src.db.repositories import StudentRepository, ConnectionLogRepository, DeviceLastSeenRepository
+
+# 多久把記憶體裡的 last_seen 批次寫回資料庫一次 (秒)
+HEARTBEAT_INTERVAL = 60
+# 超過幾秒沒看到裝置就結束 session (寫一筆 disconnected)
+SESSION_TIMEOUT = 45
+
+@dataclass
+class PresenceSession:
+    """一段連線 session：對應 connection_logs 裡的一筆紀錄"""
+    log_id: str
+    started_at: datetime  # 也是 connection_logs 的分區鍵 (timestamp)
+    ip: str
+    student_id: Optional[str]
+    last_seen: datetime
+    flushed: bool = True
+
+class PresenceTable:
+    """
+    記憶體中的在線表 (MAC -> 目前的 session)
+    跨掃描保存狀態，只有連線 / 斷線 / 換 IP 時才需要寫資料庫
+    """
+    def __init__(self):
+        self.sessions: Dict[str, PresenceSession] = {}
+        self.last_flush = datetime.utcnow()
 
 class StudentRegistryService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, presence: PresenceTable):
         self.db = db
+        self.presence = presence
         self.student_repo = StudentRepository() # Repository 不需要傳 db 進入 init
         self.log_repo = ConnectionLogRepository()
+        self.last_seen_repo = DeviceLastSeenRepository()
 
     def process_scan_results(self, scan_results: List[ARPScanResult]) -> Dict[str, int]:
         """
         比對掃描結果與學生名單
+        只在狀態轉換時寫入連線紀錄，其餘只更新記憶體中的 last_seen
+        整輪掃描的所有寫入 (新 session、斷線、心跳) 合併成一個 transaction
         """
+        now = datetime.utcnow()
+
         # 1. 取得所有註冊學生 (修正方法名稱)
         all_students = self.student_repo.get_all_students(self.db)
-        
+
         # 建立 MAC -> 學生物件 的快速查找表
         # 注意: 這裡假設 db model 屬性是 mac_address
         mac_map = {s.mac_address.lower(): s for s in all_students}
-        
+
         present_count = 0
         unknown_count = 0
+        new_logs = []
+        new_sessions = []
+        heartbeats = {}
+        last_seen_rows = []
 
         # 2. 遍歷掃描到的裝置
         for device in scan_results:
             mac_key = device.mac.lower()
             student = mac_map.get(mac_key)
-            
+            student_id = student.student_id if student else None
+
             if student:
                 # A. 是註冊學生
                 present_count += 1
-                # 寫入連線紀錄 (修正方法名稱與參數)
-                self.log_repo.create_log(
-                    db=self.db,
-                    mac_address=device.mac,
-                    ip_address=device.ip,
-                    status="connected",
-                    student_id=student.student_id
-                )
             else:
                 # B. 是陌生裝置
                 unknown_count += 1
-                self.log_repo.create_log(
-                    db=self.db,
-                    mac_address=device.mac,
-                    ip_address=device.ip,
-                    status="unknown",
-                    student_id=None
-                )
+
+            session = self.presence.sessions.get(mac_key)
+            if session and session.ip == device.ip and session.student_id == student_id:
+                # 還在線上，只更新心跳
+                session.last_seen = now
+                session.flushed = False
+                continue
+
+            # 新連線、換 IP、或剛完成註冊 -> 開一段新的 session
+            if session and not session.flushed:
+                heartbeats[session.log_id] = self._heartbeat(session)
+            new_logs.append({
+                "mac_address": device.mac,
+                "ip_address": device.ip,
+                "status": "connected" if student else "unknown",
+                "student_id": student_id,
+                "timestamp": now,
+                "last_seen": now
+            })
+            new_sessions.append((mac_key, device.ip, student_id))
+            last_seen_rows.append({
+                "mac_address": mac_key, "last_ip": device.ip, "last_seen": now,
+                "student_id": student_id, "connected": True
+            })
+
+        # 3. 超過 SESSION_TIMEOUT 沒出現的裝置 -> 寫一筆 disconnected 並結束 session
+        cutoff = now - timedelta(seconds=SESSION_TIMEOUT)
+        renewed = {mac for mac, _, _ in new_sessions}
+        expired = [
+            (mac, s) for mac, s in self.presence.sessions.items()
+            if s.last_seen < cutoff and mac not in renewed
+        ]
+        expired_macs = {mac for mac, _ in expired}
+        for mac, session in expired:
+            new_logs.append({
+                "mac_address": mac,
+                "ip_address": session.ip,
+                "status": "disconnected",
+                "student_id": session.student_id,
+                "last_seen": session.last_seen
+            })
+            last_seen_rows.append({
+                "mac_address": mac, "last_ip": session.ip, "last_seen": session.last_seen,
+                "student_id": session.student_id, "connected": False
+            })
+
+        # 4. 心跳：到了批次時間，或 session 即將結束，就把 last_seen 寫回
+        flush_all = now - self.presence.last_flush >= timedelta(seconds=HEARTBEAT_INTERVAL)
+        if flush_all:
+            for mac, s in self.presence.sessions.items():
+                if s.flushed or mac in renewed:
+                    continue
+                heartbeats[s.log_id] = self._heartbeat(s)
+                if mac not in expired_macs:
+                    last_seen_rows.append({
+                        "mac_address": mac, "last_ip": s.ip, "last_seen": s.last_seen,
+                        "student_id": s.student_id, "connected": True
+                    })
+        else:
+            heartbeats.update({s.log_id: self._heartbeat(s) for mac, s in expired if not s.flushed})
+
+        # 5. 一次寫入 (連線紀錄 + 最後出現位置)、一次 commit
+        log_ids = self.log_repo.create_logs(self.db, new_logs, commit=False)
+        self.log_repo.touch_logs(self.db, list(heartbeats.values()), commit=False)
+        self.last_seen_repo.upsert_many(self.db, last_seen_rows, commit=False)
+        if new_logs or heartbeats:
+            self.db.commit()
+
+        # DB 寫入成功後才更新記憶體狀態
+        for mac, session in expired:
+            del self.presence.sessions[mac]
+        for (mac_key, ip, student_id), log_id in zip(new_sessions, log_ids):
+            self.presence.sessions[mac_key] = PresenceSession(
+                log_id=log_id, started_at=now, ip=ip, student_id=student_id, last_seen=now
+            )
+        if flush_all:
+            for session in self.presence.sessions.values():
+                session.flushed = True
+            self.presence.last_flush = now
 
         return {
             "total_scanned": len(scan_results),
             "students_online": present_count,
-            "unknown_devices": unknown_count
+            "unknown_devices": unknown_count,
+            "sessions_opened": len(new_sessions),
+            "sessions_closed": len(expired)
         }
+
+    @staticmethod
+    def _heartbeat(session: PresenceSession) -> Dict[str, Any]:
+        # 帶上分區鍵 (timestamp)，UPDATE 只會碰到該 session 所在的分區
+        return {"id": session.log_id, "timestamp": session.started_at, "last_seen": session.last_seen}
@@ -1,8 +1,10 @@
 # src/network/scanner.py
+import asyncio
 import logging
 import scapy.config
+from concurrent.futures import ThreadPoolExecutor
 from scapy.all import ARP, Ether, srp
-from typing import List
+from typing import List, Optional, Set, Tuple
 from datetime import datetime
 
 # 引用你的 Pydantic 模型
@@ -19,6 +21,8 @@ class ARPScanner:
         :param interface: 網路介面名稱 (用 ip addr 確認你的介面，要是學生連上來的網卡)
         """
         self.interface = interface
+        # 專用的掃描執行緒 (只開一條，避免上一輪還沒掃完又疊一輪)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arp-scan")
 
     def scan(self, ip_range: str = "192.168.10.0/24") -> List[ARPScanResult]:
         """
@@ -60,6 +64,37 @@ class ARPScanner:
             logger.error(f"掃描發生錯誤: {e}")
             return []
 
+    async def scan_async(self, ip_range: str = "192.168.10.0/24") -> List[ARPScanResult]:
+        """
+        非同步版本的 ARP 掃描 (給 FastAPI 背景任務用)
+        srp() 會阻塞至少 timeout 秒，所以丟到專用執行緒執行，
+        event loop 在掃描期間仍可正常處理 /api/* 請求
+        :param ip_range: 要掃描的網段 (CIDR 格式)
+        :return: 掃描結果列表
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.scan, ip_range)
+
+    def probe(self, targets: List[Tuple[str, Optional[str]]], timeout: int = 1) -> Set[str]:
+        """
+        對指定的裝置發 ARP 請求，確認它們是否還在 (PresenceMonitor 的後備手段)
+        有已知 MAC 時直接單播，不用廣播打擾整個 AP
+        :param targets: [(IP, MAC 或 None), ...]
+        :return: 有回應的 IP 集合
+        :raises: 送不出封包時 (權限不足、網卡不存在 / 未啟用) 直接拋出例外，
+                 呼叫端要跳過這一輪，不能當成「全部都沒回應」
+        """
+        if not targets:
+            return set()
+        packets = [Ether(dst=mac or "ff:ff:ff:ff:ff:ff") / ARP(pdst=ip) for ip, mac in targets]
+        answered, unanswered = srp(packets, timeout=timeout, iface=self.interface, verbose=False)
+        return {received.psrc for sent, received in answered}
+
+    async def probe_async(self, targets: List[Tuple[str, Optional[str]]], timeout: int = 1) -> Set[str]:
+        """probe() 的非同步版本，一樣在掃描執行緒執行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.probe, targets, timeout)
+
 # --- 簡單測試區 (直接執行此檔案時會跑) ---
 if __name__ == "__main__":
     # 這裡的網段請改成你家裡/學校的真實網段，例如 192.168.0.0/24 或 10.0.2.0/24
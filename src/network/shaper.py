@@ -0,0 +1,200 @@
+# src/network/shaper.py
+"""
+限速 (tc HTB) 管理
+
+slow_down.sh 用 IP 最後一碼當 filter 的 prio：不同網段會撞號、最多 255 台，
+而且每個封包要線性走過所有 u32 filter。這裡改用 u32 雜湊表：
+    根 filter 只有一條，依目的 IP 最後一碼 (hashkey) 直接跳到 256 個 bucket 之一，
+    bucket 裡才用 /32 精確比對 (同一個最後一碼只會有少數幾台)
+所以不論限速 3 台還是 300 台，每個封包都只比對固定的幾條規則
+"""
+import asyncio
+import ipaddress
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 限速等級 -> 速率 (依序對應 HTB class 1:20, 1:21, ...)
+DEFAULT_TIERS = {
+    "slow": "256kbit",     # 同 slow_down.sh 的懲罰通道
+    "limited": "1mbit",
+    "crawl": "64kbit",
+}
+
+# u32 filter 的 prio 與雜湊表 handle
+_FILTER_PRIO = 5
+_HASH_TABLE = 2
+_MAX_NODE = 0xfff
+
+# tc filter show 的輸出：
+#   filter parent 1: protocol ip pref 5 u32 chain 0 fh 2:5:1 order 1 key ht 2 bkt 5 flowid 1:20 not_in_hw
+#     match 0a000005/ffffffff at 16
+_FILTER_HEAD = re.compile(rf"\bfh {_HASH_TABLE:x}:([0-9a-f]+):([0-9a-f]+) .*\bflowid (\S+)")
+_FILTER_MATCH = re.compile(r"^\s*match ([0-9a-f]{8})/ffffffff at 16")
+
+class TrafficShaper:
+    """
+    管理某張網卡的 HTB 樹與限速名單 (下載方向：比對目的 IP)
+
+    1:   htb root (default 1:10)
+    1:1  整條鏈路
+    1:10 正常通道
+    1:2x 各限速等級
+    """
+    def __init__(self, interface: str, tiers: Optional[Dict[str, str]] = None,
+                 link_rate: str = "100mbit", tc_path: str = "tc"):
+        self.interface = interface
+        self.tiers = dict(tiers or DEFAULT_TIERS)
+        self.link_rate = link_rate
+        self.tc_path = tc_path
+        self.class_ids = {name: f"1:{20 + i}" for i, name in enumerate(self.tiers)}
+        # IP -> (bucket, node, 等級)
+        self._entries: Dict[str, Tuple[int, int, str]] = {}
+
+    @property
+    def throttled(self) -> Dict[str, str]:
+        """目前限速中的 IP -> 等級"""
+        return {ip: tier for ip, (_, _, tier) in self._entries.items()}
+
+    def tier_of(self, ip: str) -> Optional[str]:
+        entry = self._entries.get(ip)
+        return entry[2] if entry else None
+
+    # --- 指令產生 ---
+
+    def render_setup(self) -> str:
+        """整棵 HTB 樹 + 雜湊表 (需先刪除舊的 root qdisc)"""
+        dev = f"dev {self.interface}"
+        lines = [
+            f"qdisc add {dev} root handle 1: htb default 10",
+            f"class replace {dev} parent 1: classid 1:1 htb rate {self.link_rate}",
+            f"class replace {dev} parent 1:1 classid 1:10 htb rate {self.link_rate}",
+        ]
+        for name, rate in self.tiers.items():
+            lines.append(f"class replace {dev} parent 1:1 classid {self.class_ids[name]} htb rate {rate} ceil {rate}")
+        lines += [
+            # 256 個 bucket 的雜湊表
+            f"filter add {dev} parent 1: prio {_FILTER_PRIO} handle {_HASH_TABLE}: protocol ip u32 divisor 256",
+            # 根 filter：取目的 IP (IP header offset 16) 的最後一個 byte 當 bucket
+            f"filter add {dev} parent 1: prio {_FILTER_PRIO} protocol ip u32 ht 800:: "
+            f"match ip dst 0.0.0.0/0 hashkey mask 0x000000ff at 16 link {_HASH_TABLE}:",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _filter_line(self, action: str, ip: str, bucket: int, node: int, tier: Optional[str] = None) -> str:
+        handle = f"{_HASH_TABLE:x}:{bucket:x}:{node:x}"
+        line = f"filter {action} dev {self.interface} parent 1: prio {_FILTER_PRIO} handle {handle} protocol ip u32"
+        if action == "del":
+            return line
+        return f"{line} ht {_HASH_TABLE:x}:{bucket:x}: match ip dst {ip}/32 flowid {self.class_ids[tier]}"
+
+    def _allocate_node(self, bucket: int, reserved: Iterable[int] = ()) -> int:
+        used = {node for b, node, _ in self._entries.values() if b == bucket} | set(reserved)
+        for node in range(1, _MAX_NODE + 1):
+            if node not in used:
+                return node
+        raise RuntimeError(f"bucket {bucket:x} 已滿")
+
+    # --- 操作 ---
+
+    def parse_filters(self, output: str) -> Dict[str, Tuple[int, int, str]]:
+        """從 tc filter show 的輸出取回雜湊表裡的限速名單 (IP -> (bucket, node, 等級))"""
+        tiers = {class_id: name for name, class_id in self.class_ids.items()}
+        entries = {}
+        head = None
+        for line in output.splitlines():
+            match = _FILTER_HEAD.search(line)
+            if match:
+                head = match
+                continue
+            match = _FILTER_MATCH.match(line)
+            if head and match and head.group(3) in tiers:
+                ip = str(ipaddress.IPv4Address(int(match.group(1), 16)))
+                entries[ip] = (int(head.group(1), 16), int(head.group(2), 16), tiers[head.group(3)])
+            head = None
+        return entries
+
+    async def load_existing(self) -> int:
+        """
+        把網卡上既有的限速名單讀回記憶體 (在 setup 之前呼叫)
+        防火牆代理自己重新啟動時，setup 重建 HTB 樹後會放回這些 IP
+        """
+        process = await asyncio.create_subprocess_exec(
+            self.tc_path, "filter", "show", "dev", self.interface, "parent", "1:",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        if process.returncode != 0:
+            return 0
+        self._entries.update(self.parse_filters(stdout.decode()))
+        if self._entries:
+            print(f"[Shaper] 沿用既有的限速名單: {len(self._entries)} 個 IP")
+        return len(self._entries)
+
+    async def setup(self) -> bool:
+        """建立 HTB 樹，並放回記憶體中已知的限速名單"""
+        # 先清掉舊的 root qdisc (連同 class / filter)；原本沒有時會失敗，忽略即可
+        await self._apply(f"qdisc del dev {self.interface} root\n", quiet=True)
+        script = self.render_setup()
+        script += "".join(self._filter_line("add", ip, bucket, node, tier) + "\n"
+                          for ip, (bucket, node, tier) in self._entries.items())
+        return await self._apply(script)
+
+    async def throttle(self, ip: str, tier: str = "slow") -> bool:
+        return await self.apply({ip: tier})
+
+    async def release(self, ip: str) -> bool:
+        return await self.apply({ip: None})
+
+    async def apply(self, changes: Dict[str, Optional[str]]) -> bool:
+        """
+        一次套用多筆變更 (一個 tc -batch)
+        :param changes: IP -> 限速等級，None 表示解除限速
+        """
+        lines: List[str] = []
+        updated: Dict[str, Optional[Tuple[int, int, str]]] = {}
+        reserved: Dict[int, List[int]] = {}
+        for ip, tier in changes.items():
+            if tier is not None and tier not in self.tiers:
+                raise ValueError(f"未知的限速等級: {tier}")
+            current = self._entries.get(ip)
+            if tier is None:
+                if current:
+                    lines.append(self._filter_line("del", ip, current[0], current[1]))
+                    updated[ip] = None
+            elif current:
+                if current[2] != tier:
+                    lines.append(self._filter_line("replace", ip, current[0], current[1], tier))
+                    updated[ip] = (current[0], current[1], tier)
+            else:
+                bucket = int(ipaddress.IPv4Address(ip)) & 0xff
+                node = self._allocate_node(bucket, reserved.get(bucket, ()))
+                reserved.setdefault(bucket, []).append(node)
+                lines.append(self._filter_line("add", ip, bucket, node, tier))
+                updated[ip] = (bucket, node, tier)
+        if not lines:
+            return True
+        if not await self._apply("\n".join(lines) + "\n"):
+            return False
+        for ip, entry in updated.items():
+            if entry is None:
+                self._entries.pop(ip, None)
+            else:
+                self._entries[ip] = entry
+        print(f"[Shaper] tc batch applied: {len(lines)} change(s)")
+        return True
+
+    async def _apply(self, script: str, quiet: bool = False) -> bool:
+        process = await asyncio.create_subprocess_exec(
+            self.tc_path, "-batch", "-",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate(script.encode())
+        if process.returncode != 0:
+            if quiet:
+                return False
+            print(f"[Shaper Error] tc -batch failed: {stderr.decode().strip()}")
+            return False
+        return True
@@ -2,10 +2,9 @@ import os
 import asyncio
 import logging
 import aiohttp
-import subprocess
 import uuid
 import sys
-from datetime import datetime, timezone
+from datetime import datetime, timedelta
 
 # Aiogram 核心
 from aiogram import Bot, Dispatcher, types, F
@@ -24,13 +23,17 @@ if parent_dir not in sys.path:
 
 # 資料庫引用
 from src.db.database import SessionLocal
-from src.db.models import StudentRecord, ConnectionLog, AuthorizationLog
+from src.db.models import StudentRecord
+from src.db.repositories import DeviceLastSeenRepository
+from src.network.neighbors import NeighborCache
 
 load_dotenv()
 
 # --- 設定區 ---
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://localhost:8000")
+# 與後端相同的共用密鑰 (呼叫 /api/network/activate、/api/payment/callback 時帶在 X-Backend-Secret)
+BACKEND_API_SECRET = os.getenv("BACKEND_API_SECRET", "")
 # 星星支付不需要 Token，留空
 PAYMENT_PROVIDER_TOKEN = os.getenv("PAYMENT_PROVIDER_TOKEN", "")
 
@@ -40,6 +43,8 @@ logger = logging.getLogger("kda_master_bot")
 
 if not BOT_TOKEN:
     raise ValueError("❌ 錯誤: 未設定 BOT_TOKEN，請檢查 .env 檔案")
+if not BACKEND_API_SECRET:
+    raise ValueError("❌ 錯誤: 未設定 BACKEND_API_SECRET (需與後端相同)，請檢查 .env 檔案")
 
 # 初始化 Bot 與 Dispatcher (加入 FSM 記憶體儲存)
 bot = Bot(token=BOT_TOKEN)
@@ -55,94 +60,55 @@ class Registration(StatesGroup):
 def get_db():
     return SessionLocal()
 
-def get_mac_address(ip):
+# IP -> MAC 對照 (kernel 鄰居表鏡像，啟動時開啟一次)
+neighbors = NeighborCache()
+last_seen_repo = DeviceLastSeenRepository()
+
+async def get_mac_address(ip):
     """
-    從系統 ARP 表查找 IP 對應的 MAC
-    (移植自 wifi_bot.py)
+    從鄰居表快取查找 IP 對應的 MAC
+    查不到時只針對這個 IP 補查 (向 kernel 要這筆紀錄、觸發 ARP 解析)，不重新載入整張表；
+    仍查不到 (例如鄰居表無法開啟) 再用後端掃描記下的最後位置
     """
-    try:
-        # 先 ping 一下確保 ARP 表有資料 (timeout 1秒)
-        subprocess.run(["ping", "-c", "1", "-W", "1", ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # 讀取 ARP 表
-        cmd = f"ip neigh show {ip}"
-        output = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
-        if "lladdr" in output:
-            parts = output.split()
-            try:
-                # 輸出格式通常是: 192.168.100.x dev eno1 lladdr aa:bb:cc:dd:ee:ff REACHABLE
-                return parts[parts.index("lladdr") + 1]
-            except ValueError:
-                pass
-        return "UNKNOWN"
-    except Exception as e:
-        logger.error(f"MAC 查找失敗: {e}")
-        return "UNKNOWN"
+    mac = await neighbors.resolve(ip)
+    if mac is None:
+        db = get_db()
+        try:
+            # 只接受最近還出現過的裝置，避免 IP 已經換人用
+            device = last_seen_repo.get_by_ip(db, ip, since=datetime.utcnow() - timedelta(minutes=10))
+            mac = device.mac_address if device else None
+        finally:
+            db.close()
+    return mac or "UNKNOWN"
 
-def activate_student_network(chat_id, student_record, ip_address):
+async def activate_student_network(chat_id, ip_address):
     """
-    啟用網路權限並寫入紀錄
-    (整合了 login.sh 的呼叫與資料庫寫入)
+    請後端開通網路 (寫入連線 / 授權紀錄、放行防火牆)
+    授權狀態由後端的 auth_service 維護，Bot 不直接寫 authorization_logs
     """
-    db = get_db()
-    try:
-        # 1. 寫入連線紀錄
-        new_conn = ConnectionLog(
-            id=str(uuid.uuid4()),
-            mac_address=student_record.mac_address,
-            ip_address=ip_address,
-            student_id=student_record.student_id,
-            status="connected",
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.add(new_conn)
-
-        # 2. 寫入授權紀錄
-        new_auth = AuthorizationLog(
-            id=str(uuid.uuid4()),
-            mac_address=student_record.mac_address,
-            status="active",
-            authorized_at=datetime.now(timezone.utc),
-            details={"source": "telegram_bot", "chat_id": str(chat_id)}
-        )
-        db.add(new_auth)
-        
-        # 3. 更新學生狀態為 online
-        db.query(StudentRecord).\
-            filter(StudentRecord.student_id == student_record.student_id).\
-            update({"status": "online"})
-            
-        db.commit()
-        logger.info(f"學生 {student_record.name} 資料庫狀態已更新為 Online")
-
-        # 4. 執行 Linux 開網腳本
-        # 請確保路徑正確，假設專案結構:
-        # root/
-        #   src/payment_local.py
-        #   lsa/login.sh
-        script_path = os.path.join(parent_dir, "LSA", "login.sh")
-        
-        if os.path.exists(script_path):
-            # 執行 sudo ./lsa/login.sh <IP>
-            subprocess.run(["sudo", script_path, ip_address])
-            return True, "✅ <b>網路已開通！</b>\n系統已放行您的裝置，請關閉此視窗，回到瀏覽器開始上網。"
-        else:
-            logger.error(f"找不到腳本: {script_path}")
-            return False, "⚠️ 找不到開網腳本，請聯繫管理員。"
-            
-    except Exception as e:
-        logger.error(f"開通失敗: {e}")
-        db.rollback()
+    success, resp = await notify_backend("network/activate", {
+        "telegram_id": str(chat_id),
+        "ip_address": ip_address
+    })
+    if not success:
+        logger.error(f"開通失敗: {resp}")
+        return False, "⚠️ 無法連線到系統，開通失敗，請聯繫管理員。"
+    if resp.get("status") == "error":
+        logger.error(f"開通失敗: {resp.get('message')}")
         return False, "⚠️ 系統錯誤，開通失敗。"
-    finally:
-        db.close()
+    if resp.get("status") == "warning":
+        logger.error(f"防火牆放行失敗: {resp.get('message')}")
+        return False, "⚠️ 無法連線到防火牆服務，請聯繫管理員。"
+    logger.info(f"Telegram ID {chat_id} 已開通網路: {resp.get('message')}")
+    return True, "✅ <b>網路已開通！</b>\n系統已放行您的裝置，請關閉此視窗，回到瀏覽器開始上網。"
 
 async def notify_backend(action: str, payload: dict):
     """通知後端 API (用於付款解鎖)"""
     url = f"{BACKEND_API_URL}/api/{action}"
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, timeout=10) as resp:
+            headers = {"X-Backend-Secret": BACKEND_API_SECRET}
+            async with session.post(url, json=payload, headers=headers, timeout=10) as resp:
                 if resp.status == 200:
                     return True, await resp.json()
                 else:
@@ -199,7 +165,7 @@ async def cmd_start(message: types.Message, command: CommandObject, state: FSMCo
             await message.answer(f"歡迎回來，{student.name}！\n正在為您開通網路...")
             
             # 更新 MAC (防止換手機)
-            current_mac = get_mac_address(user_ip)
+            current_mac = await get_mac_address(user_ip)
             if current_mac != "UNKNOWN" and current_mac != student.mac_address:
                 student.mac_address = current_mac
                 db.commit() # 更新 MAC
@@ -207,7 +173,7 @@ async def cmd_start(message: types.Message, command: CommandObject, state: FSMCo
             db.close()
             
             # 執行開通
-            success, msg = activate_student_network(user_id, student, user_ip)
+            success, msg = await activate_student_network(user_id, user_ip)
             await message.answer(msg, parse_mode="HTML")
             
         else:
@@ -215,7 +181,7 @@ async def cmd_start(message: types.Message, command: CommandObject, state: FSMCo
             db.close()
             
             # 檢查 MAC 是否抓得到 (確認有連上 Wi-Fi)
-            mac = get_mac_address(user_ip)
+            mac = await get_mac_address(user_ip)
             if mac == "UNKNOWN":
                 await message.answer("⚠️ <b>無法偵測到您的裝置</b>\n請確認您已連上教室 Wi-Fi 後，重新點擊網頁上的按鈕。", parse_mode="HTML")
                 return
@@ -273,7 +239,7 @@ async def process_name(message: types.Message, state: FSMContext):
         await message.answer(f"✅ 註冊成功！{name} ({student_id})")
         
         # 馬上開通
-        success, msg = activate_student_network(user_id, new_student, ip)
+        success, msg = await activate_student_network(user_id, ip)
         await message.answer(msg, parse_mode="HTML")
         
     except Exception as e:
@@ -313,4 +279,5 @@ async def success_payment(message: types.Message):
 # --- 啟動 ---
 if __name__ == "__main__":
     print("🤖 KDA 全能機器人 (Master Bot) 啟動中...")
+    neighbors.open()
     asyncio.run(dp.start_polling(bot))
\ No newline at end of file
@@ -0,0 +1,35 @@
+import grp
+import pwd
+
+from src.network import agent as agent_module
+from src.network.agent import FirewallAgent
+
+GID = 4242
+
+def make_agent(monkeypatch, members):
+    monkeypatch.setattr(agent_module.grp, "getgrnam", lambda name: grp.struct_group(("sg", "x", GID, [])))
+    monkeypatch.setattr(agent_module.grp, "getgrgid", lambda gid: grp.struct_group(("sg", "x", gid, members)))
+
+    def getpwuid(uid):
+        if uid == 1001:
+            return pwd.struct_passwd(("teacher", "x", 1001, 1001, "", "/home/teacher", "/bin/sh"))
+        raise KeyError(uid)
+
+    monkeypatch.setattr(agent_module.pwd, "getpwuid", getpwuid)
+    return FirewallAgent(None, allowed_uids=set(), group="sg")
+
+def test_primary_group_is_allowed(monkeypatch):
+    agent = make_agent(monkeypatch, [])
+    assert agent._in_group(2000, GID)
+
+def test_supplementary_group_member_is_allowed(monkeypatch):
+    agent = make_agent(monkeypatch, ["teacher"])
+    assert agent._in_group(1001, 1001)
+
+def test_other_users_are_rejected(monkeypatch):
+    agent = make_agent(monkeypatch, ["teacher"])
+    assert not agent._in_group(1002, 1002)
+    assert not make_agent(monkeypatch, [])._in_group(1001, 1001)
+
+def test_no_group_configured():
+    assert not FirewallAgent(None, allowed_uids=set(), group="")._in_group(1001, 1001)
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.core import auth_service as auth_module
+from src.core.auth_service import AuthorizationService
+from src.db.models import AuthorizationLog, Base
+from src.db.repositories import AuthorizationLogRepository
+from src.network.firewall import MockFirewallController
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(engine, tables=[AuthorizationLog.__table__])
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+async def test_unknown_mac_is_looked_up_once(db, monkeypatch):
+    repo = AuthorizationLogRepository()
+    service = AuthorizationService(repo, MockFirewallController())
+    service.load(db)
+    # 其他行程直接寫入的紀錄 (記憶體裡沒有)
+    repo.create_log(db, "AA:BB:CC:00:00:01", "authorized")
+    assert await service.is_authorized(db, "aa:bb:cc:00:00:01")
+
+    clock = [1000.0]
+    monkeypatch.setattr(auth_module.time, "monotonic", lambda: clock[0])
+    assert not await service.is_authorized(db, "aa:bb:cc:00:00:02")
+    repo.create_log(db, "aa:bb:cc:00:00:02", "authorized")
+    # 查不到的 MAC 隔 MISS_RECHECK_SECONDS 秒才再查
+    assert not await service.is_authorized(db, "aa:bb:cc:00:00:02")
+    clock[0] += auth_module.MISS_RECHECK_SECONDS
+    assert await service.is_authorized(db, "aa:bb:cc:00:00:02")
+
+async def test_revoke_updates_memory(db):
+    service = AuthorizationService(AuthorizationLogRepository(), MockFirewallController())
+    await service.authorize(db, "AA:BB:CC:00:00:01")
+    assert await service.is_authorized(db, "aa:bb:cc:00:00:01")
+    assert await service.revoke(db, "AA:BB:CC:00:00:01")
+    assert not await service.is_authorized(db, "aa:bb:cc:00:00:01")
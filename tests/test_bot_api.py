@@ -0,0 +1,43 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src import main
+from src.db.models import Base, StudentRecord
+
+@pytest.fixture
+def client(monkeypatch):
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[StudentRecord.__table__])
+    factory = sessionmaker(bind=engine)
+
+    def override_db():
+        db = factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = override_db
+    monkeypatch.setattr(main, "BACKEND_API_SECRET", "s3cret")
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+    engine.dispose()
+
+PAYLOAD = {"telegram_id": "12345", "ip_address": "192.168.10.5"}
+
+@pytest.mark.parametrize("path", ["/api/network/activate", "/api/payment/callback"])
+def test_bot_api_requires_secret(client, path):
+    assert client.post(path, json=PAYLOAD).status_code == 403
+    assert client.post(path, json=PAYLOAD, headers={"X-Backend-Secret": "wrong"}).status_code == 403
+    resp = client.post(path, json=PAYLOAD, headers={"X-Backend-Secret": "s3cret"})
+    assert resp.status_code == 200
+    # 密鑰正確才會查學生 (這個 telegram_id 沒有綁定)
+    assert resp.json()["status"] == "error"
+
+def test_bot_api_rejects_when_secret_not_configured(client, monkeypatch):
+    monkeypatch.setattr(main, "BACKEND_API_SECRET", "")
+    resp = client.post("/api/network/activate", json=PAYLOAD, headers={"X-Backend-Secret": ""})
+    assert resp.status_code == 403
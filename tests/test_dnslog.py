@@ -0,0 +1,190 @@
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.db.models import Base, DeviceLastSeen, StudentRecord
+from src.detection.dnslog import DnsLogTailer
+from src.detection.matcher import load_default
+from src.detection.service import ViolationDetector
+from src.network.firewall import MockFirewallController
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pihole.log")
+
+def write(path, text, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
+def line(second, domain, client):
+    return f"Oct 18 10:16:{second:02d} dnsmasq[812]: query[A] {domain} from {client}\n"
+
+# --- 解析 ---
+
+def test_parse_lines_plain_and_extra():
+    tailer = DnsLogTailer(FIXTURE)
+    queries = tailer.parse_lines([
+        "Oct 18 10:15:31 dnsmasq[812]: query[A] www.youtube.com from 192.168.10.5",
+        "Oct  8 09:00:01 dnsmasq[812]: query[AAAA] www.netflix.com from 192.168.10.6",
+        "Oct 18 10:15:34 dnsmasq[812]: 1042 192.168.10.8/51234 query[A] www.netflix.com from 192.168.10.8",
+    ])
+    assert [(client, domain) for _, client, domain in queries] == [
+        ("192.168.10.5", "www.youtube.com"),
+        ("192.168.10.6", "www.netflix.com"),
+        ("192.168.10.8", "www.netflix.com"),
+    ]
+    stamp = datetime.fromtimestamp(queries[0][0])
+    assert (stamp.month, stamp.day, stamp.hour, stamp.minute, stamp.second) == (10, 18, 10, 15, 31)
+    assert datetime.fromtimestamp(queries[1][0]).day == 8
+
+def test_parse_lines_skips_other_lines():
+    tailer = DnsLogTailer(FIXTURE)
+    assert tailer.parse_lines([
+        "Oct 18 10:15:30 dnsmasq[812]: forwarded www.google.com to 8.8.8.8",
+        "Oct 18 10:15:30 dnsmasq[812]: reply www.google.com is 142.250.196.196",
+        "Oct 18 10:15:38 dnsmasq[812]: gravity blocked ads.example.com is 0.0.0.0",
+        "not a log line query[A] x from y",
+        "",
+    ]) == []
+
+def test_replay_reads_last_line_without_newline():
+    tailer = DnsLogTailer(FIXTURE, from_start=True, follow=False)
+    tailer._open(at_end=False)
+    queries = [query for batch in tailer._read_available() for query in batch]
+    tailer._close()
+    assert len(queries) == 11
+    assert queries[-1][1:] == ("192.168.10.12", "i.ytimg.youtube.com")
+
+def test_follow_waits_for_end_of_line(tmp_path):
+    path = str(tmp_path / "pihole.log")
+    write(path, line(1, "a.youtube.com", "10.0.0.1") + line(2, "b.youtube.com", "10.0.0.1")[:-10], "w")
+    tailer = DnsLogTailer(path, from_start=True)
+    tailer._open(at_end=False)
+    assert [domain for batch in tailer._read_available() for _, _, domain in batch] == ["a.youtube.com"]
+    write(path, line(2, "b.youtube.com", "10.0.0.1")[-10:])
+    assert [domain for batch in tailer._read_available() for _, _, domain in batch] == ["b.youtube.com"]
+    tailer._close()
+
+# --- 輪替 ---
+
+def read_domains(tailer):
+    return [domain for batch in tailer._read_available() for _, _, domain in batch]
+
+def test_rotation_by_rename(tmp_path):
+    path = str(tmp_path / "pihole.log")
+    write(path, line(1, "old.example.com", "10.0.0.1"), "w")
+    tailer = DnsLogTailer(path)
+    tailer._open(at_end=True)
+    # 開始之後寫入舊檔、然後改名並建立新檔
+    write(path, line(2, "before-rotate.example.com", "10.0.0.1"))
+    os.rename(path, path + ".1")
+    tailer._check_rotation()
+    assert read_domains(tailer) == ["before-rotate.example.com"]
+    write(path, line(3, "new.example.com", "10.0.0.1"), "w")
+    write(path + ".1", line(3, "late.example.com", "10.0.0.1"))
+    tailer._check_rotation()
+    # 舊檔剩下的內容先讀完，再從新檔開頭開始
+    assert read_domains(tailer) == ["late.example.com", "new.example.com"]
+    tailer._close()
+
+def test_rotation_by_copytruncate(tmp_path):
+    path = str(tmp_path / "pihole.log")
+    write(path, line(1, "first.example.com", "10.0.0.1") + line(2, "second.example.com", "10.0.0.1"), "w")
+    tailer = DnsLogTailer(path, from_start=True)
+    tailer._open(at_end=False)
+    assert read_domains(tailer) == ["first.example.com", "second.example.com"]
+    inode = tailer._inode
+    write(path, line(3, "after.example.com", "10.0.0.1"), "w")
+    tailer._check_rotation()
+    assert tailer._inode == inode
+    assert read_domains(tailer) == ["after.example.com"]
+    tailer._close()
+
+def test_log_created_after_start(tmp_path):
+    path = str(tmp_path / "pihole.log")
+    tailer = DnsLogTailer(path)
+    assert not tailer._open(at_end=True)
+    write(path, line(1, "first.example.com", "10.0.0.1"), "w")
+    tailer._check_rotation()
+    assert read_domains(tailer) == ["first.example.com"]
+    tailer._close()
+
+# --- 重播 ---
+
+class FakeNeighbors:
+    def __init__(self, table):
+        self.table = table
+
+    def get_mac(self, ip):
+        return self.table.get(ip)
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[StudentRecord.__table__, DeviceLastSeen.__table__])
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add_all([
+        StudentRecord(id="1", student_id="s11", name="已處罰", mac_address="AA:00:00:00:00:11", p_status="PUNISHED"),
+        DeviceLastSeen(mac_address="aa:00:00:00:00:10", last_ip="192.168.10.10", last_seen=datetime.utcnow()),
+    ])
+    db.commit()
+    db.close()
+    yield factory
+    engine.dispose()
+
+async def test_replay_dry_run_offenders(session_factory):
+    neighbors = FakeNeighbors({
+        "192.168.10.5": "aa:00:00:00:00:05",
+        "192.168.10.6": "aa:00:00:00:00:06",
+        "192.168.10.7": "aa:00:00:00:00:07",
+        "192.168.10.8": "aa:00:00:00:00:08",
+        "192.168.10.11": "aa:00:00:00:00:11",
+        "192.168.10.12": "aa:00:00:00:00:12",
+    })
+    firewall = MockFirewallController()
+    source = DnsLogTailer(FIXTURE, from_start=True, follow=False)
+    detector = ViolationDetector(source, load_default(), firewall, neighbors, session_factory, dry_run=True)
+
+    punished = []
+    punish = detector.punish
+
+    async def record(offenders):
+        done = await punish(offenders)
+        punished.extend(done)
+        return done
+
+    detector.punish = record
+    await detector.run()
+
+    # .6 沒有違規網域、.7 遊戲不計分、.9 查不到 MAC、.11 已經是 PUNISHED；.10 由 device_last_seen 查到 MAC
+    # (同一批查詢裡的處罰順序不固定)
+    assert sorted(punished, key=lambda item: item[1]) == [
+        ("192.168.10.5", "aa:00:00:00:00:05", "VIDEO"),
+        ("192.168.10.8", "aa:00:00:00:00:08", "VIDEO"),
+        ("192.168.10.10", "aa:00:00:00:00:10", "VIDEO"),
+        ("192.168.10.12", "aa:00:00:00:00:12", "VIDEO"),
+    ]
+    # dry_run 不動資料庫
+    db = session_factory()
+    try:
+        assert db.query(StudentRecord).count() == 1
+    finally:
+        db.close()
+
+async def test_punish_reports_violation_count(session_factory):
+    db = session_factory()
+    db.add(StudentRecord(id="2", student_id="s05", name="學生", mac_address="AA:00:00:00:00:05", violation_count=2))
+    db.commit()
+    db.close()
+    reported = []
+    detector = ViolationDetector(DnsLogTailer(FIXTURE), load_default(), MockFirewallController(),
+                                 FakeNeighbors({"192.168.10.5": "aa:00:00:00:00:05",
+                                                "192.168.10.8": "aa:00:00:00:00:08"}),
+                                 session_factory, on_punished=lambda mac, count: reported.append((mac, count)))
+    done = await detector.punish([("192.168.10.5", "VIDEO"), ("192.168.10.8", "VIDEO")])
+    assert len(done) == 2
+    # 只有學生會回報 (.8 不在名單裡)
+    assert reported == [("aa:00:00:00:00:05", 3)]
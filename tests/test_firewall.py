@@ -0,0 +1,117 @@
+import asyncio
+import os
+
+from src.network.firewall import BatchingFirewallController, NftablesFirewallController
+
+FORWARD_RULES = """-P FORWARD ACCEPT
+-A FORWARD -s 192.168.10.0/24 -p udp -m udp --dport 53 -j ACCEPT
+-A FORWARD -s 192.168.10.5/32 -p udp -j DROP
+-A FORWARD -s 10.0.0.0/8 -j DROP
+-A FORWARD -s 192.168.10.0/24 -j DROP
+"""
+PREROUTING_RULES = """-P PREROUTING ACCEPT
+-A PREROUTING -s 192.168.10.0/24 -p tcp -m tcp --dport 80 -j DNAT --to-destination 192.168.10.1:81
+-A PREROUTING -p tcp -m tcp --dport 8080 -j DNAT --to-destination 192.168.10.1:81
+"""
+
+def fake_command(tmp_path, name, script):
+    path = tmp_path / name
+    path.write_text("#!/bin/sh\n" + script)
+    os.chmod(path, 0o755)
+    return str(path)
+
+def fake_iptables(tmp_path, forward=FORWARD_RULES, prerouting=PREROUTING_RULES):
+    (tmp_path / "FORWARD").write_text(forward)
+    (tmp_path / "PREROUTING").write_text(prerouting)
+    return fake_command(tmp_path, "iptables", f'cat "{tmp_path}/$4"\n')
+
+async def test_find_iptables_conflicts(tmp_path):
+    firewall = NftablesFirewallController("wlan0", "192.168.10.0/24", iptables_path=fake_iptables(tmp_path))
+    # 學生網段的 DROP (整個網段 / 單一學生) 與 port 80 的 DNAT；其他網段與放行規則不算
+    assert await firewall.find_iptables_conflicts() == [
+        "-A FORWARD -s 192.168.10.5/32 -p udp -j DROP",
+        "-A FORWARD -s 192.168.10.0/24 -j DROP",
+        "-A PREROUTING -s 192.168.10.0/24 -p tcp -m tcp --dport 80 -j DNAT --to-destination 192.168.10.1:81",
+    ]
+
+async def test_setup_refuses_with_iptables_leftovers(tmp_path):
+    nft_calls = tmp_path / "nft_calls"
+    nft = fake_command(tmp_path, "nft", f'cat >> "{nft_calls}"\n')
+    firewall = NftablesFirewallController("wlan0", "192.168.10.0/24", nft_path=nft,
+                                          iptables_path=fake_iptables(tmp_path))
+    assert not await firewall.setup()
+    assert not nft_calls.exists()
+
+    firewall.iptables_path = fake_iptables(tmp_path, forward="-P FORWARD ACCEPT\n", prerouting="")
+    assert await firewall.setup()
+    assert "table inet student_guard" in nft_calls.read_text()
+
+async def test_no_iptables_command(tmp_path):
+    firewall = NftablesFirewallController("wlan0", "192.168.10.0/24", iptables_path=str(tmp_path / "missing"))
+    assert await firewall.find_iptables_conflicts() == []
+
+# --- 批次交易 ---
+
+class RecordingBackend(NftablesFirewallController):
+    """不呼叫 nft：記錄每次套用的腳本，含有 broken 元素的腳本一律失敗"""
+    def __init__(self, broken=()):
+        super().__init__("wlan0", "192.168.10.0/24")
+        self.scripts = []
+        self.broken = set(broken)
+
+    async def _apply(self, script):
+        self.scripts.append(script)
+        return not any(element in script for element in self.broken)
+
+async def test_batch_coalesces_into_one_transaction():
+    backend = RecordingBackend()
+    firewall = BatchingFirewallController(backend)
+    results = await asyncio.gather(
+        firewall.allow_device("AA:00:00:00:00:01"),
+        firewall.allow_device("aa:00:00:00:00:02"),
+        firewall.block_game("192.168.10.5"),
+    )
+    assert results == [True, True, True]
+    [script] = backend.scripts
+    assert script.splitlines() == [
+        "add element inet student_guard allowed { aa:00:00:00:00:01, aa:00:00:00:00:02 }",
+        "add element inet student_guard game_blocked { 192.168.10.5 }",
+    ]
+    assert backend.allowed == {"aa:00:00:00:00:01", "aa:00:00:00:00:02"}
+
+async def test_superseded_change_reports_false():
+    backend = RecordingBackend()
+    firewall = BatchingFirewallController(backend)
+    # 同一批裡先 allow 再 deny：最後的狀態是「不在集合內」，allow 的呼叫端不能拿到 True
+    assert await asyncio.gather(
+        firewall.allow_device("aa:00:00:00:00:01"), firewall.deny_device("aa:00:00:00:00:01")
+    ) == [False, True]
+    assert backend.scripts == [] and not backend.allowed
+
+    assert await asyncio.gather(
+        firewall.allow_device("aa:00:00:00:00:01"),
+        firewall.deny_device("aa:00:00:00:00:01"),
+        firewall.allow_device("aa:00:00:00:00:01"),
+    ) == [True, False, True]
+    assert len(backend.scripts) == 1 and backend.is_allowed("aa:00:00:00:00:01")
+
+async def test_mirror_skips_unchanged_elements():
+    backend = RecordingBackend()
+    backend.allowed.add("aa:00:00:00:00:01")
+    firewall = BatchingFirewallController(backend)
+    assert await firewall.allow_device("AA:00:00:00:00:01")
+    assert await firewall.restore("192.168.10.5")
+    assert backend.scripts == []
+
+async def test_failed_batch_falls_back_to_single_changes():
+    backend = RecordingBackend(broken=["aa:00:00:00:00:02"])
+    firewall = BatchingFirewallController(backend)
+    results = await asyncio.gather(
+        firewall.allow_device("aa:00:00:00:00:01"),
+        firewall.allow_device("aa:00:00:00:00:02"),
+        firewall.allow_device("aa:00:00:00:00:03"),
+    )
+    # 整批失敗後逐筆重試：只有壞掉的那筆失敗
+    assert results == [True, False, True]
+    assert len(backend.scripts) == 4
+    assert backend.allowed == {"aa:00:00:00:00:01", "aa:00:00:00:00:03"}
@@ -0,0 +1,60 @@
+import socket
+import struct
+
+from src.network import neighbors as neighbors_module
+from src.network.neighbors import NeighborCache
+from src.network.netlink import (
+    NDA_DST, NDA_LLADDR, NLM_F_REQUEST, NUD_REACHABLE, RTM_GETNEIGH, RTM_NEWNEIGH, NeighborSocket, parse_messages,
+)
+
+def neighbor_message(ip, mac, ifindex=3):
+    dst = socket.inet_aton(ip)
+    lladdr = bytes(int(part, 16) for part in mac.split(":"))
+    payload = struct.pack("=BxxxiHBB", socket.AF_INET, ifindex, NUD_REACHABLE, 0, 0)
+    payload += struct.pack("=HH", 8, NDA_DST) + dst
+    payload += struct.pack("=HH", 10, NDA_LLADDR) + lladdr + b"\0\0"
+    return struct.pack("=LHHLL", 16 + len(payload), RTM_NEWNEIGH, 0, 0, 0) + payload
+
+class FakeSocket:
+    def __init__(self, replies=()):
+        self.sent = []
+        self.replies = list(replies)
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def read(self):
+        replies, self.replies = self.replies, []
+        return [entry for data in replies for entry in parse_messages(data)]
+
+def test_request_neighbor_message():
+    sock = NeighborSocket()
+    sock._sock = FakeSocket()
+    sock.request_neighbor("192.168.10.5", 3)
+    [data] = sock._sock.sent
+    length, msg_type, flags, _seq, _pid = struct.unpack_from("=LHHLL", data)
+    assert (length, msg_type, flags) == (len(data), RTM_GETNEIGH, NLM_F_REQUEST)
+    family, ifindex = struct.unpack_from("=Bxxxi", data, 16)
+    assert (family, ifindex) == (socket.AF_INET, 3)
+    assert struct.unpack_from("=HH", data, 28) == (8, NDA_DST)
+    assert data[32:36] == socket.inet_aton("192.168.10.5")
+
+async def test_resolve_asks_only_for_missing_ip(monkeypatch):
+    solicited = []
+    monkeypatch.setattr(neighbors_module, "_solicit", solicited.append)
+    cache = NeighborCache()
+    fake = FakeSocket([neighbor_message("192.168.10.5", "aa:bb:cc:dd:ee:01")])
+    cache._socket = fake
+    fake.ifindex = 3
+    requested = []
+    fake.request_neighbor = lambda ip, ifindex: requested.append((ip, ifindex))
+    # 排隊中的事件已經有這筆：不用補查
+    assert await cache.resolve("192.168.10.5") == "aa:bb:cc:dd:ee:01"
+    assert requested == [] and solicited == []
+    # 查不到：只問這一個 IP，逾時回傳 None
+    assert await cache.resolve("192.168.10.6", timeout=0.1) is None
+    assert requested == [("192.168.10.6", 3)]
+    assert solicited == ["192.168.10.6"]
+
+async def test_resolve_without_socket():
+    assert await NeighborCache().resolve("192.168.10.5") is None
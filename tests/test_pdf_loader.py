@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from src.ai import pdf_loader as loader_module
+from src.ai.pdf_extract import extract_pages
+from src.ai.pdf_loader import PAGES_PER_TASK, PageChunker, PDFLoader
+
+def make_pdf(pages):
+    """產生每頁一段文字的最小 PDF (Helvetica，不需要額外套件)"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = b"".join(b"(%s) Tj T* " % line.encode() for line in lines)
+        stream = b"BT /F1 10 Tf 12 TL 20 800 Td " + text + b"ET"
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return data
+
+def lecture(name, page_count=6):
+    return [[f"{name} page {page} line {line} lorem ipsum dolor sit amet" for line in range(12)]
+            for page in range(page_count)]
+
+# 子行程 (spawn) 以模組路徑載入這兩個函式
+
+def crash(*_args):
+    os._exit(1)
+
+def fail_after_first_task(file_path, start, end):
+    if start > 0:
+        raise RuntimeError("頁面解析失敗")
+    return extract_pages(file_path, start, end)
+
+@pytest.fixture
+def loader(tmp_path):
+    loader = PDFLoader(storage_dir=str(tmp_path / "uploads"), max_workers=1, cache_dir=str(tmp_path / "cache"))
+    yield loader
+    loader.shutdown()
+
+def part_files(loader):
+    return [name for name in os.listdir(loader.storage_dir) if name.endswith(".part")]
+
+async def upload(loader, content, filename):
+    job = await loader.submit(content, filename)
+    if job.task:
+        await job.task
+    return job
+
+async def test_upload_reports_progress(loader):
+    pages = lecture("week1")
+    job = await upload(loader, make_pdf(pages), "week1.pdf")
+    assert job.to_dict() | {"job": None} == {
+        "job": None, "filename": "week1.pdf", "status": "done", "pages_done": 6, "pages_total": 6,
+        "chunks": len(loader.knowledge_base), "error": None, "duplicate_of": None,
+    }
+    # 分成多個子行程工作，片段仍與整份依序切片相同
+    assert job.pages_total > PAGES_PER_TASK
+    chunker = PageChunker()
+    expected = [chunk for lines in pages for chunk in chunker.feed("\n".join(lines))] + chunker.finish()
+    assert loader.knowledge_base == expected
+    assert os.path.exists(os.path.join(loader.storage_dir, "week1.pdf")) and part_files(loader) == []
+
+    # 重新啟動：直接讀快取
+    reloaded = PDFLoader(storage_dir=loader.storage_dir, cache_dir=loader.cache.cache_dir)
+    assert reloaded.knowledge_base == expected
+
+async def test_failed_reupload_keeps_original(loader):
+    original = make_pdf(lecture("week1"))
+    await upload(loader, original, "week1.pdf")
+    chunks = list(loader.knowledge_base)
+
+    job = await upload(loader, b"%PDF-1.4 broken", "week1.pdf")
+    assert job.status == "failed" and job.error and job.chunks == 0
+    with open(os.path.join(loader.storage_dir, "week1.pdf"), "rb") as f:
+        assert f.read() == original
+    assert loader.knowledge_base == chunks
+    assert part_files(loader) == []
+
+async def test_failed_task_rolls_back_added_chunks(loader, monkeypatch):
+    await upload(loader, make_pdf(lecture("week1")), "week1.pdf")
+    chunks = list(loader.knowledge_base)
+    monkeypatch.setattr(loader_module, "extract_pages", fail_after_first_task)
+    job = await upload(loader, make_pdf(lecture("week2")), "week2.pdf")
+    # 第一批頁面的片段已經加入知識庫，失敗後全部移除
+    assert job.status == "failed" and job.pages_done == PAGES_PER_TASK
+    assert loader.knowledge_base == chunks
+    assert "week2.pdf" not in loader.documents
+    assert not os.path.exists(os.path.join(loader.storage_dir, "week2.pdf"))
+
+async def test_duplicate_upload(loader):
+    content = make_pdf(lecture("week1"))
+    first = await loader.submit(content, "week1.pdf")
+    # 還在解析中的相同內容
+    in_flight = await loader.submit(content, "copy.pdf")
+    await first.task
+    assert (in_flight.status, in_flight.duplicate_of) == ("duplicate", "week1.pdf")
+    # 已經存下來的相同內容
+    stored = await upload(loader, content, "again.pdf")
+    assert (stored.status, stored.duplicate_of) == ("duplicate", "week1.pdf")
+    assert sorted(os.listdir(loader.storage_dir)) == ["week1.pdf"]
+    assert len(loader.knowledge_base) == first.chunks
+
+async def test_broken_pool_is_recreated(loader, monkeypatch):
+    monkeypatch.setattr(loader_module, "count_pages", crash)
+    job = await upload(loader, make_pdf(lecture("week1")), "week1.pdf")
+    assert job.status == "failed" and loader._pool is None
+    monkeypatch.undo()
+    job = await upload(loader, make_pdf(lecture("week1")), "week1.pdf")
+    assert job.status == "done" and job.chunks == len(loader.knowledge_base)
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from src.core.roster import RosterSnapshot
+
+def rows(status_online=True, violations=0):
+    last_seen = datetime.utcnow() if status_online else None
+    return [("s01", "學生", "AA:00:00:00:00:01", violations, True, last_seen)]
+
+def test_apply_updates_before_refresh():
+    roster = RosterSnapshot()
+    roster.refresh(rows())
+    cursor = roster.version
+    before, after = roster.apply("aa:00:00:00:00:01", status="offline")
+    assert (before["status"], after["status"]) == ("online", "offline")
+    assert roster.changes_since(cursor) == ([after], [])
+    # 同樣的狀態不再回報
+    assert roster.apply("AA:00:00:00:00:01", status="offline") is None
+    assert roster.apply("aa:00:00:00:00:99", status="offline") is None
+
+def test_refresh_does_not_repeat_applied_change():
+    roster = RosterSnapshot()
+    roster.refresh(rows())
+    roster.apply("aa:00:00:00:00:01", violation_count=1)
+    assert roster.refresh(rows(violations=1)) == []
+    # 資料庫跟直接推播的不一致時，以資料庫為準
+    [(before, after)] = roster.refresh(rows(status_online=False, violations=1))
+    assert (before["status"], after["status"]) == ("online", "offline")
@@ -0,0 +1,97 @@
+import math
+
+from hypothesis import given, settings, strategies as st
+
+from src.detection.scoring import ScoreBoard
+
+HALF_LIFE = 240
+MAX_SCORE = 50
+TTL = 1200
+
+times = st.floats(min_value=0, max_value=10000, allow_nan=False, allow_infinity=False)
+amounts = st.floats(min_value=0, max_value=60, allow_nan=False, allow_infinity=False)
+gaps = st.floats(min_value=0, max_value=60, allow_nan=False, allow_infinity=False)
+
+def close(a, b):
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+def eager(hits, min_gap, now):
+    """對照組：每次加分前逐筆衰減，並記下最後一次加分的時間"""
+    score, updated, hit_at = 0.0, None, None
+    for t, amount in hits:
+        if updated is not None:
+            score *= 0.5 ** ((t - updated) / HALF_LIFE)
+        if hit_at is None or t - hit_at >= min_gap:
+            score = min(score + amount, MAX_SCORE)
+            hit_at = t
+        updated = t
+    if updated is None:
+        return 0.0
+    return score * 0.5 ** ((now - updated) / HALF_LIFE)
+
+@given(st.lists(st.tuples(times, amounts), max_size=30), gaps, st.floats(min_value=0, max_value=5000))
+def test_lazy_decay_matches_eager(hits, min_gap, later):
+    hits = sorted(hits)
+    board = ScoreBoard(HALF_LIFE, MAX_SCORE, TTL, min_gap=min_gap)
+    for t, amount in hits:
+        board.hit("10.0.0.1", "video", amount, t)
+    now = (hits[-1][0] if hits else 0) + later
+    assert close(board.score("10.0.0.1", "video", now), eager(hits, min_gap, now))
+
+@given(times, amounts, st.floats(min_value=0, max_value=5000))
+def test_score_halves_every_half_life(t, amount, elapsed):
+    board = ScoreBoard(HALF_LIFE, MAX_SCORE, TTL)
+    board.hit("10.0.0.1", "video", amount, t)
+    now = t + elapsed
+    assert close(board.score("10.0.0.1", "video", now + HALF_LIFE), board.score("10.0.0.1", "video", now) / 2)
+
+@given(st.lists(times, min_size=1, max_size=30), st.floats(min_value=1, max_value=60))
+def test_min_gap_counts_spaced_hits_once(hit_times, min_gap):
+    # 不衰減：分數就是加分次數
+    board = ScoreBoard(math.inf, math.inf, TTL, min_gap=min_gap)
+    hit_times = sorted(hit_times)
+    expected, last = 0, None
+    for t in hit_times:
+        board.hit("10.0.0.1", "video", 1, t)
+        if last is None or t - last >= min_gap:
+            expected, last = expected + 1, t
+    assert board.score("10.0.0.1", "video", hit_times[-1]) == expected
+
+@given(times, st.floats(min_value=1, max_value=60), st.floats(min_value=0, max_value=120))
+def test_reset_keeps_hit_time(t, min_gap, delay):
+    board = ScoreBoard(HALF_LIFE, MAX_SCORE, TTL, min_gap=min_gap)
+    board.hit("10.0.0.1", "video", 21, t)
+    board.reset("10.0.0.1", ["video", "game"])
+    assert board.score("10.0.0.1", "video", t) == 0
+    # 處罰後 min_gap 內的查詢不會馬上又加分
+    later = t + delay
+    score = board.hit("10.0.0.1", "video", 21, later)
+    assert score == (21 if later - t >= min_gap else 0)
+    assert len(board) == 1
+
+@settings(max_examples=300)
+@given(st.lists(st.tuples(st.integers(0, 5), st.sampled_from(["video", "game"]), times), max_size=40),
+       st.floats(min_value=0, max_value=3000))
+def test_evict_out_of_order(hits, later):
+    board = ScoreBoard(HALF_LIFE, MAX_SCORE, TTL, min_gap=10)
+    # 對照組：紀錄時間 = 最後一次加分時看過的最大時間戳 (不往回走)
+    clock, stamped, newest = -math.inf, {}, {}
+    for client, category, t in hits:
+        board.hit(client, category, 21, t)
+        clock = max(clock, t)
+        stamped[(client, category)] = clock
+        newest[(client, category)] = max(newest.get((client, category), -math.inf), t)
+        assert 0 <= board.score(client, category, clock) <= MAX_SCORE
+
+    now = (clock if hits else 0) + later
+    evicted = board.evict(now)
+    alive = {key for key, updated in stamped.items() if updated >= now - TTL}
+    assert evicted == len(stamped) - len(alive)
+    assert len(board) == len(alive)
+    # 閥值內還有查詢的紀錄一定留著
+    for key, t in newest.items():
+        if t >= now - TTL:
+            assert key in alive
+    # 全部過期後清空
+    board.evict(now + TTL + 1)
+    assert len(board) == 0
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.db.models import Base, StudentRecord, ViolationDaily, ViolationEvent
+from src.db.violations import ViolationEventWriter
+
+START = datetime(2026, 10, 18, 2, 0)
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[
+        StudentRecord.__table__, ViolationEvent.__table__, ViolationDaily.__table__,
+    ])
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(StudentRecord(id="1", student_id="s01", name="學生", mac_address="AA:00:00:00:00:01"))
+    db.commit()
+    db.close()
+    yield factory
+    engine.dispose()
+
+def query(session_factory, model, order_by):
+    db = session_factory()
+    try:
+        return db.query(model).order_by(order_by).all()
+    finally:
+        db.close()
+
+def add(writer, minutes, mac="aa:00:00:00:00:01", category="VIDEO"):
+    writer.add(mac, "192.168.10.5", category, "throttle", occurred_at=START + timedelta(minutes=minutes))
+
+async def test_daily_count_adds_up_across_flushes(session_factory):
+    writer = ViolationEventWriter(session_factory)
+    for minutes in (0, 1, 2):
+        add(writer, minutes)
+    assert await writer.flush() == 3
+    add(writer, 10)
+    assert await writer.flush() == 1
+
+    [daily] = query(session_factory, ViolationDaily, ViolationDaily.day)
+    assert (daily.student_id, daily.category, daily.count) == ("s01", "VIDEO", 4)
+    assert (daily.first_at, daily.last_at) == (START, START + timedelta(minutes=10))
+    events = query(session_factory, ViolationEvent, ViolationEvent.occurred_at)
+    assert [event.student_id for event in events] == ["s01"] * 4
+
+async def test_unregistered_device_has_no_student(session_factory):
+    writer = ViolationEventWriter(session_factory)
+    # 大寫 MAC 也對得到學生；沒註冊的裝置只留事件、不計入每日彙總
+    add(writer, 0, mac="AA:00:00:00:00:01")
+    add(writer, 1, mac="AA:00:00:00:00:99", category="GAME")
+    assert await writer.flush() == 2
+
+    events = query(session_factory, ViolationEvent, ViolationEvent.occurred_at)
+    assert [(event.mac_address, event.student_id) for event in events] == [
+        ("aa:00:00:00:00:01", "s01"),
+        ("aa:00:00:00:00:99", None),
+    ]
+    daily = query(session_factory, ViolationDaily, ViolationDaily.day)
+    assert [(row.student_id, row.count) for row in daily] == [("s01", 1)]
+
+async def test_buffer_is_bounded_while_database_fails(session_factory, monkeypatch):
+    writer = ViolationEventWriter(session_factory, max_buffer=5)
+
+    def fail(db, events):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(writer.repo, "add_events", fail)
+    for minutes in range(3):
+        add(writer, minutes)
+    assert await writer.flush() == 0
+    for minutes in range(3, 7):
+        add(writer, minutes)
+    assert await writer.flush() == 0
+    # 失敗的事件放回緩衝區，超過上限時丟掉最舊的
+    assert [event["occurred_at"] for event in writer._buffer] == [START + timedelta(minutes=m) for m in range(2, 7)]
+
+    monkeypatch.undo()
+    assert await writer.flush() == 5
+    assert writer._buffer == []
+    assert query(session_factory, ViolationDaily, ViolationDaily.day)[0].count == 5
+
+async def test_stop_flushes_remaining_events(session_factory):
+    writer = ViolationEventWriter(session_factory, flush_interval=3600)
+    writer.start()
+    add(writer, 0)
+    add(writer, 1)
+    await writer.stop()
+    assert writer._task is None
+    assert len(query(session_factory, ViolationEvent, ViolationEvent.occurred_at)) == 2